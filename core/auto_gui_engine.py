@@ -7,124 +7,3402 @@ import numpy as np
 import os
 import sys
 import ctypes
+import contextlib
+import threading
+import hashlib
+import json
+import atexit
+import socket
+import subprocess
+import tempfile
+from multiprocessing import shared_memory
 from PIL import Image
-from typing import Dict, List, Tuple, Optional, Any
-from collections import defaultdict
+from typing import Dict, List, Tuple, Optional, Any, Callable
+from collections import defaultdict, OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 # ==============================================================================
 # Logging Setup
 # ==============================================================================
-if not os.path.exists('logs'):
-    os.makedirs('logs')
+# 以 --ocr-worker 執行的背景 worker 不建立 logs/ 檔案 (它的 stdout/stderr 也已導向 DEVNULL)
+_OCR_WORKER_PROCESS = __name__ == "__main__" and sys.argv[1:2] == ["--ocr-worker"]
 
-log_filename = f"logs/lite_agent_{time.strftime('%Y%m%d_%H%M%S')}.log"
+if _OCR_WORKER_PROCESS:
+    log_filename = None
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(message)s',
+                        handlers=[logging.StreamHandler()])
+else:
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)-8s | %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(log_filename, encoding='utf-8')
-    ]
-)
+    log_filename = f"logs/lite_agent_{time.strftime('%Y%m%d_%H%M%S')}.log"
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s | %(levelname)-8s | %(message)s',
+        handlers=[
+            logging.StreamHandler(),
+            logging.FileHandler(log_filename, encoding='utf-8')
+        ]
+    )
 logger = logging.getLogger("LiteEngine")
-logger.info(f"🚀 Lite Engine started (OCR removed). Logs: {log_filename}")
+if not _OCR_WORKER_PROCESS:
+    logger.info(f"🚀 Lite Engine started. Logs: {log_filename}")
+
+# ==============================================================================
+# 1. Vision System (IMAGE MATCHING; OCR runs in a separate worker process)
+# ==============================================================================
+class Preprocessor:
+    """
+    灰階影像的前處理管線。每個步驟以字串表示, 例如 "blur:3"、"canny:50:150"、"binary:otsu"、"invert"、"equalize"。
+    一條管線的 key (mode) 就是步驟以 "|" 串接, 空管線為 "gray"; 畫面端與模板端共用同一組 key。
+    """
+    OPS = ("blur", "canny", "binary", "invert", "equalize")
+
+    @staticmethod
+    def steps_for(feature: Dict) -> Tuple[str, ...]:
+        """
+        由 feature 設定取得前處理步驟: edge_filter / canny_thresholds 為舊寫法的簡寫, preprocess 為完整寫法。
+        設定錯誤 (缺少 op / 未知步驟) 一律丟出指明 target 的 ValueError。
+        """
+        target = feature.get("path") or feature.get("text") or feature.get("type")
+        steps = []
+        for step in feature.get("preprocess", []) or []:
+            if isinstance(step, dict):
+                op = step.get("op")
+                if not op:
+                    raise ValueError(f"preprocess step {step} of '{target}' has no 'op'")
+                args = [str(step[k]) for k in ("ksize", "low", "high", "thresh") if k in step]
+                step = ":".join([op] + args)
+            steps.append(str(step))
+        if feature.get("edge_filter", False) and not any(st.startswith("canny") for st in steps):
+            low, high = feature.get("canny_thresholds", [50, 150])
+            steps.append(f"canny:{low}:{high}")
+        for st in steps:
+            if st.split(":")[0] not in Preprocessor.OPS:
+                raise ValueError(f"Unknown preprocess step '{st}' of '{target}'")
+        return tuple(steps)
+
+    @staticmethod
+    def key(steps: Tuple[str, ...]) -> str:
+        return "|".join(steps) if steps else "gray"
+
+    @staticmethod
+    def apply(img: np.ndarray, step: str) -> np.ndarray:
+        op, *args = step.split(":")
+        if op == "blur":
+            k = int(args[0]) if args else 3
+            return cv2.GaussianBlur(img, (k | 1, k | 1), 0)
+        if op == "canny":
+            low, high = (int(args[0]), int(args[1])) if len(args) >= 2 else (50, 150)
+            return cv2.Canny(img, low, high)
+        if op == "binary":
+            if not args or args[0] == "otsu":
+                return cv2.threshold(img, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+            return cv2.threshold(img, int(args[0]), 255, cv2.THRESH_BINARY)[1]
+        if op == "invert":
+            return cv2.bitwise_not(img)
+        if op == "equalize":
+            return cv2.equalizeHist(img)
+        raise ValueError(f"Unknown preprocess step: {step}")
+
+    @classmethod
+    def run(cls, img: np.ndarray, steps: Tuple[str, ...]) -> np.ndarray:
+        for step in steps:
+            img = cls.apply(img, step)
+        return img
+
+
+class TemplateCache:
+    """預處理模板快取: (path, mtime, scale, mode) -> 可直接比對的 numpy array (LRU + 記憶體上限)"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, mtime_check_interval: float = 1.0):
+        self.max_bytes = max_bytes
+        self.mtime_check_interval = mtime_check_interval
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._mtimes: Dict[str, Tuple[float, float]] = {}  # path -> (mtime, last_checked)
+        self._lock = threading.RLock()   # 背景 watcher 與主流程會同時存取
+
+    def _mtime(self, path: str) -> float:
+        """節流 stat 呼叫: 穩態下不碰檔案系統, 每 mtime_check_interval 秒才確認一次檔案是否被改過"""
+        now = time.monotonic()
+        cached = self._mtimes.get(path)
+        if cached and now - cached[1] < self.mtime_check_interval:
+            return cached[0]
+        mtime = os.path.getmtime(path)  # 檔案不存在時拋出 FileNotFoundError
+        if cached and cached[0] != mtime:
+            self._purge(path)
+        self._mtimes[path] = (mtime, now)
+        return mtime
+
+    def _purge(self, path: str):
+        for key in [k for k in self._entries if k[0] == path]:
+            self.current_bytes -= self._entries.pop(key).nbytes
+
+    def _put(self, key: tuple, arr: np.ndarray):
+        self._entries[key] = arr
+        self.current_bytes += arr.nbytes
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _source(self, path: str, mtime: float) -> np.ndarray:
+        """原始 RGB 解碼結果, 同樣放在 LRU 內 (不計入 hit/miss)"""
+        key = (path, mtime, 1.0, "rgb")
+        src = self._entries.get(key)
+        if src is None:
+            src = np.array(Image.open(path).convert("RGB"))
+            self._put(key, src)
+        else:
+            self._entries.move_to_end(key)
+        return src
+
+    def _build(self, path: str, mtime: float, scale: float, mode: str) -> Optional[np.ndarray]:
+        src = self._source(path, mtime)
+        h, w = src.shape[:2]
+        new_w, new_h = int(w * scale), int(h * scale)
+        if new_w == 0 or new_h == 0:
+            return None
+        if (new_w, new_h) != (w, h):
+            src = np.array(Image.fromarray(src).resize((new_w, new_h), Image.LANCZOS))
+        if mode == "rgb":
+            return src
+        if mode == "hist":
+            return color_histogram(src)
+        gray = cv2.cvtColor(src, cv2.COLOR_RGB2GRAY)
+        if mode == "gray":
+            return gray
+        return Preprocessor.run(gray, tuple(mode.split("|")))
+
+    def get(self, path: str, scale: float = 1.0, mode: str = "gray") -> Optional[np.ndarray]:
+        """取得縮放 + 預處理完成的模板; 縮放後尺寸為 0 時回傳 None"""
+        with self._lock:
+            mtime = self._mtime(path)
+            key = (path, mtime, round(scale, 4), mode)
+            arr = self._entries.get(key)
+            if arr is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return arr
+            self.misses += 1
+            arr = self._build(path, mtime, scale, mode)
+            if arr is not None:
+                self._put(key, arr)
+            return arr
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def color_histogram(rgb: np.ndarray) -> np.ndarray:
+    """RGB 各 8 階量化後的 512-bin 像素計數 (色彩預篩用)"""
+    return cv2.calcHist([np.ascontiguousarray(rgb)], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256]).ravel()
+
+
+def _clip_rect(rect: Tuple[int, int, int, int], bounds: Tuple[int, int, int, int]) -> Optional[Tuple[int, int, int, int]]:
+    """將 rect 裁切到 bounds 之內 (皆為 x, y, w, h); 無交集時回傳 None"""
+    x1, y1 = max(rect[0], bounds[0]), max(rect[1], bounds[1])
+    x2 = min(rect[0] + rect[2], bounds[0] + bounds[2])
+    y2 = min(rect[1] + rect[3], bounds[1] + bounds[3])
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def _rect_contains(outer: Tuple[int, int, int, int], inner: Tuple[int, int, int, int]) -> bool:
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and inner[0] + inner[2] <= outer[0] + outer[2] and inner[1] + inner[3] <= outer[1] + outer[3])
+
+
+def _union_rect(rects: List[Optional[Tuple[int, int, int, int]]]) -> Optional[Tuple[int, int, int, int]]:
+    """多個 ROI 的外接矩形; 任一 ROI 為 None (= 全螢幕) 時回傳 None"""
+    if not rects or any(r is None for r in rects):
+        return None
+    x1 = min(r[0] for r in rects)
+    y1 = min(r[1] for r in rects)
+    x2 = max(r[0] + r[2] for r in rects)
+    y2 = max(r[1] + r[3] for r in rects)
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+class Frame:
+    """單次擷取的畫面: 灰階只轉換一次, 各 ROI 以 zero-copy view 的方式共用"""
+
+    def __init__(self, rgb: np.ndarray, origin: Tuple[int, int] = (0, 0), timestamp: Optional[float] = None):
+        self.rgb = rgb
+        self.origin = origin
+        self.timestamp = time.time() if timestamp is None else timestamp   # 擷取開始的時間
+        self._gray = None
+        self._derived: Dict[tuple, np.ndarray] = {}   # (ROI rect, 前處理步驟) -> 結果, 同一張畫面內共用
+        self.text_indexes: List["TextIndex"] = []      # 這張畫面上已做過 OCR 的區域
+
+    @property
+    def rect(self) -> Tuple[int, int, int, int]:
+        return (self.origin[0], self.origin[1], self.rgb.shape[1], self.rgb.shape[0])
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+        return self._gray
+
+    def contains(self, roi: Optional[Tuple[int, int, int, int]], screen_size: Tuple[int, int]) -> bool:
+        """畫面是否涵蓋 ROI 在螢幕內的部分 (roi=None 代表全螢幕)"""
+        want = _clip_rect(roi, (0, 0, *screen_size)) if roi else (0, 0, *screen_size)
+        return want is None or _rect_contains(self.rect, want)
+
+    def view(self, roi: Optional[Tuple[int, int, int, int]], gray: bool = True) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
+        """回傳 ROI 的 numpy view 以及該 view 左上角的螢幕座標; ROI 落在畫面外時回傳 (None, ...)"""
+        src = self.gray if gray else self.rgb
+        rect = _clip_rect(roi, self.rect) if roi else self.rect
+        if rect is None:
+            return None, (roi[0], roi[1])
+        x, y = rect[0] - self.origin[0], rect[1] - self.origin[1]
+        return src[y:y + rect[3], x:x + rect[2]], (rect[0], rect[1])
+
+    def processed(self, roi: Optional[Tuple[int, int, int, int]], steps: Tuple[str, ...]) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
+        """ROI 經前處理後的影像; 每個前綴節點 (例如 blur -> blur|canny) 在同一張畫面只計算一次"""
+        view, offset = self.view(roi)
+        if view is None or not steps:
+            return view, offset
+        rect = (offset[0], offset[1], view.shape[1], view.shape[0])
+        img = view
+        for i in range(len(steps)):
+            key = (rect, steps[:i + 1])
+            cached = self._derived.get(key)
+            if cached is None:
+                cached = Preprocessor.apply(img, steps[i])
+                self._derived[key] = cached
+            img = cached
+        return img, offset
+
+
+class CaptureBackend:
+    """擷取後端: grab(region) 回傳 RGB uint8 (H, W, 3); region 為 (x, y, w, h), None 代表全螢幕"""
+
+    name = "base"
+
+    def grab(self, region: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PyAutoGuiCapture(CaptureBackend):
+    """預設後端: pyautogui.screenshot (Linux 上經 PIL / scrot), 呼叫時才查找函式以便工具 mock"""
+
+    name = "pyautogui"
+
+    def grab(self, region=None) -> np.ndarray:
+        img = pyautogui.screenshot(region=region)
+        return np.asarray(img.convert("RGB") if img.mode != "RGB" else img)
+
+
+class MssCapture(CaptureBackend):
+    """mss 後端 (選用套件): 直接讀取 BGRA 原始緩衝區, 只做一次 BGRA -> RGB 轉換"""
+
+    name = "mss"
+
+    def __init__(self):
+        import mss   # 選用相依, 未安裝時由 create_capture_backend 退回 pyautogui
+        self._mss = mss
+        # mss 實例不可跨執行緒共用 (Linux 上各自持有 X 連線)
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+        self._sct()   # 先連線一次: 沒有 display 時在建立階段就失敗, 而不是第一次擷取才失敗
+
+    def _sct(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            # mss 10 起以 MSS 取代 mss.mss()
+            sct = (getattr(self._mss, "MSS", None) or self._mss.mss)()
+            self._local.sct = sct
+            with self._lock:
+                self._instances.append(sct)
+        return sct
+
+    def grab(self, region=None) -> np.ndarray:
+        sct = self._sct()
+        if region:
+            monitor = {"left": int(region[0]), "top": int(region[1]), "width": int(region[2]), "height": int(region[3])}
+        else:
+            monitor = sct.monitors[0]
+        shot = sct.grab(monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        return cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGB)
+
+    def close(self):
+        with self._lock:
+            for sct in self._instances:
+                try:
+                    sct.close()
+                except Exception:
+                    pass
+            self._instances.clear()
+
+
+class _XImage(ctypes.Structure):
+    # 只宣告會讀寫到的前段欄位 (經由指標存取, 後段的 masks / funcs 不需要)
+    _fields_ = [
+        ("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int), ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int), ("bitmap_unit", ctypes.c_int),
+        ("bitmap_bit_order", ctypes.c_int), ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int),
+        ("bytes_per_line", ctypes.c_int), ("bits_per_pixel", ctypes.c_int),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int), ("shmaddr", ctypes.c_void_p), ("readOnly", ctypes.c_int)]
+
+
+class XShmCapture(CaptureBackend):
+    """
+    X11 MIT-SHM 後端 (ctypes, 不需額外套件): X server 直接把畫面寫進共享記憶體,
+    共享區以 numpy view 讀取, 每種擷取尺寸保留一塊可重複使用的區段。可在 Xvfb 下運作。
+    """
+
+    name = "xshm"
+    _ZPIXMAP = 2
+    _IPC_PRIVATE, _IPC_CREAT, _IPC_RMID = 0, 0o1000, 0
+    _error_handler = None   # X error handler 為行程全域, 保留參考避免被回收
+
+    def __init__(self, display: Optional[str] = None, max_segments: int = 4):
+        import ctypes.util
+        if not (display or os.environ.get("DISPLAY")):
+            raise RuntimeError("DISPLAY 未設定")
+        x11 = ctypes.CDLL(ctypes.util.find_library("X11") or "libX11.so.6")
+        xext = ctypes.CDLL(ctypes.util.find_library("Xext") or "libXext.so.6")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        vp, ul, ci = ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int
+        x11.XOpenDisplay.argtypes, x11.XOpenDisplay.restype = [ctypes.c_char_p], vp
+        x11.XDefaultScreen.argtypes, x11.XDefaultScreen.restype = [vp], ci
+        x11.XRootWindow.argtypes, x11.XRootWindow.restype = [vp, ci], ul
+        x11.XDefaultVisual.argtypes, x11.XDefaultVisual.restype = [vp, ci], vp
+        x11.XDefaultDepth.argtypes, x11.XDefaultDepth.restype = [vp, ci], ci
+        x11.XDisplayWidth.argtypes, x11.XDisplayWidth.restype = [vp, ci], ci
+        x11.XDisplayHeight.argtypes, x11.XDisplayHeight.restype = [vp, ci], ci
+        x11.XSync.argtypes, x11.XSync.restype = [vp, ci], ci
+        x11.XDestroyImage.argtypes, x11.XDestroyImage.restype = [ctypes.POINTER(_XImage)], ci
+        x11.XCloseDisplay.argtypes, x11.XCloseDisplay.restype = [vp], ci
+        xext.XShmQueryExtension.argtypes, xext.XShmQueryExtension.restype = [vp], ci
+        xext.XShmCreateImage.argtypes = [vp, vp, ctypes.c_uint, ci, ctypes.c_char_p, ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmAttach.argtypes, xext.XShmAttach.restype = [vp, ctypes.POINTER(_XShmSegmentInfo)], ci
+        xext.XShmDetach.argtypes, xext.XShmDetach.restype = [vp, ctypes.POINTER(_XShmSegmentInfo)], ci
+        xext.XShmGetImage.argtypes, xext.XShmGetImage.restype = [vp, ul, ctypes.POINTER(_XImage), ci, ci, ul], ci
+        libc.shmget.argtypes, libc.shmget.restype = [ci, ctypes.c_size_t, ci], ci
+        libc.shmat.argtypes, libc.shmat.restype = [ci, vp, ci], vp
+        libc.shmdt.argtypes, libc.shmdt.restype = [vp], ci
+        libc.shmctl.argtypes, libc.shmctl.restype = [ci, ci, vp], ci
+        self._x11, self._xext, self._libc = x11, xext, libc
+
+        self._display = x11.XOpenDisplay(display.encode() if display else None)
+        if not self._display:
+            raise RuntimeError(f"無法開啟 X display {display or os.environ.get('DISPLAY')}")
+        try:
+            if not xext.XShmQueryExtension(self._display):
+                raise RuntimeError("X server 不支援 MIT-SHM")
+            screen = x11.XDefaultScreen(self._display)
+            self._root = x11.XRootWindow(self._display, screen)
+            self._visual = x11.XDefaultVisual(self._display, screen)
+            self._depth = x11.XDefaultDepth(self._display, screen)
+            if self._depth not in (24, 32):
+                raise RuntimeError(f"不支援的色彩深度 {self._depth}")
+            self.size = (x11.XDisplayWidth(self._display, screen), x11.XDisplayHeight(self._display, screen))
+        except Exception:
+            x11.XCloseDisplay(self._display)
+            raise
+        self._install_error_handler(x11)
+        self.max_segments = max(1, int(max_segments))
+        self._segments: "OrderedDict[Tuple[int, int], tuple]" = OrderedDict()   # (w, h) -> (image, info, view)
+        # Xlib 連線不可多執行緒同時使用 (watcher 與主流程)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _install_error_handler(cls, x11):
+        # 預設 handler 遇到 X error 會直接結束行程; 改為記錄後交由 XShmGetImage 的回傳值處理
+        if cls._error_handler is not None:
+            return
+        handler_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+
+        def _on_error(_display, _event):
+            logger.warning("      ⚠️ X11 capture error (ignored)")
+            return 0
+
+        cls._error_handler = handler_type(_on_error)
+        x11.XSetErrorHandler.argtypes, x11.XSetErrorHandler.restype = [handler_type], ctypes.c_void_p
+        x11.XSetErrorHandler(cls._error_handler)
+
+    def _segment(self, w: int, h: int) -> tuple:
+        seg = self._segments.get((w, h))
+        if seg is not None:
+            self._segments.move_to_end((w, h))
+            return seg
+        while len(self._segments) >= self.max_segments:
+            self._release(self._segments.popitem(last=False)[1])
+        info = _XShmSegmentInfo()
+        image = self._xext.XShmCreateImage(self._display, self._visual, self._depth, self._ZPIXMAP, None, ctypes.byref(info), w, h)
+        if not image:
+            raise RuntimeError("XShmCreateImage 失敗")
+        ximg = image.contents
+        if ximg.bits_per_pixel != 32:
+            self._x11.XDestroyImage(image)
+            raise RuntimeError(f"不支援的像素格式 {ximg.bits_per_pixel} bpp")
+        size = ximg.bytes_per_line * ximg.height
+        shmid = self._libc.shmget(self._IPC_PRIVATE, size, self._IPC_CREAT | 0o600)
+        if shmid < 0:
+            self._x11.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmget 失敗")
+        addr = self._libc.shmat(shmid, None, 0)
+        if addr in (None, ctypes.c_void_p(-1).value):
+            self._libc.shmctl(shmid, self._IPC_RMID, None)
+            self._x11.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmat 失敗")
+        info.shmid, info.shmaddr, info.readOnly = shmid, addr, 0
+        ximg.data = addr
+        attached = self._xext.XShmAttach(self._display, ctypes.byref(info))
+        self._x11.XSync(self._display, 0)
+        # 雙方都 attach 後先標記刪除: 行程結束 (即使異常) 時區段自動回收
+        self._libc.shmctl(shmid, self._IPC_RMID, None)
+        if not attached:
+            self._libc.shmdt(addr)
+            self._x11.XDestroyImage(image)
+            raise RuntimeError("XShmAttach 失敗")
+        buf = (ctypes.c_uint8 * size).from_address(addr)
+        view = np.ndarray((h, w, 4), dtype=np.uint8, buffer=buf, strides=(ximg.bytes_per_line, 4, 1))
+        seg = (image, info, view)
+        self._segments[(w, h)] = seg
+        return seg
+
+    def _release(self, seg: tuple):
+        image, info, _ = seg
+        self._xext.XShmDetach(self._display, ctypes.byref(info))
+        self._x11.XSync(self._display, 0)
+        # shm image 的 destroy 只釋放 XImage 結構, 共享區另外 shmdt
+        self._x11.XDestroyImage(image)
+        self._libc.shmdt(info.shmaddr)
+
+    def grab(self, region=None) -> np.ndarray:
+        x, y, w, h = (int(v) for v in region) if region else (0, 0, *self.size)
+        with self._lock:
+            if self._display is None:
+                raise RuntimeError("capture backend 已關閉")
+            image, _, view = self._segment(w, h)
+            if not self._xext.XShmGetImage(self._display, self._root, image, x, y, 0xFFFFFFFF):
+                raise RuntimeError(f"XShmGetImage 失敗: {(x, y, w, h)}")
+            # 共享區下一次擷取就會被覆寫, 轉成 RGB 時同時產生 Frame 自己的陣列
+            return cv2.cvtColor(view, cv2.COLOR_BGRA2RGB)
+
+    def close(self):
+        with self._lock:
+            if self._display is None:
+                return
+            while self._segments:
+                self._release(self._segments.popitem()[1])
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+
+
+CAPTURE_BACKENDS: Dict[str, Callable[[], CaptureBackend]] = {
+    "pyautogui": PyAutoGuiCapture,
+    "xshm": XShmCapture,
+    "mss": MssCapture,
+}
+
+
+def benchmark_capture_backends(names: Optional[List[str]] = None, rounds: int = 5,
+                               region_size: Tuple[int, int] = (320, 240)) -> Dict[str, Dict[str, Any]]:
+    """
+    在目前主機上實測各擷取後端: 全螢幕與 ROI 擷取的平均延遲 (ms)。
+    無法初始化或擷取失敗的後端記錄 error。回傳 {name: {"full_ms", "region_ms"} 或 {"error"}}
+    """
+    sw, sh = FrameGrabber.screen_size()
+    rw, rh = min(region_size[0], sw), min(region_size[1], sh)
+    region = ((sw - rw) // 2, (sh - rh) // 2, rw, rh)
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names or list(CAPTURE_BACKENDS):
+        try:
+            backend = CAPTURE_BACKENDS[name]()
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            continue
+        try:
+            backend.grab(None)   # 暖機: 連線 / 配置共享記憶體不計入
+            backend.grab(region)
+            timings = {}
+            for label, target in (("full_ms", None), ("region_ms", region)):
+                t0 = time.perf_counter()
+                for _ in range(rounds):
+                    backend.grab(target)
+                timings[label] = round((time.perf_counter() - t0) * 1000 / rounds, 2)
+            results[name] = timings
+        except Exception as e:
+            results[name] = {"error": str(e)}
+        finally:
+            backend.close()
+    return results
+
+
+def _capture_cost(timing: Dict[str, Any]) -> float:
+    # tick 多數擷取 ROI 聯集, 偶爾升級成全螢幕: 兩者平均作為排序依據
+    return (timing["full_ms"] + timing["region_ms"]) / 2
+
+
+def select_capture_backend(cache_dir: Optional[str] = "cache/capture", rebenchmark: bool = False) -> str:
+    """
+    回傳本機最快且可用的擷取後端名稱。結果依 主機 + DISPLAY + 解析度 快取,
+    之後的執行直接沿用; rebenchmark=True 時強制重新量測。
+    """
+    import platform
+    size = FrameGrabber.screen_size()
+    host_key = f"{platform.node()}|{sys.platform}|{os.environ.get('DISPLAY', '')}|{size[0]}x{size[1]}"
+    cache_file = None
+    if cache_dir:
+        digest = hashlib.sha1(host_key.encode("utf-8")).hexdigest()[:12]
+        cache_file = os.path.join(cache_dir, f"capture_{digest}.json")
+    if cache_file and not rebenchmark and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("host") == host_key and cached.get("backend") in CAPTURE_BACKENDS:
+                timing = cached.get("results", {}).get(cached["backend"], {})
+                logger.info(f"      📸 Capture backend (cached): {cached['backend']} "
+                            f"full={timing.get('full_ms')}ms region={timing.get('region_ms')}ms")
+                return cached["backend"]
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Capture benchmark cache unreadable, re-benchmarking: {e}")
+
+    results = benchmark_capture_backends()
+    usable = {name: t for name, t in results.items() if "error" not in t}
+    for name, t in results.items():
+        if "error" in t:
+            logger.info(f"      📸 {name:<10} unavailable: {t['error']}")
+        else:
+            logger.info(f"      📸 {name:<10} full={t['full_ms']}ms region={t['region_ms']}ms")
+    best = min(usable, key=lambda n: _capture_cost(usable[n])) if usable else "pyautogui"
+    logger.info(f"      📸 Capture backend selected: {best}")
+    if cache_file:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, "w", encoding="utf-8") as f:
+                json.dump({"host": host_key, "backend": best, "results": results,
+                           "benchmarked_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"⚠️ Capture benchmark cache save failed: {e}")
+    return best
+
+
+def create_capture_backend(name: Optional[str], cache_dir: Optional[str] = "cache/capture") -> CaptureBackend:
+    """
+    依名稱建立擷取後端; "auto" 先實測 (或讀快取) 選出最快的後端。
+    未知名稱或環境不支援 (沒有 X display / 未安裝 mss) 時退回 pyautogui
+    """
+    name = (name or "pyautogui").lower()
+    if name == "auto":
+        name = select_capture_backend(cache_dir)
+    factory = CAPTURE_BACKENDS.get(name)
+    if factory is None:
+        logger.warning(f"      ⚠️ Unknown capture backend '{name}', using pyautogui")
+        return PyAutoGuiCapture()
+    try:
+        backend = factory()
+    except Exception as e:
+        logger.warning(f"      ⚠️ Capture backend '{name}' unavailable ({e}), using pyautogui")
+        return PyAutoGuiCapture()
+    if backend.name != "pyautogui":
+        atexit.register(backend.close)
+        logger.info(f"      📸 Capture backend: {backend.name}")
+    return backend
+
+
+class FrameGrabber:
+    """畫面擷取層: 每個 engine tick 只截一次圖 (全螢幕或 ROI 聯集), 供所有 feature / scale / anchor / branch 共用"""
+
+    def __init__(self, backend: Optional[CaptureBackend] = None):
+        self.backend = backend or PyAutoGuiCapture()
+        self.captures = 0
+        self.capture_ms = 0.0
+        self.last_capture_ms = 0.0
+        self._recent = deque(maxlen=120)    # 最近的擷取時間點, 用來估計實際 FPS
+        # tick 狀態以執行緒區分, 背景 watcher 與主流程各自持有自己的畫面
+        self._local = threading.local()
+        # 背景 watcher 啟動時掛上: live_source(since) 回傳 since 之後擷取的畫面 (或 None)
+        self.live_source: Optional[Callable[[float], Optional[Frame]]] = None
+
+    @property
+    def current(self) -> Optional[Frame]:
+        return getattr(self._local, "current", None)
+
+    @property
+    def thread_capture_ms(self) -> float:
+        """目前執行緒累計的擷取耗時 (偵測 telemetry 以前後差值計算單次偵測的擷取成本)"""
+        return getattr(self._local, "capture_ms", 0.0)
+
+    @staticmethod
+    def screen_size() -> Tuple[int, int]:
+        w, h = pyautogui.size()
+        return (w, h)
+
+    def capture(self, region: Optional[Tuple[int, int, int, int]] = None) -> Frame:
+        if region:
+            region = _clip_rect(region, (0, 0, *self.screen_size())) or region
+        started = time.time()
+        t0 = time.perf_counter()
+        rgb = self.backend.grab(region)
+        elapsed = (time.perf_counter() - t0) * 1000
+        self.captures += 1
+        self.capture_ms += elapsed
+        self.last_capture_ms = elapsed
+        self._local.capture_ms = self.thread_capture_ms + elapsed
+        self._recent.append(started)
+        return Frame(rgb, origin=(region[0], region[1]) if region else (0, 0), timestamp=started)
+
+    def stats(self) -> Dict[str, Any]:
+        """擷取延遲與 FPS: max_fps 為單純擷取的理論上限, fps 為最近實際的擷取頻率"""
+        recent = list(self._recent)
+        span = recent[-1] - recent[0] if len(recent) > 1 else 0.0
+        avg = self.capture_ms / self.captures if self.captures else 0.0
+        return {
+            "backend": self.backend.name,
+            "captures": self.captures,
+            "avg_ms": round(avg, 2),
+            "last_ms": round(self.last_capture_ms, 2),
+            "max_fps": round(1000.0 / avg, 1) if avg else 0.0,
+            "fps": round((len(recent) - 1) / span, 1) if span > 0 else 0.0,
+        }
+
+    @contextlib.contextmanager
+    def tick(self, rois: Optional[List[Optional[Tuple[int, int, int, int]]]] = None, frame: Optional[Frame] = None):
+        """
+        開啟一個 tick: 期間內的 detect 共用同一張畫面; 巢狀呼叫時沿用外層的畫面。
+        frame 可指定 tick 要使用的既有畫面 (例如 watcher 的 ring buffer)。
+        """
+        st = self._local
+        if getattr(st, "depth", 0) == 0:
+            st.current = frame
+            st.tick_region = _union_rect(rois) if rois else None
+            st.started = time.time()
+            st.depth = 0
+        st.depth += 1
+        try:
+            yield self
+        finally:
+            st.depth -= 1
+            if st.depth == 0:
+                st.current = None
+                st.tick_region = None
+
+    def frame_for(self, roi: Optional[Tuple[int, int, int, int]]) -> Frame:
+        st = self._local
+        if getattr(st, "depth", 0) == 0:
+            # 不在 tick 內 (例如工具直接呼叫 detect): 只擷取該 ROI
+            return self.capture(roi)
+        size = self.screen_size()
+        if st.current is None and self.live_source is not None:
+            # watcher 運作中: 直接取 tick 開始之後的最新畫面, 不另外截圖
+            st.current = self.live_source(st.started)
+        if st.current is None:
+            region = st.tick_region
+            want = _clip_rect(roi, (0, 0, *size)) if roi else None
+            if region is not None and (want is None or not _rect_contains(region, want)):
+                region = None
+            st.current = self.capture(region)
+        elif not st.current.contains(roi, size):
+            # ROI 超出本 tick 擷取範圍 (例如 anchor 偏移後的 ROI): 升級為全螢幕
+            st.current = self.capture(None)
+        return st.current
+
+
+class MatcherPool:
+    """
+    cv2.matchTemplate 執行時會釋放 GIL: 以 thread pool 平行處理 (features × scales) 的比對批次。
+    在 worker 內再次呼叫 map/submit 會直接同步執行, 避免巢狀等待造成死結。
+    """
+
+    def __init__(self, workers: int = 4):
+        self.workers = max(1, int(workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="matcher") if self.workers > 1 else None
+        self._local = threading.local()
+
+    @property
+    def parallel(self) -> bool:
+        return self._executor is not None and not getattr(self._local, "active", False)
+
+    def _run(self, fn, *args):
+        self._local.active = True
+        try:
+            return fn(*args)
+        finally:
+            self._local.active = False
+
+    def submit(self, fn, *args) -> Future:
+        if not self.parallel:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._executor.submit(self._run, fn, *args)
+
+    def map(self, fn, items: List) -> List:
+        if not self.parallel or len(items) < 2:
+            return [fn(item) for item in items]
+        return [f.result() for f in [self._executor.submit(self._run, fn, item) for item in items]]
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class KeypointMatcher:
+    """
+    type: "keypoints" 的特徵點比對 (ORB / AKAZE / SIFT): 尺度不變, 一次比對即可由 similarity 變換求出中心與縮放比例,
+    不需要 scale sweep。模板的描述子只計算一次並快取; 同一張畫面、同一個 ROI 的描述子也只計算一次。
+    """
+
+    DETECTORS = {
+        "orb": lambda: cv2.ORB_create(nfeatures=1500),
+        "akaze": lambda: cv2.AKAZE_create() if hasattr(cv2, "AKAZE_create") else None,
+        "sift": lambda: cv2.SIFT_create() if hasattr(cv2, "SIFT_create") else None,
+    }
+
+    def __init__(self, templates: "TemplateCache"):
+        self.templates = templates
+        self.template_padding = 32
+        self._lock = threading.Lock()
+        self._local = threading.local()       # cv2 detector 物件不保證 thread-safe, 每個執行緒各自建立
+        self._descriptors: Dict[tuple, tuple] = {}   # (path, detector) -> (gray 模板, keypoints, descriptors)
+        self.stats = {"calls": 0, "hits": 0, "rejected": 0, "template_builds": 0, "total_ms": 0.0}
+
+    def _detector(self, name: str):
+        cache = getattr(self._local, "detectors", None)
+        if cache is None:
+            cache = self._local.detectors = {}
+        if name not in cache:
+            factory = self.DETECTORS.get(name)
+            if factory is None:
+                raise ValueError(f"unknown keypoint detector '{name}'")
+            det = factory()
+            if det is None:
+                logger.warning(f"      ⚠️ Keypoint detector '{name}' not available in this OpenCV build, falling back to ORB")
+                det = self.DETECTORS["orb"]()
+            cache[name] = det
+        return cache[name]
+
+    @staticmethod
+    def _norm(det) -> int:
+        # ORB / AKAZE 為二進位描述子 (Hamming), SIFT 為浮點 (L2)
+        return cv2.NORM_L2 if det.descriptorType() == cv2.CV_32F else cv2.NORM_HAMMING
+
+    def template_features(self, path: str, detector: str) -> tuple:
+        gray = self.templates.get(path, 1.0, "gray")   # 檔案更新 / 被 LRU 淘汰時會拿到新的 array, 描述子跟著重算
+        key = (path, detector)
+        with self._lock:
+            cached = self._descriptors.get(key)
+            if cached is not None and cached[0] is gray:
+                return cached
+        # ORB 不在距邊界 edgeThreshold 內取點: 小型 UI 模板先以邊緣像素外擴, 否則幾乎取不到特徵點
+        pad = self.template_padding
+        padded = cv2.copyMakeBorder(gray, pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+        kps, des = self._detector(detector).detectAndCompute(padded, None)
+        pts = np.float32([kp.pt for kp in kps]) - pad if kps else np.zeros((0, 2), np.float32)
+        entry = (gray, pts, des)
+        with self._lock:
+            self._descriptors[key] = entry
+            self.stats["template_builds"] += 1
+        return entry
+
+    def frame_features(self, frame: "Frame", roi, detector: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Tuple[int, int]]:
+        view, offset = frame.view(roi)
+        if view is None or view.size == 0:
+            return None, None, offset
+        key = ((offset[0], offset[1], view.shape[1], view.shape[0]), ("kp:" + detector,))
+        cached = frame._derived.get(key)
+        if cached is None:
+            kps, des = self._detector(detector).detectAndCompute(view, None)
+            pts = np.float32([kp.pt for kp in kps]) if kps else np.zeros((0, 2), np.float32)
+            cached = frame._derived[key] = (pts, des)
+        return cached[0], cached[1], offset
+
+    @staticmethod
+    def _similarity_scale(H: np.ndarray, w: int, h: int, max_anisotropy: float,
+                          max_rotation: float = 10.0) -> Optional[float]:
+        """
+        UI 元件在畫面上只會等比縮放 + 平移; 翻轉 (det <= 0)、明顯的非等比 / 歪斜、透視變形或旋轉
+        超過 max_rotation 度都是錯配, 回傳 None。合理時回傳縮放比例。
+        """
+        if not np.all(np.isfinite(H)) or abs(H[2, 2]) < 1e-9:
+            return None
+        H = H / H[2, 2]
+        if abs(H[2, 0]) * w + abs(H[2, 1]) * h > 0.05:
+            return None
+        A = H[:2, :2]
+        if np.linalg.det(A) <= 0:
+            return None
+        s_max, s_min = np.linalg.svd(A, compute_uv=False)
+        if s_min <= 0 or s_max / s_min > max_anisotropy:
+            return None
+        if abs(np.degrees(np.arctan2(A[1, 0] - A[0, 1], A[0, 0] + A[1, 1]))) > max_rotation:
+            return None
+        return float(np.sqrt(s_max * s_min))
+
+    def match(self, frame: "Frame", roi, path: str, detector: str = "orb", ratio: float = 0.75,
+              min_matches: int = 10, min_inliers: int = 8, scale_range: Tuple[float, float] = (0.5, 2.0),
+              max_anisotropy: float = 1.25, min_ncc: float = 0.5) -> Optional[Dict[str, Any]]:
+        """
+        回傳 {"center", "scale", "score", "inliers", "matches", "ncc"} (螢幕座標), 比對點不足時回傳 None。
+        score = RANSAC inlier 比例, 由呼叫端以 confidence 判斷是否命中。
+        變換必須是 scale_range 內的等比縮放, inlier 至少 min_inliers 個,
+        且反投影回模板大小的畫面區域與模板的 NCC 至少 min_ncc, 否則視為錯配 (None)。
+        """
+        t0 = time.perf_counter()
+        try:
+            gray, t_pts, t_des = self.template_features(path, detector)
+            s_pts, s_des, (off_x, off_y) = self.frame_features(frame, roi, detector)
+            if t_des is None or s_des is None or len(t_des) < 2 or len(s_des) < 2:
+                return None
+            det = self._detector(detector)
+            pairs = cv2.BFMatcher(self._norm(det)).knnMatch(t_des, s_des, k=2)
+            good = [m[0] for m in pairs if len(m) == 2 and m[0].distance < ratio * m[1].distance]
+            if len(good) < min_matches:
+                return None
+            src = t_pts[[m.queryIdx for m in good]].reshape(-1, 1, 2)
+            dst = s_pts[[m.trainIdx for m in good]].reshape(-1, 1, 2)
+            # UI 元件只會等比縮放 + 平移: 直接以 similarity (4 DoF) 模型做 RANSAC, 比 8 DoF homography 穩定得多
+            M, mask = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=5.0)
+            if M is None:
+                return None
+            H = np.vstack([M, [0.0, 0.0, 1.0]])
+            inliers = int(mask.sum())
+            if inliers < max(min_matches, min_inliers):
+                return None
+            h, w = gray.shape[:2]
+            scale = self._similarity_scale(H, w, h, max_anisotropy)
+            if scale is None or not scale_range[0] <= scale <= scale_range[1]:
+                return self._reject(path, f"homography is not a similarity within {scale_range} (scale {scale})")
+            cx, cy = cv2.perspectiveTransform(np.float32([[[w / 2.0, h / 2.0]]]), H)[0][0]
+            view, _ = frame.view(roi)
+            warped = cv2.warpPerspective(view, H, (w, h), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                         borderMode=cv2.BORDER_REPLICATE)
+            ncc = float(cv2.matchTemplate(warped, gray, cv2.TM_CCOEFF_NORMED)[0][0])
+            if not np.isfinite(ncc) or ncc < min_ncc:
+                return self._reject(path, f"warped region NCC {ncc:.3f} < {min_ncc}")
+            with self._lock:
+                self.stats["hits"] += 1
+            return {
+                "center": (int(round(off_x + cx)), int(round(off_y + cy))),
+                "scale": round(scale, 3),
+                "score": inliers / len(good),
+                "inliers": inliers,
+                "matches": len(good),
+                "ncc": round(ncc, 3),
+            }
+        finally:
+            with self._lock:
+                self.stats["calls"] += 1
+                self.stats["total_ms"] += (time.perf_counter() - t0) * 1000
+
+    def _reject(self, path: str, reason: str) -> None:
+        with self._lock:
+            self.stats["rejected"] += 1
+        logger.info(f"      ⚠️ Keypoints rejected for '{os.path.basename(path)}': {reason}")
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        st = dict(self.stats)
+        st["templates"] = len(self._descriptors)
+        st["avg_ms"] = round(st["total_ms"] / st["calls"], 3) if st["calls"] else None
+        return st
+
+
+class TemplateCalibration:
+    """單一校正 key (模板或素材資料夾) 的尺度與信心統計"""
+
+    def __init__(self, window: int):
+        self.scale: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.searches = 0
+        self.failed_searches = 0             # 連續失敗的完整搜尋次數 (決定下一次搜尋前的 backoff), 命中即歸零
+        self.misses_since_search = 0
+        self.recent = deque(maxlen=window)   # 最近 N 次比對是否命中
+        self.score_sum = 0.0
+        self.score_min = None
+        self.score_max = None
+        self.calibrated_at = None
+        self.provisional = False             # 由校正檔載入, 尚未在本次執行中確認過
+
+    @property
+    def hit_rate(self) -> float:
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    def record(self, hit: bool, score: float):
+        self.recent.append(hit)
+        if hit:
+            self.provisional = False
+            self.failed_searches = 0
+            self.hits += 1
+            self.score_sum += score
+            self.score_min = score if self.score_min is None else min(self.score_min, score)
+            self.score_max = score if self.score_max is None else max(self.score_max, score)
+        else:
+            self.misses += 1
+            self.misses_since_search += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "scale": self.scale,
+            "hits": self.hits,
+            "misses": self.misses,
+            "searches": self.searches,
+            "failed_searches": self.failed_searches,
+            "recent_hit_rate": round(self.hit_rate, 3),
+            "score_mean": round(self.score_sum / self.hits, 4) if self.hits else None,
+            "score_min": self.score_min,
+            "score_max": self.score_max,
+        }
+
+
+class ScaleCalibrator:
+    """
+    逐模板 (或逐素材資料夾) 的尺度校正。
+    只有在命中率掉到 min_hit_rate 以下時才重新做完整尺度搜尋; 兩次搜尋之間的 miss 間隔從 search_backoff 起
+    每失敗一次加倍 (上限 max_backoff), 命中即重置, 避免「目標本來就不在畫面上」時反覆付出完整搜尋成本。
+    尚未校正的模板每次 miss 仍會做便宜的常見縮放比對 (needs_scale), 目標一出現就能找到。
+    """
+
+    def __init__(self, scope: str = "template", window: int = 8, min_hit_rate: float = 0.25, search_backoff: int = 4,
+                 max_backoff: int = 64):
+        if scope not in ("template", "asset_dir"):
+            raise ValueError(f"Unknown calibration scope: {scope}")
+        self.scope = scope
+        self.window = window
+        self.min_hit_rate = min_hit_rate
+        self.search_backoff = search_backoff
+        self.max_backoff = max_backoff
+        self.entries: Dict[str, TemplateCalibration] = {}
+        self.dir_scales: Dict[str, float] = {}   # 資料夾內最近一次確認的 scale, 作為同資料夾新模板的第一猜測
+
+    def key(self, path: str) -> str:
+        return os.path.dirname(path) if self.scope == "asset_dir" else path
+
+    def entry(self, path: str) -> TemplateCalibration:
+        k = self.key(path)
+        entry = self.entries.get(k)
+        if entry is None:
+            entry = self.entries.setdefault(k, TemplateCalibration(self.window))
+        return entry
+
+    def guess(self, path: str) -> float:
+        """尚未校正時的單一尺度猜測: 同資料夾的已知 scale, 否則 1.0"""
+        entry = self.entries.get(self.key(path))
+        if entry and entry.scale is not None:
+            return entry.scale
+        return self.dir_scales.get(os.path.dirname(path), 1.0)
+
+    def has_hint(self, path: str) -> bool:
+        entry = self.entries.get(self.key(path))
+        return (entry is not None and entry.scale is not None) or os.path.dirname(path) in self.dir_scales
+
+    def backoff(self, entry: TemplateCalibration) -> int:
+        """下一次完整搜尋前需要的 miss 數: search_backoff * 2^(連續失敗次數 - 1), 上限 max_backoff"""
+        return min(self.max_backoff, self.search_backoff * 2 ** max(0, entry.failed_searches - 1))
+
+    def peek(self, path: str) -> Optional[TemplateCalibration]:
+        """唯讀查詢 (不建立 entry), 供背景偵測使用"""
+        return self.entries.get(self.key(path))
+
+    def should_search(self, path: str) -> bool:
+        """是否做完整 (coarse-to-fine) 尺度搜尋"""
+        entry = self.peek(path)
+        if entry is None:
+            return True
+        if entry.scale is None:
+            return entry.searches == 0 or entry.misses_since_search >= self.backoff(entry)
+        if entry.provisional:
+            # 校正檔的 scale 會先被嘗試 (has_hint), 若沒命中可能是 UI 縮放已改變, 立即重新搜尋一次
+            return True
+        return (len(entry.recent) >= entry.recent.maxlen and entry.hit_rate < self.min_hit_rate
+                and entry.misses_since_search >= self.backoff(entry))
+
+    def needs_scale(self, path: str) -> bool:
+        """尚未確認 scale (未校正或校正檔載入待確認): miss 時每次都做常見縮放比對"""
+        entry = self.peek(path)
+        return entry is None or entry.scale is None or entry.provisional
+
+    def searched(self, path: str, scale: Optional[float]):
+        """記錄一次尺度搜尋結果; scale=None 表示搜尋失敗"""
+        entry = self.entry(path)
+        entry.searches += 1
+        entry.misses_since_search = 0
+        entry.provisional = False
+        if scale is None:
+            entry.failed_searches += 1
+            entry.recent.clear()
+            return
+        entry.failed_searches = 0
+        entry.scale = scale
+        entry.calibrated_at = time.time()
+        entry.recent.clear()
+        self.dir_scales[os.path.dirname(path)] = scale
+
+    def record(self, path: str, hit: bool, score: float):
+        self.entry(path).record(hit, score)
+
+    def stats(self) -> Dict[str, Any]:
+        return {k: e.to_dict() for k, e in self.entries.items()}
+
+    # --- 校正檔持久化 (以 asset_dir + 螢幕解析度 區分) ---
+    @staticmethod
+    def profile_path(profile_dir: str, asset_dir: str, screen_size: Tuple[int, int]) -> str:
+        dir_id = hashlib.sha1(os.path.abspath(asset_dir).encode("utf-8")).hexdigest()[:12]
+        name = f"{os.path.basename(os.path.normpath(asset_dir))}_{dir_id}_{screen_size[0]}x{screen_size[1]}.json"
+        return os.path.join(profile_dir, name)
+
+    @staticmethod
+    def _file_hash(path: str) -> Optional[str]:
+        try:
+            with open(path, "rb") as f:
+                return hashlib.md5(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def load_profile(self, profile_file: str, asset_dir: str) -> int:
+        """載入校正檔; 模板內容 hash 不符 (素材已更新) 的項目視為過期而略過。回傳載入筆數"""
+        if not os.path.exists(profile_file):
+            return 0
+        try:
+            with open(profile_file, "r", encoding="utf-8") as f:
+                profile = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Calibration profile unreadable, ignored: {e}")
+            return 0
+        if profile.get("scope", "template") != self.scope:
+            return 0
+
+        loaded, stale = 0, 0
+        base = asset_dir.rstrip("/\\")
+        for rel, item in profile.get("entries", {}).items():
+            # 還原成與 YAML "$asset_dir/xxx.png" 替換後完全相同的字串, 才能對上 detect 時的 key
+            target = f"{base}/{rel}" if rel else base
+            if self.scope == "template" and self._file_hash(target) != item.get("hash"):
+                stale += 1
+                continue
+            entry = self.entry(target)
+            entry.scale = item["scale"]
+            entry.calibrated_at = item.get("calibrated_at")
+            entry.provisional = True
+            self.dir_scales[target if self.scope == "asset_dir" else os.path.dirname(target)] = item["scale"]
+            loaded += 1
+        logger.info(f"📐 Calibration profile loaded: {loaded} entries ({stale} stale) <- {profile_file}")
+        return loaded
+
+    def save_profile(self, profile_file: str, asset_dir: str, screen_size: Tuple[int, int]):
+        entries = {}
+        base = asset_dir.rstrip("/\\")
+        for key, entry in self.entries.items():
+            if entry.scale is None:
+                continue
+            if key == base:
+                rel = ""
+            elif key.startswith(base) and key[len(base)] in "/\\":
+                rel = key[len(base) + 1:]
+            else:
+                continue  # 不屬於此 asset_dir 的模板不寫入
+            item = {"scale": entry.scale, "calibrated_at": entry.calibrated_at,
+                    "score_mean": round(entry.score_sum / entry.hits, 4) if entry.hits else None}
+            if self.scope == "template":
+                item["hash"] = self._file_hash(key)
+            entries[rel] = item
+        if not entries:
+            return
+        profile = {
+            "asset_dir": asset_dir,
+            "resolution": list(screen_size),
+            "scope": self.scope,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "entries": entries,
+        }
+        os.makedirs(os.path.dirname(profile_file) or ".", exist_ok=True)
+        tmp = profile_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, profile_file)
+        logger.info(f"📐 Calibration profile saved: {len(entries)} entries -> {profile_file}")
+
+
+# ==============================================================================
+# 1b. OCR Service (獨立的常駐 worker process, 模型延遲載入)
+# ==============================================================================
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """以非擁有者身分掛上既有的 shared memory (不讓本 process 的 resource_tracker 在結束時把它刪掉)"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)   # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+def _ocr_session_dir(base: Optional[str] = None) -> str:
+    """
+    OCR worker 的 session 目錄 (socket 與 authkey 檔): 每個使用者一個, POSIX 上必須是自己擁有的 0700 目錄,
+    否則拒絕使用 (避免其他使用者預先建立目錄或以 symlink 攔截)。
+    """
+    if base is None:
+        if os.name == "nt":
+            base = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(), "RcpAgent", "ocr")
+        else:
+            root = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+            base = os.path.join(root, f"rcpagent-ocr-{os.getuid()}")
+    os.makedirs(base, mode=0o700, exist_ok=True)
+    if os.name != "nt":
+        st = os.lstat(base)
+        if not os.path.isdir(base) or os.path.islink(base) or st.st_uid != os.getuid():
+            raise RuntimeError(f"OCR session dir {base} is not a directory owned by the current user")
+        if st.st_mode & 0o077:
+            os.chmod(base, 0o700)
+    return base
+
+
+def _ocr_address(session_dir: str, host: str, port: int):
+    """POSIX 使用 session 目錄內的 AF_UNIX socket; 其他平台 (Windows) 使用 TCP (host, port)"""
+    if os.name != "nt" and hasattr(socket, "AF_UNIX"):
+        return os.path.join(session_dir, "ocr.sock")
+    return (host, int(port))
+
+
+def _ocr_key_path(session_dir: str, address) -> str:
+    return os.path.join(session_dir, "ocr.key" if isinstance(address, str) else f"ocr-{address[1]}.key")
+
+
+def _read_ocr_key(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            return bytes.fromhex(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_private(path: str, data: str):
+    """以 0600 寫入暫存檔再 rename, 讀取端不會看到寫到一半的內容"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="ascii") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class _OcrWorker:
+    """
+    OCR worker 本體 (在獨立 process 內執行): easyocr.Reader 於第一次 readtext 才載入, 之後常駐。
+    多個 engine (不同 process / 不同次 run) 透過 multiprocessing.connection 共用同一個 worker;
+    影像放在 client 建立的 shared memory, 連線上只傳名稱與 shape。
+    multiprocessing.connection 以 pickle 傳遞訊息, 所以 authkey 由 worker 在 bind 成功後以 os.urandom 產生,
+    只寫進 session 目錄內的 0600 檔案, 同一使用者的 client 讀檔連線; worker 結束時刪除。
+    """
+
+    def __init__(self, address, key_path: str, model_dir: str, languages: List[str], gpu: bool, idle_timeout: float):
+        self.address = address
+        self.key_path = key_path
+        self.authkey = os.urandom(32)
+        self.model_dir = model_dir
+        self.languages = languages
+        self.gpu = gpu
+        self.idle_timeout = idle_timeout
+        self.reader = None
+        self.load_ms = None
+        self._reader_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._connections = 0
+        self._last_activity = time.monotonic()
+
+    def _load_reader(self) -> Optional[float]:
+        """回傳本次載入花費的毫秒數; 已載入時回傳 None"""
+        if self.reader is not None:
+            return None
+        import easyocr
+        t0 = time.perf_counter()
+        os.makedirs(self.model_dir, exist_ok=True)
+        self.reader = easyocr.Reader(self.languages, gpu=self.gpu, model_storage_directory=self.model_dir, download_enabled=True)
+        self.load_ms = (time.perf_counter() - t0) * 1000
+        logger.info(f"🔤 [OCR Worker] model loaded in {self.load_ms:.0f} ms ({','.join(self.languages)})")
+        return self.load_ms
+
+    def _run_reader(self, msg: Dict, segments: Dict[str, shared_memory.SharedMemory]) -> Dict[str, Any]:
+        """readtext: 偵測 + 辨識; recognize: 只辨識指定的水平文字框 (跳過昂貴的文字偵測)"""
+        name = msg["shm"]
+        shm = segments.get(name)
+        if shm is None:
+            shm = segments[name] = _attach_shared_memory(name)
+        shape = tuple(msg["shape"])
+        img = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)[:].copy()
+        with self._reader_lock:
+            load_ms = self._load_reader()
+            t0 = time.perf_counter()
+            if msg["op"] == "recognize":
+                boxes = [[int(v) for v in box] for box in msg["boxes"]]   # [x_min, x_max, y_min, y_max]
+                gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+                raw = self.reader.recognize(gray, horizontal_list=boxes, free_list=[], **msg.get("kwargs", {}))
+            else:
+                raw = self.reader.readtext(img, **msg.get("kwargs", {}))
+            infer_ms = (time.perf_counter() - t0) * 1000
+        results = [([[float(p[0]), float(p[1])] for p in bbox], str(text), float(prob)) for bbox, text, prob in raw]
+        return {"ok": True, "results": results, "load_ms": load_ms, "infer_ms": infer_ms}
+
+    def _serve(self, conn):
+        segments: Dict[str, shared_memory.SharedMemory] = {}
+        try:
+            while True:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    break
+                with self._state_lock:
+                    self._last_activity = time.monotonic()
+                op = msg.get("op")
+                try:
+                    if op in ("readtext", "recognize"):
+                        reply = self._run_reader(msg, segments)
+                    elif op == "ping":
+                        reply = {"ok": True, "pid": os.getpid(), "loaded": self.reader is not None, "load_ms": self.load_ms}
+                    elif op == "release":
+                        old = segments.pop(msg.get("shm"), None)
+                        if old is not None:
+                            old.close()
+                        reply = {"ok": True}
+                    elif op == "shutdown":
+                        conn.send({"ok": True})
+                        self._exit()
+                    else:
+                        reply = {"ok": False, "error": f"unknown op '{op}'"}
+                except Exception as e:
+                    reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                conn.send(reply)
+        finally:
+            for shm in segments.values():
+                shm.close()
+            conn.close()
+            with self._state_lock:
+                self._connections -= 1
+                self._last_activity = time.monotonic()
+
+    def _idle_monitor(self):
+        # 沒有任何連線且閒置超過 idle_timeout 才結束, 讓下一次 run 仍能拿到已載入模型的 worker
+        while True:
+            time.sleep(min(5.0, self.idle_timeout))
+            with self._state_lock:
+                idle = self._connections == 0 and time.monotonic() - self._last_activity > self.idle_timeout
+            if idle:
+                logger.info("🔤 [OCR Worker] idle timeout, exiting")
+                self._exit()
+
+    def _exit(self):
+        for path in (self.key_path, self.address if isinstance(self.address, str) else None):
+            if path:
+                with contextlib.suppress(OSError):
+                    os.unlink(path)
+        os._exit(0)
+
+    def _clear_stale_socket(self):
+        """上一個 worker 異常結束時留下的 socket 檔連不上, 刪掉才能重新 bind; 連得上代表已有 worker 在服務"""
+        if not isinstance(self.address, str) or not os.path.exists(self.address):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.address)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.unlink(self.address)
+        finally:
+            probe.close()
+
+    def serve_forever(self):
+        from multiprocessing.connection import Listener
+        self._clear_stale_socket()
+        try:
+            listener = Listener(self.address, authkey=self.authkey)
+        except OSError as e:
+            # 另一個 worker 已經佔用位址 (例如兩個 engine 同時啟動): 交給它服務
+            logger.info(f"🔤 [OCR Worker] address in use, exiting: {e}")
+            return
+        _write_private(self.key_path, self.authkey.hex())
+        logger.info(f"🔤 [OCR Worker] listening on {self.address} (pid {os.getpid()}, idle timeout {self.idle_timeout}s)")
+        threading.Thread(target=self._idle_monitor, daemon=True).start()
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.warning(f"⚠️ [OCR Worker] rejected connection: {e}")
+                continue
+            with self._state_lock:
+                self._connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+
+class TextIndex:
+    """
+    一次 OCR 的結果 (單一畫面區域): 文字框 / 字串 / 機率, 加上正規化文字的查詢表。
+    同一張畫面上落在此區域內的 ocr feature、anchor、error branch 條件都直接查表, 不再重跑 OCR。
+    """
+
+    def __init__(self, rect: Tuple[int, int, int, int], results: List[Tuple[List[List[float]], str, float]], backend: str = "easyocr"):
+        self.rect = rect
+        self.backend = backend
+        self.entries: List[Dict[str, Any]] = []
+        self.by_text: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for bbox, text, prob in results:
+            xs, ys = [p[0] for p in bbox], [p[1] for p in bbox]
+            box = (int(rect[0] + min(xs)), int(rect[1] + min(ys)), int(max(xs) - min(xs)), int(max(ys) - min(ys)))
+            entry = {"text": text, "norm": self.normalize(text), "prob": prob, "box": box,
+                     "center": (int(rect[0] + (bbox[0][0] + bbox[2][0]) / 2), int(rect[1] + (bbox[0][1] + bbox[2][1]) / 2))}
+            self.entries.append(entry)
+            self.by_text[entry["norm"]].append(entry)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """不分大小寫、忽略空白與標點 ("Go Manual" / "GoManual" / "go-manual" 視為相同)"""
+        return "".join(ch for ch in str(text).lower() if ch.isalnum())
+
+    def covers(self, rect: Tuple[int, int, int, int]) -> bool:
+        return _rect_contains(self.rect, rect)
+
+    def find(self, text: str, rect: Optional[Tuple[int, int, int, int]] = None, min_prob: float = 0.0) -> Tuple[Optional[Dict[str, Any]], float]:
+        """
+        回傳 (命中的文字框 或 None, 最高機率); 先查完全相同的正規化字串, 再做子字串比對。
+        rect 指定時只看中心點落在 rect 內的文字框。
+        """
+        target = self.normalize(text)
+        if not target:
+            return None, -1.0
+        candidates = self.by_text.get(target, []) + [e for e in self.entries if e["norm"] != target and target in e["norm"]]
+        best = -1.0
+        for entry in candidates:
+            if rect and not _rect_contains(rect, (entry["center"][0], entry["center"][1], 1, 1)):
+                continue
+            best = max(best, entry["prob"])
+            if entry["prob"] >= min_prob:
+                return entry, entry["prob"]
+        return None, best
+
+
+class IncrementalOcr:
+    """
+    跨畫面的增量 OCR (以 ROI 區域為單位): 保留上次的文字框與每個框的像素 hash。
+    - 整塊區域沒變: 直接沿用上次結果
+    - 只有框內像素變了: 對這些框做 recognize (不跑文字偵測)
+    - 框外出現變化: 只對變化區域 (連同重疊的框) 做 readtext
+    需要重跑的面積超過 full_ratio 時改做一次完整 readtext。
+    """
+
+    def __init__(self, client: "OcrClient", max_regions: int = 32, noise: int = 16, pad: int = 6, full_ratio: float = 0.5):
+        self.client = client
+        self.max_regions = max_regions
+        self.noise = noise
+        self.pad = pad
+        self.full_ratio = full_ratio
+        self._states: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self.stats = {"full": 0, "unchanged": 0, "incremental": 0, "boxes_reused": 0, "boxes_recognized": 0,
+                      "regions_detected": 0, "pixels_total": 0, "pixels_ocr": 0}
+
+    @staticmethod
+    def _box_bounds(bbox: List[List[float]], shape: Tuple[int, ...]) -> Tuple[int, int, int, int]:
+        xs, ys = [p[0] for p in bbox], [p[1] for p in bbox]
+        return (max(0, int(min(xs))), min(shape[1], int(np.ceil(max(xs)))),
+                max(0, int(min(ys))), min(shape[0], int(np.ceil(max(ys)))))
+
+    @staticmethod
+    def _hash(gray: np.ndarray, b: Tuple[int, int, int, int]) -> str:
+        return hashlib.md5(np.ascontiguousarray(gray[b[2]:b[3], b[0]:b[1]]).tobytes()).hexdigest()
+
+    def _entries(self, results, gray: np.ndarray) -> List[Dict[str, Any]]:
+        entries = []
+        for bbox, text, prob in results:
+            b = self._box_bounds(bbox, gray.shape)
+            entries.append({"result": (bbox, text, prob), "bounds": b, "hash": self._hash(gray, b)})
+        return entries
+
+    def _full(self, key: tuple, rgb: np.ndarray, gray: np.ndarray) -> List:
+        results = self.client.readtext(rgb)
+        self._store(key, gray, self._entries(results, gray))
+        self.stats["full"] += 1
+        self.stats["pixels_ocr"] += gray.size
+        return results
+
+    def _store(self, key: tuple, gray: np.ndarray, entries: List[Dict[str, Any]]):
+        self._states[key] = {"gray": gray, "entries": entries}
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_regions:
+            self._states.popitem(last=False)
+
+    def read(self, rect: Tuple[int, int, int, int], rgb: np.ndarray) -> List[Tuple[List[List[float]], str, float]]:
+        """與 readtext 相同格式的結果 (座標相對於 rgb); rect 為此區域的螢幕座標, 作為跨畫面比對的 key"""
+        gray = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2GRAY)
+        self.stats["pixels_total"] += gray.size
+        key = tuple(rect)
+        state = self._states.get(key)
+        if state is None or state["gray"].shape != gray.shape:
+            return self._full(key, rgb, gray)
+
+        changed = cv2.absdiff(gray, state["gray"]) > self.noise
+        if not changed.any():
+            self._states.move_to_end(key)
+            self.stats["unchanged"] += 1
+            self.stats["boxes_reused"] += len(state["entries"])
+            return [e["result"] for e in state["entries"]]
+
+        # 1) 框外的變化 -> 需要重新偵測的區域 (連同與之重疊的框一起)
+        outside = changed.copy()
+        for e in state["entries"]:
+            x0, x1, y0, y1 = e["bounds"]
+            outside[y0:y1, x0:x1] = False
+        regions = []
+        if outside.any():
+            mask = cv2.dilate(outside.astype(np.uint8), np.ones((3, 3), np.uint8), iterations=self.pad)
+            n, _, comp, _ = cv2.connectedComponentsWithStats(mask)
+            for x, y, w, h, _ in comp[1:n]:
+                regions.append([x, x + w, y, y + h])
+        for region in regions:
+            for e in state["entries"]:
+                x0, x1, y0, y1 = e["bounds"]
+                if x0 < region[1] and region[0] < x1 and y0 < region[3] and region[2] < y1:
+                    region[:] = [min(region[0], x0), max(region[1], x1), min(region[2], y0), max(region[3], y1)]
+        regions = [[max(0, r[0] - self.pad), min(gray.shape[1], r[1] + self.pad),
+                    max(0, r[2] - self.pad), min(gray.shape[0], r[3] + self.pad)] for r in regions]
+
+        def in_region(b):
+            return any(r[0] <= b[0] and b[1] <= r[1] and r[2] <= b[2] and b[3] <= r[3] for r in regions)
+
+        # 2) 其餘的框: hash 相同就沿用, 不同就只做 recognize
+        kept, stale = [], []
+        for e in state["entries"]:
+            if in_region(e["bounds"]):
+                continue
+            (kept if self._hash(gray, e["bounds"]) == e["hash"] else stale).append(e)
+
+        area = sum((r[1] - r[0]) * (r[3] - r[2]) for r in regions) + \
+            sum((e["bounds"][1] - e["bounds"][0]) * (e["bounds"][3] - e["bounds"][2]) for e in stale)
+        if area > gray.size * self.full_ratio:
+            return self._full(key, rgb, gray)
+
+        results = [e["result"] for e in kept]
+        if stale:
+            results += self.client.recognize(rgb, [e["bounds"] for e in stale])
+        for x0, x1, y0, y1 in regions:
+            for bbox, text, prob in self.client.readtext(rgb[y0:y1, x0:x1]):
+                results.append(([[p[0] + x0, p[1] + y0] for p in bbox], text, prob))
+        self._store(key, gray, self._entries(results, gray))
+        st = self.stats
+        st["incremental"] += 1
+        st["boxes_reused"] += len(kept)
+        st["boxes_recognized"] += len(stale)
+        st["regions_detected"] += len(regions)
+        st["pixels_ocr"] += area
+        return results
+
+    def metrics(self) -> Dict[str, Any]:
+        st = dict(self.stats)
+        total = st.pop("pixels_total")
+        st["ocr_area_ratio"] = round(st.pop("pixels_ocr") / total, 4) if total else None   # 實際送進 OCR 的面積比例
+        return st
+
+
+class GlyphOcr:
+    """
+    固定點陣字型的輕量 OCR (純 OpenCV / NumPy, 不需要 torch)。
+    字模 (glyph atlas) 由 glyph_dir 內的文字樣本建立: tools/roi_tmp_crop_tool.py 裁切的樣本圖 +
+    labels.json ({"檔名": "樣本文字"}); 每張樣本切成單字後依序對應到文字中的非空白字元 (相黏的字元依字寬切開),
+    樣本中標註的空白同時用來估計字距與空白的分界。
+    辨識時以兩種極性 (淺底深字 / 深底淺字) 切出字元, 與相同尺寸 (±1px) 的字模比對 IoU, 再依間距組成字串。
+    """
+
+    incremental = False   # 本身就很快, 不需要 IncrementalOcr
+
+    def __init__(self, glyph_dir: str, min_score: float = 0.75, space_ratio: float = 0.6, phrase_ratio: float = 2.5, contrast: int = 40):
+        self.glyph_dir = glyph_dir
+        self.min_score = min_score
+        self.contrast = contrast           # 字與周圍底色的最小灰階差
+        self.space_ratio = space_ratio     # 字距 > 平均字寬 * space_ratio 視為空白
+        self.phrase_ratio = phrase_ratio   # 字距 > 平均字寬 * phrase_ratio 視為另一段文字
+        self.glyphs: Dict[Tuple[int, int], List[Tuple[str, np.ndarray]]] = defaultdict(list)   # (h, w) -> [(char, mask)]
+        self.char_width = 8.0
+        self.space_gap: Optional[float] = None   # 由樣本估計的空白字距; 無法估計時用 char_width * space_ratio
+        self.height_range = (0, 0)
+        self._signature = None
+        self._memo: Dict[tuple, Tuple[Optional[str], float]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "total_ms": 0.0, "glyphs": 0, "samples": 0, "skipped_samples": 0}
+
+    @staticmethod
+    def _segment(mask: np.ndarray) -> List[List[Tuple[int, int, int, int]]]:
+        """
+        前景 mask 切成文字行, 每行為依 x 排序的字元框 (x, y, w, h)。
+        先以較高的連通元件建立行, 小元件 (i 的點、冒號) 併入所在行, 行內水平重疊的元件合併為同一個字元。
+        """
+        n, _, comp, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+        lines: List[Dict[str, Any]] = []
+        for x, y, w, h in sorted((tuple(int(v) for v in c[:4]) for c in comp[1:n]), key=lambda b: -b[3]):
+            for line in lines:
+                reach = int(0.4 * (line["y1"] - line["y0"]))
+                if min(line["y1"] + reach, y + h) - max(line["y0"] - reach, y) > 0:
+                    line["boxes"].append([x, y, w, h])
+                    if h >= 0.5 * (line["y1"] - line["y0"]):
+                        line["y0"], line["y1"] = min(line["y0"], y), max(line["y1"], y + h)
+                    break
+            else:
+                lines.append({"y0": y, "y1": y + h, "boxes": [[x, y, w, h]]})
+        result = []
+        for line in sorted(lines, key=lambda l: l["y0"]):
+            merged: List[List[int]] = []
+            for b in sorted(line["boxes"], key=lambda b: b[0]):
+                for m in merged:
+                    overlap = min(m[0] + m[2], b[0] + b[2]) - max(m[0], b[0])
+                    if overlap >= 0.5 * min(m[2], b[2]):
+                        x0, y0 = min(m[0], b[0]), min(m[1], b[1])
+                        m[:] = [x0, y0, max(m[0] + m[2], b[0] + b[2]) - x0, max(m[1] + m[3], b[1] + b[3]) - y0]
+                        break
+                else:
+                    merged.append(b)
+            result.append([tuple(b) for b in sorted(merged, key=lambda b: b[0])])
+        return result
+
+    def _foregrounds(self, gray: np.ndarray, kernel: int) -> List[np.ndarray]:
+        """深色字 (black-hat) 與淺色字 (top-hat) 兩種前景; 以區域對比判斷, 不受 ROI 內不同底色影響"""
+        k = np.ones((kernel, kernel), np.uint8)
+        return [cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, k) > self.contrast,
+                cv2.morphologyEx(gray, cv2.MORPH_TOPHAT, k) > self.contrast]
+
+    def _kernel(self) -> int:
+        return max(9, int(self.height_range[1]) | 1)
+
+    def _load(self):
+        """依 labels.json 的 mtime 決定是否重建字模"""
+        labels_path = os.path.join(self.glyph_dir, "labels.json")
+        try:
+            signature = os.path.getmtime(labels_path)
+        except OSError:
+            raise FileNotFoundError(f"glyph atlas labels not found: {labels_path}")
+        if signature == self._signature:
+            return
+        with open(labels_path, "r", encoding="utf-8") as f:
+            labels = json.load(f)
+        accepted, pending = [], []
+        for name, text in labels.items():
+            chars = [ch for ch in str(text) if not ch.isspace()]
+            gray = np.array(Image.open(os.path.join(self.glyph_dir, name)).convert("L"))
+            foregrounds = self._foregrounds(gray, max(9, gray.shape[0] | 1))
+            # 樣本的字色未知: 先取切出的字元數與文字相符的那一種極性
+            for fg in foregrounds:
+                lines = self._segment(fg)
+                if sum(len(line) for line in lines) == len(chars):
+                    accepted.append((text, fg, lines))
+                    break
+            else:
+                pending.append((name, text, chars, gray, foregrounds))
+        # 比例字型常有相黏的字元: 以已接受樣本的字寬切開; 新接受的樣本提供更多字寬, 重複到沒有進展為止
+        while pending:
+            widths = self._char_widths(accepted)
+            remaining = []
+            for name, text, chars, gray, foregrounds in pending:
+                fg = foregrounds[0 if self._dark_text(gray) else 1]
+                lines = self._split_merged(fg, self._segment(fg), chars, widths)
+                if lines is None:
+                    remaining.append((name, text, chars, gray, foregrounds))
+                else:
+                    accepted.append((text, fg, lines))
+            if len(remaining) == len(pending):
+                break
+            pending = remaining
+        for name, text, chars, gray, foregrounds in pending:
+            # 切開後仍不符: 回報最接近的那一種極性
+            polarity, boxes = min(((polarity, [b for line in self._segment(fg) for b in line])
+                                   for polarity, fg in zip(("dark", "light"), foregrounds)), key=lambda c: abs(len(c[1]) - len(chars)))
+            logger.warning(f"⚠️ [Glyph OCR] sample '{name}': {len(boxes)} glyphs ({polarity} text) for {len(chars)} chars "
+                           f"of '{text}' [{self._segment_failures(chars, boxes)}], skipped")
+        glyphs: Dict[Tuple[int, int], List[Tuple[str, np.ndarray]]] = defaultdict(list)
+        widths, heights, letter_gaps, word_gaps = [], [], [], []
+        for text, fg, lines in accepted:
+            # chars[i] 為第 i 個非空白字元, spaced[i] 表示它後面接著空白
+            chars, spaced = [], []
+            for ch in str(text):
+                if not ch.isspace():
+                    chars.append(ch)
+                    spaced.append(False)
+                elif spaced:
+                    spaced[-1] = True
+            i = 0
+            for line in lines:
+                for j, (x, y, w, h) in enumerate(line):
+                    ch, glyph = chars[i], fg[y:y + h, x:x + w]
+                    bucket = glyphs[(h, w)]
+                    if not any(c == ch and np.array_equal(g, glyph) for c, g in bucket):
+                        bucket.append((ch, glyph))
+                    widths.append(w)
+                    heights.append(h)
+                    if j + 1 < len(line):
+                        (word_gaps if spaced[i] else letter_gaps).append(line[j + 1][0] - (x + w))
+                    i += 1
+        self.glyphs = glyphs
+        self._memo.clear()
+        self.char_width = float(np.median(widths)) if widths else 8.0
+        # 字距與空白可以分開時取兩者中間為空白的分界, 否則退回 char_width * space_ratio
+        self.space_gap = (max(letter_gaps) + min(word_gaps)) / 2 if letter_gaps and word_gaps and max(letter_gaps) < min(word_gaps) else None
+        self.height_range = (min(heights), max(heights)) if heights else (0, 0)
+        self._signature = signature
+        self.stats.update(glyphs=sum(len(v) for v in glyphs.values()), samples=len(accepted), skipped_samples=len(pending))
+        logger.info(f"🔡 [Glyph OCR] atlas built: {self.stats['glyphs']} glyphs from {len(accepted)} samples ({self.glyph_dir})")
+
+    @staticmethod
+    def _dark_text(gray: np.ndarray) -> bool:
+        """樣本的底色以外框估計: 外框比整張圖亮代表淺底深字"""
+        border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+        return float(np.median(border)) >= float(gray.mean())
+
+    @staticmethod
+    def _char_widths(accepted: List[tuple]) -> Dict[str, List[int]]:
+        widths: Dict[str, List[int]] = defaultdict(list)
+        for text, _, lines in accepted:
+            for ch, (_, _, w, _) in zip([c for c in str(text) if not c.isspace()], (b for line in lines for b in line)):
+                widths[ch].append(w)
+        return widths
+
+    @staticmethod
+    def _split_merged(fg: np.ndarray, lines: List[List[Tuple[int, int, int, int]]], chars: List[str],
+                      widths: Dict[str, List[int]]) -> Optional[List[List[Tuple[int, int, int, int]]]]:
+        """
+        切出的框比字元少時 (相黏的字元), 依字寬把字元依序分給各框 (動態規劃, 使框寬與所含字元的預期寬度差最小),
+        再於預期邊界附近前景最少的欄切開; 與辨識時的 _classify_run 相同, 每段裁到前景的外框。
+        預期字寬取已接受樣本中同一字元的中位數, 沒看過的字元以單字框的中位寬度估計。無法切成 len(chars) 段時回傳 None。
+        """
+        boxes = [b for line in lines for b in line]
+        n, m = len(chars), len(boxes)
+        if not boxes or m >= n:
+            return None
+        known = [w for ws in widths.values() for w in ws]
+        unit = float(np.median(known or [b[2] for b in boxes]))
+        edges = np.concatenate([[0.0], np.cumsum([float(np.median(widths[c])) if widths.get(c) else unit for c in chars])])
+        # cost[j][i]: 前 j 個框分到前 i 個字元的最小寬度差; take[j][i]: 第 j 個框分到的字元數
+        cost = np.full((m + 1, n + 1), np.inf)
+        take = np.zeros((m + 1, n + 1), int)
+        cost[0][0] = 0.0
+        for j in range(1, m + 1):
+            w = boxes[j - 1][2]
+            for i in range(j, n - (m - j) + 1):
+                for k in range(1, i - j + 2):
+                    c = cost[j - 1][i - k] + abs(w - (edges[i] - edges[i - k]))
+                    if c < cost[j][i]:
+                        cost[j][i], take[j][i] = c, k
+        counts, i = [], n
+        for j in range(m, 0, -1):
+            counts.append(int(take[j][i]))
+            i -= counts[-1]
+        counts.reverse()
+        radius = max(1, int(round(unit * 0.3)))
+        result, start, idx = [], 0, 0
+        for line in lines:
+            out = []
+            for x, y, w, h in line:
+                k = counts[idx]
+                glyph = fg[y:y + h, x:x + w]
+                ink = glyph.sum(axis=0)
+                cuts, prev = [], 0
+                for t in range(1, k):
+                    expect = int(round(w * (edges[start + t] - edges[start]) / (edges[start + k] - edges[start])))
+                    window = range(max(prev + 1, expect - radius), min(w - 1, expect + radius) + 1)
+                    if not window:
+                        return None
+                    prev = min(window, key=lambda c: (ink[c], abs(c - expect)))
+                    cuts.append(prev)
+                for x0, x1 in zip([0] + cuts, cuts + [w]):
+                    piece = glyph[:, x0:x1]
+                    rows, cols = np.flatnonzero(piece.any(axis=1)), np.flatnonzero(piece.any(axis=0))
+                    if not len(rows):
+                        return None
+                    out.append((x + x0 + int(cols[0]), y + int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)))
+                start += k
+                idx += 1
+            result.append(out)
+        return result
+
+    @staticmethod
+    def _segment_failures(chars: List[str], boxes: List[Tuple[int, int, int, int]]) -> str:
+        """
+        切割數與文字不符時估計是哪些字元出問題: 以平均字寬把元件依序對應到字元,
+        寬度約 n 個字的元件為相黏 (merged), 不到半個字寬的碎片歸給前一個字 (split)。
+        """
+        if not boxes:
+            return "no glyphs segmented"
+        unit = sum(b[2] for b in boxes) / len(chars)
+        merged, split, i = [], [], 0
+        for x, _, w, _ in boxes:
+            n = int(round(w / unit)) if unit else 1
+            if n == 0:
+                if i and chars[i - 1] not in split:
+                    split.append(chars[i - 1])
+                continue
+            if n > 1 and i < len(chars):
+                merged.append("".join(chars[i:i + n]))
+            i += n
+        parts = []
+        if merged:
+            parts.append("merged: " + ", ".join(f"'{m}'" for m in merged))
+        if split:
+            parts.append("split: " + ", ".join(f"'{c}'" for c in split))
+        if i < len(chars):
+            parts.append(f"unsegmented: '{''.join(chars[i:])}'")
+        elif i > len(chars):
+            parts.append(f"{i - len(chars)} extra")
+        return "; ".join(parts) or "unknown"
+
+    def _classify(self, glyph: np.ndarray) -> Tuple[Optional[str], float]:
+        # 固定字型的字元圖樣會一再出現: 以 mask 內容快取辨識結果
+        key = (glyph.shape, np.packbits(glyph).tobytes())
+        cached = self._memo.get(key)
+        if cached is None:
+            cached = self._memo[key] = self._match_glyph(glyph)
+            if len(self._memo) > 8192:
+                self._memo.clear()
+        return cached
+
+    def _match_glyph(self, glyph: np.ndarray) -> Tuple[Optional[str], float]:
+        h, w = glyph.shape
+        best_ch, best = None, 0.0
+        for dh in (0, -1, 1):
+            for dw in (0, -1, 1):
+                refs = self.glyphs.get((h + dh, w + dw))
+                if not refs:
+                    continue
+                cand = glyph if (dh, dw) == (0, 0) else cv2.resize(glyph.astype(np.uint8), (w + dw, h + dh), interpolation=cv2.INTER_NEAREST).astype(bool)
+                for ch, ref in refs:
+                    union = np.count_nonzero(cand | ref)
+                    score = np.count_nonzero(cand & ref) / union if union else 0.0
+                    if score > best:
+                        best_ch, best = ch, score
+        return best_ch, best
+
+    def _classify_run(self, glyph: np.ndarray, depth: int = 2) -> Tuple[List[Tuple[int, int, int, int, str]], float]:
+        """
+        辨識一個元件, 分數不足且夠寬時嘗試切成左右兩段 (比例字型中相黏的字元, 例如 "LA")。
+        回傳 ([(dx, dy, w, h, char)], 最低分數)。
+        """
+        h, w = glyph.shape
+        ch, score = self._classify(glyph)
+        best = ([(0, 0, w, h, ch)], score) if ch is not None else ([], 0.0)
+        min_w = max(2, int(self.char_width * 0.3))
+        lo, hi = self.height_range
+        if score >= self.min_score or depth == 0 or w < 2 * min_w or not lo - 1 <= h <= hi + 1:
+            return best
+        for cut in range(min_w, w - min_w + 1):
+            parts = []
+            for x0, x1 in ((0, cut), (cut, w)):
+                piece = glyph[:, x0:x1]
+                rows = np.flatnonzero(piece.any(axis=1))
+                cols = np.flatnonzero(piece.any(axis=0))
+                if not len(rows):
+                    break
+                sub, sub_score = self._classify_run(piece[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1], depth - 1)
+                if not sub:
+                    break
+                parts.append(([(int(dx + x0 + cols[0]), int(dy + rows[0]), sw, sh, c) for dx, dy, sw, sh, c in sub], sub_score))
+            if len(parts) == 2 and min(parts[0][1], parts[1][1]) > best[1]:
+                best = (parts[0][0] + parts[1][0], min(parts[0][1], parts[1][1]))
+        return best
+
+    def _read_mask(self, fg: np.ndarray) -> List[Tuple[List[List[float]], str, float]]:
+        lo, hi = self.height_range
+        space = self.space_gap if self.space_gap is not None else self.char_width * self.space_ratio
+        results = []
+        for line in self._segment(fg):
+            chars = []
+            for x, y, w, h in line:
+                if h > hi + 1 or w > 3 * self.char_width + 2:
+                    continue
+                pieces, score = self._classify_run(fg[y:y + h, x:x + w])
+                # 比最矮字模還小的元件 (雜點) 需要更高的分數才採用
+                if pieces and score >= (self.min_score if h >= lo - 1 else max(self.min_score, 0.9)):
+                    chars.extend((x + dx, y + dy, pw, ph, c, score) for dx, dy, pw, ph, c in pieces)
+            # 行內依間距分段 / 補空白
+            phrase: List[tuple] = []
+            for c in chars + [None]:
+                if c is not None and (not phrase or c[0] - (phrase[-1][0] + phrase[-1][2]) <= self.char_width * self.phrase_ratio):
+                    phrase.append(c)
+                    continue
+                if phrase:
+                    text = phrase[0][4]
+                    for a, b in zip(phrase, phrase[1:]):
+                        text += (" " if b[0] - (a[0] + a[2]) > space else "") + b[4]
+                    x0, y0 = min(p[0] for p in phrase), min(p[1] for p in phrase)
+                    x1, y1 = max(p[0] + p[2] for p in phrase), max(p[1] + p[3] for p in phrase)
+                    results.append(([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, float(np.mean([p[5] for p in phrase]))))
+                phrase = [c] if c is not None else []
+        return results
+
+    def readtext(self, rgb: np.ndarray, **kwargs) -> List[Tuple[List[List[float]], str, float]]:
+        t0 = time.perf_counter()
+        with self._lock:
+            self._load()
+        gray = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2GRAY) if rgb.ndim == 3 else rgb
+        kernel = self._kernel()
+        results = []
+        for sign, fg in zip((-1, 1), self._foregrounds(gray, kernel)):
+            for bbox, text, prob in self._read_mask(fg):
+                # 字的筆畫之間的底色在反極性中會切出一排細直條 (讀成 'lll'): 這種「筆畫」的顏色就是周圍的底色, 捨棄
+                if self._stroke_contrast(gray, fg, bbox, kernel, sign):
+                    results.append((bbox, text, prob))
+        self.stats["calls"] += 1
+        self.stats["total_ms"] += (time.perf_counter() - t0) * 1000
+        return results
+
+    def _stroke_contrast(self, gray: np.ndarray, fg: np.ndarray, bbox: List[List[float]], pad: int, sign: int) -> bool:
+        """筆畫與周圍 (多取 pad 的範圍, 以底色為主) 的灰階中位數相差至少 contrast / 2 (反鋸齒的細筆畫較淡); sign -1 為深色字, 1 為淺色字"""
+        (x0, y0), (x1, y1) = bbox[0], bbox[2]
+        strokes = gray[y0:y1, x0:x1][fg[y0:y1, x0:x1]]
+        around = gray[max(0, y0 - pad):y1 + pad, max(0, x0 - pad):x1 + pad]
+        return sign * (float(np.median(strokes)) - float(np.median(around))) >= self.contrast / 2
+
+    def recognize(self, rgb: np.ndarray, boxes: List[Tuple[int, int, int, int]], **kwargs) -> List[Tuple[List[List[float]], str, float]]:
+        results = []
+        for x0, x1, y0, y1 in boxes:
+            for bbox, text, prob in self.readtext(rgb[y0:y1, x0:x1]):
+                results.append(([[p[0] + x0, p[1] + y0] for p in bbox], text, prob))
+        return results
+
+    def metrics(self) -> Dict[str, Any]:
+        st = dict(self.stats)
+        st["avg_ms"] = round(st.pop("total_ms") / st["calls"], 3) if st["calls"] else None
+        return st
+
+
+class DnnOcr:
+    """
+    cv2.dnn 的文字偵測 (DB) + 辨識 (CRNN, CTC) backend: 從本機 models 目錄載入小型 (可為 int8 量化) ONNX 模型,
+    不需要 torch; 模型在第一次辨識時才載入。檔名可由設定覆寫, 未指定時優先使用 *_int8.onnx。
+    """
+
+    incremental = True   # 支援只對已知文字框做 recognize
+    DEFAULT_DETECTORS = ("text_detection_DB_IC15_resnet18_2021sep_int8.onnx", "text_detection_DB_IC15_resnet18_2021sep.onnx",
+                         "text_detection_DB_TD500_resnet18_2021sep.onnx")
+    DEFAULT_RECOGNIZERS = ("text_recognition_CRNN_EN_2021sep_int8.onnx", "text_recognition_CRNN_EN_2021sep.onnx")
+    DEFAULT_VOCABULARIES = ("charset_36_EN.txt", "alphabet_36.txt")
+
+    def __init__(self, model_dir: str, detector: Optional[str] = None, recognizer: Optional[str] = None,
+                 vocabulary: Optional[str] = None, rgb: bool = False, max_side: int = 736,
+                 binary_threshold: float = 0.3, polygon_threshold: float = 0.5):
+        self.model_dir = model_dir
+        self.files = {"detector": detector, "recognizer": recognizer, "vocabulary": vocabulary}
+        self.rgb = rgb                 # CRNN_EN 以灰階輸入; 94 字元的 CRNN_CS 需設為 true
+        self.max_side = max_side       # 偵測輸入的最長邊, 超過時縮小
+        self.binary_threshold = binary_threshold
+        self.polygon_threshold = polygon_threshold
+        self._detector = None
+        self._recognizer = None
+        self._lock = threading.Lock()  # cv2.dnn 模型不保證 thread-safe
+        self.stats = {"load_ms": None, "calls": 0, "detect_ms": 0.0, "recognize_ms": 0.0, "boxes": 0}
+
+    def _resolve(self, kind: str, candidates: Tuple[str, ...]) -> str:
+        name = self.files[kind]
+        for candidate in ([name] if name else list(candidates)):
+            path = os.path.join(self.model_dir, candidate)
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"dnn OCR {kind} not found in {self.model_dir} (tried: {name or ', '.join(candidates)})")
+
+    def _load(self):
+        if self._recognizer is not None:
+            return
+        t0 = time.perf_counter()
+        detector = cv2.dnn.TextDetectionModel_DB(self._resolve("detector", self.DEFAULT_DETECTORS))
+        detector.setBinaryThreshold(self.binary_threshold)
+        detector.setPolygonThreshold(self.polygon_threshold)
+        detector.setMaxCandidates(200)
+        detector.setUnclipRatio(2.0)
+        recognizer = cv2.dnn.TextRecognitionModel(self._resolve("recognizer", self.DEFAULT_RECOGNIZERS))
+        with open(self._resolve("vocabulary", self.DEFAULT_VOCABULARIES), "r", encoding="utf-8") as f:
+            recognizer.setVocabulary([line.rstrip("\n") for line in f if line.rstrip("\n")])
+        recognizer.setDecodeType("CTC-greedy")
+        recognizer.setInputParams(1.0 / 127.5, (100, 32), (127.5, 127.5, 127.5))
+        self._detector, self._recognizer = detector, recognizer
+        self.stats["load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        logger.info(f"🔤 [DNN OCR] models loaded in {self.stats['load_ms']} ms ({self.model_dir})")
+
+    def _detect_boxes(self, bgr: np.ndarray) -> List[Tuple[np.ndarray, float]]:
+        """DB 偵測: 輸入尺寸需為 32 的倍數, 先縮小到 max_side 以內再補邊 (不改變字的比例)"""
+        h, w = bgr.shape[:2]
+        ratio = min(1.0, self.max_side / max(h, w))
+        img = cv2.resize(bgr, (max(1, int(w * ratio)), max(1, int(h * ratio)))) if ratio < 1.0 else bgr
+        ih, iw = img.shape[:2]
+        ph, pw = -ih % 32, -iw % 32
+        if ph or pw:
+            img = cv2.copyMakeBorder(img, 0, ph, 0, pw, cv2.BORDER_REPLICATE)
+        self._detector.setInputParams(1.0 / 255, (img.shape[1], img.shape[0]), (122.67891434, 116.66876762, 104.00698793))
+        quads, confidences = self._detector.detect(img)
+        return [(np.asarray(q, np.float32) / ratio, float(c)) for q, c in zip(quads, confidences)]
+
+    def _recognize_quad(self, src: np.ndarray, quad: np.ndarray) -> str:
+        # 四邊形拉正成 100x32 再辨識; DB 的點順序為 左下、左上、右上、右下
+        target = np.float32([[0, 31], [0, 0], [99, 0], [99, 31]])
+        crop = cv2.warpPerspective(src, cv2.getPerspectiveTransform(quad.astype(np.float32), target), (100, 32))
+        return self._recognizer.recognize(crop)
+
+    @staticmethod
+    def _bbox(quad: np.ndarray) -> List[List[float]]:
+        x0, y0 = float(quad[:, 0].min()), float(quad[:, 1].min())
+        x1, y1 = float(quad[:, 0].max()), float(quad[:, 1].max())
+        return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+    def _source(self, rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        bgr = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2BGR)
+        return bgr, (bgr if self.rgb else cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+
+    def readtext(self, rgb: np.ndarray, **kwargs) -> List[Tuple[List[List[float]], str, float]]:
+        with self._lock:
+            self._load()
+            bgr, src = self._source(rgb)
+            t0 = time.perf_counter()
+            boxes = self._detect_boxes(bgr)
+            t1 = time.perf_counter()
+            results = []
+            for quad, conf in boxes:
+                text = self._recognize_quad(src, quad)
+                if text:
+                    results.append((self._bbox(quad), text, conf))
+            self._record(t1 - t0, time.perf_counter() - t1, len(boxes))
+            return results
+
+    def recognize(self, rgb: np.ndarray, boxes: List[Tuple[int, int, int, int]], **kwargs) -> List[Tuple[List[List[float]], str, float]]:
+        """已知的水平文字框 (x_min, x_max, y_min, y_max) 直接辨識, 跳過 DB 偵測"""
+        with self._lock:
+            self._load()
+            _, src = self._source(rgb)
+            t0 = time.perf_counter()
+            results = []
+            for x0, x1, y0, y1 in boxes:
+                quad = np.float32([[x0, y1], [x0, y0], [x1, y0], [x1, y1]])
+                text = self._recognize_quad(src, quad)
+                if text:
+                    results.append((self._bbox(quad), text, 1.0))
+            self._record(0.0, time.perf_counter() - t0, len(boxes))
+            return results
+
+    def _record(self, detect_s: float, recognize_s: float, boxes: int):
+        st = self.stats
+        st["calls"] += 1
+        st["detect_ms"] += detect_s * 1000
+        st["recognize_ms"] += recognize_s * 1000
+        st["boxes"] += boxes
+
+    def metrics(self) -> Dict[str, Any]:
+        st = dict(self.stats)
+        calls = st["calls"]
+        st["avg_detect_ms"] = round(st.pop("detect_ms") / calls, 2) if calls else None
+        st["avg_recognize_ms"] = round(st.pop("recognize_ms") / calls, 2) if calls else None
+        return st
+
+
+class OcrClient:
+    """
+    engine 端的 OCR 連線: 第一次呼叫 readtext 才連線, 連不上時啟動一個 detached worker process
+    (同一個檔案以 --ocr-worker 執行)。同一 process 內的多個 engine 透過 OcrClient.shared() 共用連線。
+    POSIX 上連線走 session 目錄 (0700) 內的 AF_UNIX socket, 其他平台走 127.0.0.1:port;
+    authkey 每次 worker 啟動隨機產生, 從 session 目錄的 0600 檔案讀取。
+    """
+
+    incremental = True
+    _instances: Dict[tuple, "OcrClient"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 47631, session_dir: Optional[str] = None,
+                 model_dir: Optional[str] = None, languages: Optional[List[str]] = None, gpu: bool = False,
+                 idle_timeout: float = 600.0, start_timeout: float = 15.0, call_timeout: float = 120.0):
+        self.session_dir = _ocr_session_dir(session_dir)
+        self.address = _ocr_address(self.session_dir, host, port)
+        self.key_path = _ocr_key_path(self.session_dir, self.address)
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.model_dir = model_dir or os.path.join(base_dir, "models", "easyocr")
+        self.languages = list(languages or ["en"])
+        self.gpu = gpu
+        self.idle_timeout = idle_timeout
+        self.start_timeout = start_timeout
+        self.call_timeout = call_timeout
+        self._conn = None
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._lock = threading.Lock()
+        self.metrics = {
+            "spawned": False, "worker_pid": None, "connect_ms": None, "cold_start_ms": None, "model_load_ms": None,
+            "calls": 0, "errors": 0, "total_call_ms": 0.0, "total_infer_ms": 0.0, "last_call_ms": None,
+        }
+
+    @classmethod
+    def shared(cls, **options) -> "OcrClient":
+        key = (options.get("host", "127.0.0.1"), int(options.get("port", 47631)), options.get("session_dir"))
+        with cls._instances_lock:
+            client = cls._instances.get(key)
+            if client is None:
+                client = cls._instances[key] = cls(**options)
+                atexit.register(client.close)
+            return client
+
+    def _spawn_worker(self):
+        where = ["--socket", self.address] if isinstance(self.address, str) else \
+            ["--host", self.address[0], "--port", str(self.address[1])]
+        cmd = [sys.executable, os.path.abspath(__file__), "--ocr-worker", *where,
+               "--key-file", self.key_path,
+               "--model-dir", self.model_dir, "--languages", ",".join(self.languages),
+               "--idle-timeout", str(self.idle_timeout)] + (["--gpu"] if self.gpu else [])
+        kwargs: Dict[str, Any] = {"stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        subprocess.Popen(cmd, **kwargs)
+        self.metrics["spawned"] = True
+        logger.info(f"🔤 [OCR] starting worker process on {self.address}")
+
+    def _connect(self):
+        from multiprocessing.connection import Client, AuthenticationError
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + self.start_timeout
+        spawned = False
+        while True:
+            try:
+                # worker bind 成功後才寫 key 檔; 讀不到 key 或 key 已被新 worker 換掉時重試
+                authkey = _read_ocr_key(self.key_path)
+                if authkey is None:
+                    raise FileNotFoundError(self.key_path)
+                self._conn = Client(self.address, authkey=authkey)
+                break
+            except AuthenticationError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"OCR worker at {self.address} rejected the session key")
+                time.sleep(0.1)
+            except (ConnectionRefusedError, FileNotFoundError, OSError):
+                if not spawned:
+                    self._spawn_worker()
+                    spawned = True
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"OCR worker did not start within {self.start_timeout}s")
+                time.sleep(0.1)
+        self._conn.send({"op": "ping"})
+        info = self._conn.recv()
+        self.metrics["connect_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        self.metrics["worker_pid"] = info.get("pid")
+        state = "warm" if info.get("loaded") else "model not loaded yet"
+        logger.info(f"🔤 [OCR] connected to worker pid {info.get('pid')} in {self.metrics['connect_ms']} ms ({state})")
+
+    def _buffer(self, nbytes: int) -> shared_memory.SharedMemory:
+        if self._shm is None or self._shm.size < nbytes:
+            if self._shm is not None:
+                self._request({"op": "release", "shm": self._shm.name})
+                self._shm.close()
+                self._shm.unlink()
+            self._shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 4 * 1024 * 1024))
+        return self._shm
+
+    def _request(self, msg: Dict) -> Dict:
+        self._conn.send(msg)
+        if not self._conn.poll(self.call_timeout):
+            raise TimeoutError(f"OCR worker did not answer within {self.call_timeout}s")
+        reply = self._conn.recv()
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "OCR worker error"))
+        return reply
+
+    def readtext(self, rgb: np.ndarray, **kwargs) -> List[Tuple[List[List[float]], str, float]]:
+        """與 easyocr.Reader.readtext 相同的 (bbox, text, prob) 清單, 座標相對於傳入的影像"""
+        return self._call({"op": "readtext", "kwargs": kwargs}, rgb)
+
+    def recognize(self, rgb: np.ndarray, boxes: List[Tuple[int, int, int, int]], **kwargs) -> List[Tuple[List[List[float]], str, float]]:
+        """只對已知文字框 (x_min, x_max, y_min, y_max) 做辨識, 不跑文字偵測"""
+        return self._call({"op": "recognize", "boxes": [list(b) for b in boxes], "kwargs": kwargs}, rgb)
+
+    def _call(self, msg: Dict, rgb: np.ndarray) -> List[Tuple[List[List[float]], str, float]]:
+        rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                if self._conn is None:
+                    self._connect()
+                shm = self._buffer(rgb.nbytes)
+                np.ndarray(rgb.shape, dtype=np.uint8, buffer=shm.buf)[:] = rgb
+                reply = self._request(dict(msg, shm=shm.name, shape=rgb.shape))
+            except Exception:
+                self.metrics["errors"] += 1
+                self._drop_connection()
+                raise
+            call_ms = (time.perf_counter() - t0) * 1000
+            m = self.metrics
+            m["calls"] += 1
+            m["total_call_ms"] += call_ms
+            m["total_infer_ms"] += reply["infer_ms"]
+            m["last_call_ms"] = round(call_ms, 1)
+            if reply.get("load_ms") is not None:
+                m["model_load_ms"] = round(reply["load_ms"], 1)
+                m["cold_start_ms"] = round((m["connect_ms"] or 0.0) + call_ms, 1)
+                logger.info(f"🔤 [OCR] cold start: model load {m['model_load_ms']} ms, first call {call_ms:.0f} ms")
+            return reply["results"]
+
+    def _drop_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def close(self):
+        """只關閉本端連線與 shared memory; worker 保持常駐供下一次 run 使用"""
+        with self._lock:
+            self._drop_connection()
+            if self._shm is not None:
+                self._shm.close()
+                try:
+                    self._shm.unlink()
+                except FileNotFoundError:
+                    pass
+                self._shm = None
+
+    def stats(self) -> Dict[str, Any]:
+        m = dict(self.metrics)
+        calls = m.pop("calls")
+        total_call, total_infer = m.pop("total_call_ms"), m.pop("total_infer_ms")
+        m.update({
+            "calls": calls,
+            "avg_call_ms": round(total_call / calls, 1) if calls else None,
+            "avg_infer_ms": round(total_infer / calls, 1) if calls else None,
+        })
+        return m
+
+
+def _ocr_worker_main(argv: List[str]):
+    import argparse
+    parser = argparse.ArgumentParser(description="RcpAgent OCR worker")
+    parser.add_argument("--socket", default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=47631)
+    parser.add_argument("--key-file", required=True)
+    parser.add_argument("--model-dir", required=True)
+    parser.add_argument("--languages", default="en")
+    parser.add_argument("--gpu", action="store_true")
+    parser.add_argument("--idle-timeout", type=float, default=600.0)
+    args = parser.parse_args(argv)
+    address = args.socket or (args.host, args.port)
+    _OcrWorker(address, args.key_file, args.model_dir, args.languages.split(","), args.gpu, args.idle_timeout).serve_forever()
+
 
 # ==============================================================================
-# 1. Vision System (PURE IMAGE MATCHING - NO OCR)
+# 1c. Detection Telemetry (每次偵測的分數 / 耗時, 依模板彙整)
 # ==============================================================================
+class DetectionResult(tuple):
+    """
+    detect() 的結果: 仍可當作 (found, coords) 使用 (解包 / [0]),
+    另外附帶最佳分數、門檻、scale、比對路徑、ROI 大小與各階段耗時。
+    """
+
+    def __new__(cls, found: bool, coords: Optional[Tuple[int, int]], **info):
+        self = super().__new__(cls, (found, coords))
+        self.found = found
+        self.coords = coords
+        self.feature_type: Optional[str] = info.get("feature_type")
+        self.target: Optional[str] = info.get("target")
+        self.score: float = info.get("score", -1.0)
+        self.threshold: Optional[float] = info.get("threshold")
+        self.scale: Optional[float] = info.get("scale")
+        self.path: Optional[str] = info.get("path")
+        self.roi = info.get("roi")
+        self.roi_size: Optional[Tuple[int, int]] = info.get("roi_size")
+        self.capture_ms: float = info.get("capture_ms", 0.0)
+        self.preprocess_ms: float = info.get("preprocess_ms", 0.0)
+        self.match_ms: float = info.get("match_ms", 0.0)
+        self.total_ms: float = info.get("total_ms", 0.0)
+        return self
+
+    @property
+    def margin(self) -> Optional[float]:
+        """分數與門檻的差距: 負值代表差多少才會命中"""
+        if self.threshold is None or self.score is None or self.score <= -1.0:
+            return None
+        return self.score - self.threshold
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "found": self.found, "coords": self.coords, "type": self.feature_type, "target": self.target,
+            "score": round(float(self.score), 4), "threshold": self.threshold, "scale": self.scale,
+            "path": self.path, "roi": self.roi, "roi_size": self.roi_size,
+            "capture_ms": round(self.capture_ms, 3), "preprocess_ms": round(self.preprocess_ms, 3),
+            "match_ms": round(self.match_ms, 3), "total_ms": round(self.total_ms, 3),
+        }
+
+
+class DetectionMetrics:
+    """
+    依 (type, 模板 / 文字) 彙整的偵測統計 registry, 供依實測資料調整 confidence 與 ROI。
+    背景偵測 (watcher / 推測偵測) 分開統計, 不影響前景偵測的 hit_rate 與 best_miss_score。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._background: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, result: DetectionResult, background: bool = False):
+        key = f"{result.feature_type}:{result.target}"
+        entries = self._background if background else self._entries
+        with self._lock:
+            e = entries.get(key)
+            if e is None:
+                e = entries[key] = {
+                    "type": result.feature_type, "target": result.target, "calls": 0, "found": 0,
+                    "threshold": None, "hit_score_sum": 0.0, "min_hit_score": None, "best_miss_score": None,
+                    "capture_ms": 0.0, "preprocess_ms": 0.0, "match_ms": 0.0, "total_ms": 0.0, "max_ms": 0.0,
+                    "paths": defaultdict(int), "scales": defaultdict(int), "roi_sizes": defaultdict(int),
+                }
+            e["calls"] += 1
+            if result.threshold is not None:
+                e["threshold"] = result.threshold
+            if result.found:
+                e["found"] += 1
+                e["hit_score_sum"] += result.score
+                e["min_hit_score"] = result.score if e["min_hit_score"] is None else min(e["min_hit_score"], result.score)
+            elif result.score > -1.0:
+                e["best_miss_score"] = result.score if e["best_miss_score"] is None else max(e["best_miss_score"], result.score)
+            for name in ("capture_ms", "preprocess_ms", "match_ms", "total_ms"):
+                e[name] += getattr(result, name)
+            e["max_ms"] = max(e["max_ms"], result.total_ms)
+            e["paths"][result.path or "none"] += 1
+            if result.scale is not None:
+                e["scales"][str(round(result.scale, 3))] += 1
+            if result.roi_size:
+                e["roi_sizes"]["x".join(map(str, result.roi_size))] += 1
+
+    def summary(self, background: bool = False) -> Dict[str, Dict[str, Any]]:
+        def r(v, n=3):
+            return round(float(v), n) if v is not None else None
+
+        out = {}
+        with self._lock:
+            for key, e in (self._background if background else self._entries).items():
+                calls = e["calls"]
+                out[key] = {
+                    "type": e["type"], "target": e["target"], "calls": calls, "found": e["found"],
+                    "hit_rate": r(e["found"] / calls, 4), "threshold": e["threshold"],
+                    "avg_hit_score": r(e["hit_score_sum"] / e["found"], 4) if e["found"] else None,
+                    "min_hit_score": r(e["min_hit_score"], 4), "best_miss_score": r(e["best_miss_score"], 4),
+                    "avg_ms": r(e["total_ms"] / calls), "max_ms": r(e["max_ms"]), "total_ms": r(e["total_ms"], 1),
+                    "avg_capture_ms": r(e["capture_ms"] / calls), "avg_preprocess_ms": r(e["preprocess_ms"] / calls),
+                    "avg_match_ms": r(e["match_ms"] / calls),
+                    "paths": dict(e["paths"]), "scales": dict(e["scales"]), "roi_sizes": dict(e["roi_sizes"]),
+                }
+        return out
+
+    def dump(self, path: str, **extra) -> str:
+        """寫出 JSON (extra 例如 vision=get_metrics()), 回傳檔案路徑"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"templates": self.summary(), "background": self.summary(background=True), **extra},
+                      f, ensure_ascii=False, indent=2, default=str)
+        return path
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._background.clear()
+
+
 class VisionSystem:
-    def __init__(self, confidence_threshold=0.8):
+    def __init__(self, confidence_threshold=0.8, template_cache_mb=64, calibration_scope="template", matcher_threads=None,
+                 color_prefilter=False, exact_match=True, ocr: Optional["OcrClient"] = None,
+                 ocr_incremental=True, glyph_ocr: Optional["GlyphOcr"] = None, dnn_ocr: Optional["DnnOcr"] = None,
+                 ocr_backend="easyocr", two_stage=True, capture_backend="pyautogui",
+                 capture_cache_dir="cache/capture"):
         self.confidence_threshold = confidence_threshold
+        # OCR 由獨立 worker process 負責, 第一次遇到 ocr feature 才連線 / 載入模型
+        self.ocr = ocr
+        # 可用的 OCR backend (feature 的 ocr_backend 可覆寫預設的 ocr_backend)
+        self.ocr_backends: Dict[str, Any] = {
+            name: b for name, b in (("easyocr", ocr), ("glyph", glyph_ocr), ("dnn", dnn_ocr)) if b is not None
+        }
+        self.ocr_backend = ocr_backend
+        self.text_stats = {"built": 0, "reused": 0}   # 每張畫面的 OCR 文字索引: 新建 / 直接沿用
+        self.incremental_ocr: Dict[str, IncrementalOcr] = {
+            name: IncrementalOcr(b) for name, b in self.ocr_backends.items() if ocr_incremental and b.incremental
+        }
+        self._text_lock = threading.Lock()
+        # 逐像素相同的 UI 元件先走 exact 快速路徑 (feature 的 exact 可覆寫), 找不到才做 correlation
+        self.exact_match = exact_match
+        # 大模板 / 大 ROI 的兩階段比對 (feature 的 two_stage 可覆寫)
+        self.two_stage = two_stage
+        self.two_stage_min_side = 16
+        self.two_stage_top_k = 3
+        self.two_stage_stats = {"count": 0, "total_ms": 0.0}
+        self.path_counts: Dict[str, int] = defaultdict(int)   # 每次偵測實際走的路徑, 例如 "exact@prior"
+        self._path_local = threading.local()
+        # 畫面穩定等待 (取代固定 sleep): budget_s 為設定的上限總和, waited_s 為實際等待
+        self.settle_stats = {"count": 0, "settled": 0, "budget_s": 0.0, "waited_s": 0.0}
+        # 每次偵測的分數 / 門檻 / 耗時, 依模板彙整 (AgentEngine.run 結束時輸出)
+        self.detection_metrics = DetectionMetrics()
+        self._telemetry_local = threading.local()
         self.MOCK_MODE = False 
         
-        self.is_calibrated = False
-        self.scale_factor = 1.0
-        self.calibration_scales = [1.0, 1.25, 1.5, 1.75, 2.0, 0.8, 0.75, 0.5]
+        self.calibration = ScaleCalibrator(scope=calibration_scope)
+        # 校正前的 coarse-to-fine 連續尺度搜尋參數
+        self.scale_range = (0.5, 2.0)
+        self.scale_step = 0.08       # coarse 階段相鄰 scale 的等比間距 (8%)
+        self.pyramid_max_side = 640  # coarse 階段畫面 (ROI) 縮小後的長邊上限
+        self.pyramid_top_k = 3
+        self.perfect_score = 0.99    # 常見縮放的比對分數達此值 (幾乎逐像素相同) 才提前結束, 其餘取分數最高者
+        self.common_scales = (0.5, 0.75, 0.8, 1.0, 1.25, 1.5, 1.75, 2.0)  # 常見 DPI 縮放, 精修時一併嘗試
+        self.scale_search_stats = {"count": 0, "total_ms": 0.0}
+        # 上次命中位置 (template, ROI) -> (x, y, w, h): 先在附近的小視窗找, 沒有才掃整個 ROI
+        self.priors: Dict[tuple, Tuple[int, int, int, int]] = {}
+        self.prior_margin = 16
+        self.prior_stats = {"hits": 0, "misses": 0, "prior_ms": 0.0, "full_count": 0, "full_ms": 0.0}
+        self.prior_by_template: Dict[str, List[int]] = defaultdict(lambda: [0, 0])   # path -> [hits, misses]
+        # 色彩預篩: 模板主要顏色在 ROI 內數量不足時直接判定不存在, 不做 correlation (feature 的 prefilter 可覆寫)
+        self.color_prefilter = color_prefilter
+        self.prefilter_min_share = 0.08     # 佔模板像素比例達此值的 bin 視為主要顏色
+        self.prefilter_tolerance = 0.5      # ROI 內至少要有預期像素數的這個比例
+        self.prefilter_stats = {"checks": 0, "rejects": 0, "total_ms": 0.0, "probes": 0, "probe_hits": 0}
+        self.templates = TemplateCache(max_bytes=int(template_cache_mb * 1024 * 1024))
+        self.frames = FrameGrabber(create_capture_backend(capture_backend, capture_cache_dir))
+        self.keypoints = KeypointMatcher(self.templates)
+        self.matcher = MatcherPool(matcher_threads if matcher_threads is not None else min(4, os.cpu_count() or 1))
+
+    def tick(self, rois: Optional[List] = None):
+        """engine 每輪偵測的共用畫面範圍, 用法: with vision.tick([roi]): ..."""
+        return self.frames.tick(rois)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Vision 層的累計統計 (快取命中率等)"""
+        return {
+            "template_cache": self.templates.stats(),
+            "captures": self.frames.captures,
+            "capture": self.frames.stats(),
+            "scale_search": dict(self.scale_search_stats),
+            "two_stage": dict(self.two_stage_stats),
+            "calibration": self.calibration.stats(),
+            "spatial_prior": self._prior_metrics(),
+            "keypoints": self.keypoints.metrics(),
+            "prefilter": self._prefilter_metrics(),
+            "match_paths": dict(self.path_counts),
+            "settle": self._settle_metrics(),
+            "ocr": self._ocr_metrics(),
+        }
+
+    @property
+    def last_path(self) -> Optional[str]:
+        """目前執行緒最近一次偵測所走的路徑"""
+        return getattr(self._path_local, "last", None)
+
+    def _note_path(self, path: str):
+        self._path_local.last = path
+        self.path_counts[path] += 1
+
+    @property
+    def last_result(self) -> Optional[DetectionResult]:
+        """目前執行緒最近一次的偵測結果"""
+        return getattr(self._telemetry_local, "last", None)
+
+    def _note_detail(self, **detail):
+        """偵測過程中回報 telemetry 欄位 (threshold / scale / preprocess_ms)"""
+        current = getattr(self._telemetry_local, "detail", None)
+        if current is not None:
+            current.update(detail)
+
+    @staticmethod
+    def _best_match(screen: np.ndarray, template: np.ndarray) -> Tuple[float, Tuple[int, int]]:
+        """TM_CCOEFF_NORMED 的最高分與其左上角位置; 模板比畫面大或分數非有限值時回傳 -1"""
+        if template.shape[0] > screen.shape[0] or template.shape[1] > screen.shape[1]:
+            return -1.0, (0, 0)
+        _, max_val, _, max_loc = cv2.minMaxLoc(cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED))
+        if not np.isfinite(max_val):
+            return -1.0, (0, 0)
+        return float(max_val), max_loc
+
+    @staticmethod
+    def _find_exact(screen: np.ndarray, template: np.ndarray, anchors: int = 4, max_candidates: int = 64) -> Optional[Tuple[int, int]]:
+        """
+        逐像素完全相同的出現位置 (row-major 第一個), 找不到時回傳 None。
+        先以模板中最少見的幾個像素值做向量化篩選 (每個 anchor 掃一次畫面, 近似線性), 再逐一驗證剩下的候選位置。
+        """
+        th, tw = template.shape[:2]
+        h, w = screen.shape[:2] 
+        if th > h or tw > w:
+            return None
+        ch, cw = h - th + 1, w - tw + 1
+        flat = template.ravel()
+        rarity = np.bincount(flat, minlength=256)[flat]
+        mask = None
+        for idx in np.argsort(rarity, kind="stable")[:anchors]:
+            y, x = divmod(int(idx), tw)
+            hit = screen[y:y + ch, x:x + cw] == flat[idx]
+            mask = hit if mask is None else (mask & hit)
+        candidates = np.argwhere(mask)
+        if len(candidates) > max_candidates:
+            return None   # 重複圖樣過多 (例如大片單色), 交給 correlation
+        for y, x in candidates:
+            if np.array_equal(screen[y:y + th, x:x + tw], template):
+                return int(x), int(y)
+        return None
+
+    def two_stage_factor(self, template_shape: Tuple[int, ...], screen_shape: Tuple[int, ...]) -> Optional[float]:
+        """
+        依模板大小自動決定縮小倍率: 縮小後模板短邊約 two_stage_min_side 像素。
+        模板太小 (倍率 > 0.5) 或 ROI 沒有明顯大於模板時回傳 None (直接全解析度比對)。
+        """
+        th, tw = template_shape[:2]
+        sh, sw = screen_shape[:2]
+        f = max(0.125, self.two_stage_min_side / min(th, tw))
+        if f > 0.5 or sh < 2 * th or sw < 2 * tw:
+            return None
+        return f
+
+    def _two_stage_match(self, screen: np.ndarray, template: np.ndarray, f: float) -> Tuple[float, Tuple[int, int]]:
+        """縮小的畫面 / 模板先找 top-k 候選峰值, 再只在這些位置附近以全解析度確認"""
+        t0 = time.perf_counter()
+        th, tw = template.shape[:2]
+        small_screen = cv2.resize(screen, (max(1, round(screen.shape[1] * f)), max(1, round(screen.shape[0] * f))), interpolation=cv2.INTER_AREA)
+        small_tpl = cv2.resize(template, (max(1, round(tw * f)), max(1, round(th * f))), interpolation=cv2.INTER_AREA)
+        best_score, best_loc = -1.0, (0, 0)
+        if small_tpl.shape[0] <= small_screen.shape[0] and small_tpl.shape[1] <= small_screen.shape[1] and small_tpl.min() != small_tpl.max():
+            res = cv2.matchTemplate(small_screen, small_tpl, cv2.TM_CCOEFF_NORMED)
+            res[~np.isfinite(res)] = -1.0
+            margin = int(np.ceil(1.0 / f)) + 2
+            sup_h, sup_w = max(1, small_tpl.shape[0] // 2), max(1, small_tpl.shape[1] // 2)
+            for _ in range(self.two_stage_top_k):
+                _, peak, _, (px, py) = cv2.minMaxLoc(res)
+                if peak <= -1.0:
+                    break
+                res[max(0, py - sup_h):py + sup_h + 1, max(0, px - sup_w):px + sup_w + 1] = -1.0   # 抑制鄰近峰值
+                x0, y0 = max(0, int(px / f) - margin), max(0, int(py / f) - margin)
+                score, loc = self._best_match(screen[y0:y0 + th + 2 * margin, x0:x0 + tw + 2 * margin], template)
+                if score > best_score:
+                    best_score, best_loc = score, (x0 + loc[0], y0 + loc[1])
+        st = self.two_stage_stats
+        st["count"] += 1
+        st["total_ms"] += (time.perf_counter() - t0) * 1000
+        return best_score, best_loc
+
+    def _match(self, screen: np.ndarray, template: np.ndarray, exact: bool, two_stage: bool = False) -> Tuple[float, Tuple[int, int], str]:
+        """
+        單一尺度比對: exact 時先找逐像素相同的位置, 沒有才做 TM_CCOEFF_NORMED
+        (大模板 + 大 ROI 時走縮小後的兩階段比對); 回傳 (score, loc, 使用的方法)
+        """
+        if exact and template.dtype == np.uint8 and template.min() != template.max():
+            loc = self._find_exact(screen, template)
+            if loc is not None:
+                return 1.0, loc, "exact"
+        f = self.two_stage_factor(template.shape, screen.shape) if two_stage else None
+        if f is not None:
+            score, loc = self._two_stage_match(screen, template, f)
+            return score, loc, "two_stage"
+        score, loc = self._best_match(screen, template)
+        return score, loc, "correlation"
+
+    def _match_with_prior(self, screen: np.ndarray, template: np.ndarray, prior_key: tuple,
+                          offset: Tuple[int, int], conf: float, exact: bool = False, two_stage: bool = False) -> Tuple[float, Tuple[int, int], str]:
+        """
+        先在上次命中位置附近的小視窗比對 (以同樣的門檻確認), 未命中才退回整個 ROI。
+        回傳 (score, loc, path), path 例如 "exact@prior" / "correlation@roi"。
+        """
+        th, tw = template.shape[:2]
+        prior = self.priors.get(prior_key)
+        stats = self.prior_stats
+        if prior is not None and prior[2:] == (tw, th):
+            t0 = time.perf_counter()
+            margin = max(self.prior_margin, max(tw, th) // 4)
+            px, py = prior[0] - offset[0], prior[1] - offset[1]
+            x0, y0 = max(0, px - margin), max(0, py - margin)
+            score, loc, method = self._match(screen[y0:py + th + margin, x0:px + tw + margin], template, exact, two_stage)
+            stats["prior_ms"] += (time.perf_counter() - t0) * 1000
+            per_tpl = self.prior_by_template[prior_key[0]]
+            if score >= conf:
+                stats["hits"] += 1
+                per_tpl[0] += 1
+                return score, (x0 + loc[0], y0 + loc[1]), f"{method}@prior"
+            stats["misses"] += 1
+            per_tpl[1] += 1
+        t0 = time.perf_counter()
+        score, loc, method = self._match(screen, template, exact, two_stage)
+        stats["full_ms"] += (time.perf_counter() - t0) * 1000
+        stats["full_count"] += 1
+        return score, loc, f"{method}@roi"
 
-    def detect(self, feature: Dict, roi: Optional[Tuple[int, int, int, int]] = None) -> Tuple[bool, Optional[Tuple[int, int]]]:
+    def _roi_histogram(self, frame: Frame, roi) -> Optional[np.ndarray]:
+        view, offset = frame.view(roi, gray=False)
+        if view is None or view.size == 0:
+            return None
+        key = ((offset[0], offset[1], view.shape[1], view.shape[0]), ("hist",))
+        hist = frame._derived.get(key)
+        if hist is None:
+            hist = frame._derived[key] = color_histogram(view)
+        return hist
+
+    def _color_prefilter(self, frame: Frame, roi, path: str, scale: Optional[float]) -> bool:
+        """
+        模板的主要顏色 bin 在 ROI 內的像素數是否足夠; False 代表目標一定不在 ROI 內。
+        尚未校正 (scale=None) 時以 scale_range 下限估計預期像素數, 避免誤判。
+        """
+        t0 = time.perf_counter()
+        tpl = self.templates.get(path, 1.0, "hist")
+        roi_hist = self._roi_histogram(frame, roi)
+        ok = True
+        if tpl is not None and roi_hist is not None:
+            area = (scale if scale else self.scale_range[0]) ** 2
+            dominant = tpl >= tpl.sum() * self.prefilter_min_share
+            ok = bool(np.all(roi_hist[dominant] >= tpl[dominant] * area * self.prefilter_tolerance))
+        st = self.prefilter_stats
+        st["checks"] += 1
+        st["rejects"] += 0 if ok else 1
+        st["total_ms"] += (time.perf_counter() - t0) * 1000
+        return ok
+
+    def _probe_points(self, feature: Dict) -> Tuple[List[Tuple[int, int, Optional[Tuple[int, int, int]]]], Optional[Tuple[int, int]]]:
+        """
+        pixel_probe 的取樣點: [[x, y], [x, y, [r, g, b]], ...], 座標相對於模板左上角 (小於等於 1 的小數代表比例)。
+        未指定顏色時從模板同位置取色; 未指定 probes 時取模板中心與四個 1/4 點。
+        座標一律取整數像素, 模板取色與畫面取樣用同一個 (ix, iy), 避免兩邊四捨五入不一致而差一格。
+        """
+        path = feature.get("path")
+        tpl = self.templates.get(path, 1.0, "rgb") if path else None
+        size = (tpl.shape[1], tpl.shape[0]) if tpl is not None else None
+        raw = feature.get("probes") or [[0.5, 0.5], [0.25, 0.25], [0.75, 0.25], [0.25, 0.75], [0.75, 0.75]]
+        points = []
+        for probe in raw:
+            x, y = float(probe[0]), float(probe[1])
+            if size and isinstance(probe[0], float) and x <= 1.0 and y <= 1.0:
+                x, y = x * (size[0] - 1), y * (size[1] - 1)
+            ix, iy = int(x), int(y)
+            color = tuple(int(c) for c in probe[2]) if len(probe) > 2 else None
+            if color is None:
+                if tpl is None:
+                    raise ValueError("pixel_probe needs 'path' or an explicit color for every probe")
+                color = tuple(int(c) for c in tpl[iy, ix])
+            points.append((ix, iy, color))
+        return points, size
+
+    def _detect_pixel_probe(self, feature: Dict, roi, background: bool = False) -> Tuple[bool, Optional[Tuple[int, int]], float]:
+        """
+        以少數像素顏色確認簡單的狀態指示燈, 完全不做 correlation。
+        模板位置: 上次在此 ROI 命中的位置 (image 或 pixel_probe 皆可); 還沒有時先用 image 比對定位一次。
+        沒有 path 時 probes 必須是相對 ROI 左上角 (或螢幕原點) 的絕對像素座標並附上顏色。
+        background=True 時不寫入 priors, 定位結果只用於這一次。
+        """
+        path = feature.get("path")
+        points, size = self._probe_points(feature)
+        tolerance = feature.get("tolerance", 24)
+        prior = self.priors.get((path, roi)) if path else None
+        scale = self.calibration.guess(path) if path else 1.0
+        if path and prior is None:
+            logger.info("      🔎 Pixel probe has no known position yet, locating template first")
+            locate = {"type": "image", "path": path, "confidence": feature.get("locate_confidence", self.confidence_threshold)}
+            found, center, _ = self._detect_feature(locate, roi, background)
+            if not found:
+                self._note_path("pixel_probe+locate")
+                logger.info("      ❌ Pixel probe target not located")
+                return False, None, 0.0
+            if background:
+                # 背景定位不會寫入 priors / calibration: 由這次命中的中心與 scale 推回模板左上角
+                scale = (getattr(self._telemetry_local, "detail", None) or {}).get("scale") or scale
+                th, tw = self.templates.get(path, scale, "gray").shape[:2]
+                prior = (center[0] - tw // 2, center[1] - th // 2)
+            else:
+                prior = self.priors.get((path, roi))
+                scale = self.calibration.guess(path)
+        if prior is not None:
+            origin = prior[:2]
+        elif roi:
+            origin = (roi[0], roi[1])
+        else:
+            origin = (0, 0)
+        screen_pts = [(origin[0] + int(round(x * scale)), origin[1] + int(round(y * scale))) for x, y, _ in points]
+        xs, ys = [p[0] for p in screen_pts], [p[1] for p in screen_pts]
+        box = (min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+        frame = self.frames.frame_for(box)
+        matched = 0
+        for (sx, sy), (_, _, color) in zip(screen_pts, points):
+            lx, ly = sx - frame.origin[0], sy - frame.origin[1]
+            if 0 <= ly < frame.rgb.shape[0] and 0 <= lx < frame.rgb.shape[1]:
+                diff = np.abs(frame.rgb[ly, lx].astype(np.int16) - np.array(color, np.int16))
+                matched += int(diff.max() <= tolerance)
+        score = matched / len(points)
+        st = self.prefilter_stats
+        st["probes"] += 1
+        self._note_path("pixel_probe")
+        self._note_detail(threshold=feature.get("min_ratio", 1.0), scale=scale)
+        if score >= feature.get("min_ratio", 1.0):
+            st["probe_hits"] += 1
+            if size:
+                center = (int(origin[0] + size[0] * scale / 2), int(origin[1] + size[1] * scale / 2))
+                if path and not background:
+                    self.priors[(path, roi)] = (origin[0], origin[1], int(size[0] * scale), int(size[1] * scale))
+            else:
+                center = (int(sum(xs) / len(xs)), int(sum(ys) / len(ys)))
+            logger.info(f"      ✅ Pixel probe matched at {center} ({matched}/{len(points)} probes)")
+            return True, center, score
+        logger.info(f"      ❌ Pixel probe mismatch ({matched}/{len(points)} probes)")
+        return False, None, score
+
+    def _ocr_metrics(self) -> Optional[Dict[str, Any]]:
+        if not self.ocr_backends:
+            return None
+        metrics: Dict[str, Any] = {"backend": self.ocr_backend, "text_index": dict(self.text_stats)}
+        for name, backend in self.ocr_backends.items():
+            metrics[name] = backend.stats() if name == "easyocr" else backend.metrics()
+        metrics["incremental"] = {name: inc.metrics() for name, inc in self.incremental_ocr.items()}
+        return metrics
+
+    def text_index(self, frame: Frame, roi, backend: Optional[str] = None) -> Optional[TextIndex]:
+        """取得涵蓋 ROI 的 OCR 結果: 同一張畫面上已有 (同 backend) 涵蓋的區域就直接沿用, 否則對 ROI 做一次 OCR 並記下來"""
+        backend = backend or self.ocr_backend
+        engine = self.ocr_backends.get(backend)
+        if engine is None:
+            raise ValueError(f"OCR backend '{backend}' is not available (configured: {sorted(self.ocr_backends)})")
+        view, offset = frame.view(roi, gray=False)
+        if view is None or view.size == 0:
+            return None
+        rect = (offset[0], offset[1], view.shape[1], view.shape[0])
+        with self._text_lock:
+            for index in frame.text_indexes:
+                if index.backend == backend and index.covers(rect):
+                    self.text_stats["reused"] += 1
+                    return index
+            if backend in self.incremental_ocr:
+                results = self.incremental_ocr[backend].read(rect, view)
+            else:
+                results = engine.readtext(view)
+            index = TextIndex(rect, results, backend)
+            frame.text_indexes.append(index)
+            self.text_stats["built"] += 1
+            return index
+
+    def _detect_ocr(self, feature: Dict, roi) -> Tuple[bool, Optional[Tuple[int, int]], float]:
+        """ROI 內是否有包含 text 的文字 (正規化後的子字串比對); confidence 為 OCR 機率下限"""
+        if not self.ocr_backends:
+            logger.error("      ❌ OCR is disabled (global_config.enable_ocr: false)")
+            return False, None, -1.0
+        try:
+            frame = self.frames.frame_for(roi)
+            index = self.text_index(frame, roi, feature.get("ocr_backend"))
+        except (ValueError, FileNotFoundError) as e:
+            logger.error(f"      ❌ Invalid OCR config: {e}")
+            return False, None, -1.0
+        except Exception as e:
+            logger.warning(f"      ⚠️ OCR Error: {e}")
+            return False, None, -1.0
+        if index is None:
+            logger.info("      ❌ ROI is outside of the screen")
+            return False, None, -1.0
+        self._note_path(f"ocr:{index.backend}")
+        self._note_detail(threshold=feature.get("confidence", 0.0))
+        clip = _clip_rect(roi, index.rect) if roi else None
+        entry, best = index.find(feature.get("text", ""), clip, feature.get("confidence", 0.0))
+        if entry:
+            logger.info(f"      ✅ Found Text '{entry['text']}' at {entry['center']} (Prob: {entry['prob']:.3f})")
+            return True, entry["center"], entry["prob"]
+        logger.info(f"      ❌ Text Not Found ({len(index.entries)} text boxes)")
+        return False, None, best
+
+    def _prefilter_metrics(self) -> Dict[str, Any]:
+        st = dict(self.prefilter_stats)
+        st["reject_rate"] = round(st["rejects"] / st["checks"], 4) if st["checks"] else None
+        st["avg_ms"] = round(st.pop("total_ms") / st["checks"], 4) if st["checks"] else None
+        return st
+
+    def _prior_metrics(self) -> Dict[str, Any]:
+        st = self.prior_stats
+        tried = st["hits"] + st["misses"]
+        avg_prior = st["prior_ms"] / tried if tried else None
+        avg_full = st["full_ms"] / st["full_count"] if st["full_count"] else None
+        return {
+            "hits": st["hits"],
+            "misses": st["misses"],
+            "hit_rate": round(st["hits"] / tried, 4) if tried else None,
+            "avg_prior_ms": round(avg_prior, 3) if avg_prior is not None else None,
+            "avg_full_ms": round(avg_full, 3) if avg_full is not None else None,
+            # 每次 prior 命中省下一次整個 ROI 的比對
+            "est_saved_ms": round(st["hits"] * (avg_full - avg_prior), 1) if avg_full is not None and avg_prior is not None else None,
+            "by_template": {k: {"hits": v[0], "misses": v[1]} for k, v in self.prior_by_template.items()},
+        }
+
+    def _quick_scales(self, screen: np.ndarray, path: str, mode: str, exact: bool,
+                      two_stage: bool, tried: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        常見 DPI 縮放逐一比對 (略過 hint 已試過的 tried), 回傳分數最高者。
+        只有 1.0x 幾乎完全相同 (>= perfect_score, 例如 exact 命中) 才提前結束, 不拿第一個過門檻的 scale。
+        """
+        lo, hi = self.scale_range
+
+        def attempt(scale: float):
+            tpl = self.templates.get(path, scale, mode)
+            if tpl is None:
+                return None
+            score, loc, _ = self._match(screen, tpl, exact and scale == 1.0, two_stage)
+            return {"scale": float(scale), "score": score, "loc": loc, "size": (tpl.shape[1], tpl.shape[0])}
+
+        skip = round(tried, 3) if tried is not None else None
+        best = attempt(1.0) if lo <= 1.0 <= hi and skip != 1.0 else None
+        if best is not None and best["score"] >= self.perfect_score:
+            return best
+        others = [cs for cs in self.common_scales if lo <= cs <= hi and cs != 1.0 and round(cs, 3) != skip]
+        for result in self.matcher.map(attempt, others):
+            if result is not None and (best is None or result["score"] > best["score"]):
+                best = result
+        return best
+
+    def _pyramid_scale_search(self, screen: np.ndarray, path: str, mode: str = "gray", conf: Optional[float] = None,
+                              exact: bool = False, two_stage: bool = False,
+                              tried: Optional[float] = None, full: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        尺度搜尋: 先比對常見 DPI 縮放, 最佳者過 conf 時只在它附近精修; 否則 coarse-to-fine:
+        在低解析度畫面上掃過整段連續 scale 區間, 再只對前 pyramid_top_k 名候選在全解析度的鄰近區域精修。
+        full=False 時只做常見縮放這一段 (完整搜尋仍在 backoff 中)。
+        回傳最佳 (而非第一個過門檻的) scale / score / loc / size 與耗時。
+        """
+        t0 = time.perf_counter()
+        base = self.templates.get(path, 1.0, mode)
+        if base is None:
+            return None
+        quick = self._quick_scales(screen, path, mode, exact, two_stage, tried)
+        if quick is not None and quick["score"] >= self.perfect_score:
+            return self._scale_search_done(quick, t0, "common scales")
+        if quick is not None and conf is not None and quick["score"] >= conf:
+            best = self._refine_scale(screen, path, mode, quick["scale"], quick["loc"], 1.0, quick)
+            return self._scale_search_done(best, t0, "common scales + refine")
+        if not full:
+            return self._scale_search_done(quick, t0, "common scales only")
+        lo, hi = self.scale_range
+        step = self.scale_step
+        bh, bw = base.shape[:2]
+        # 前處理後的影像 (edge map / 二值化) 縮小後幾乎無法比對, 只縮 gray; 倍率由畫面 (ROI) 大小決定, 長邊縮到 pyramid_max_side
+        f = 1.0 if mode != "gray" else min(1.0, max(0.25, self.pyramid_max_side / max(screen.shape[:2])))
+        small = screen if f == 1.0 else cv2.resize(screen, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+
+        def coarse_match(scale: float):
+            if f == 1.0:
+                tpl = self.templates.get(path, scale, mode)
+            else:
+                tw, th = int(bw * scale * f), int(bh * scale * f)
+                tpl = cv2.resize(base, (tw, th), interpolation=cv2.INTER_AREA) if tw >= 3 and th >= 3 else None
+            if tpl is None:
+                return None
+            score, loc = self._best_match(small, tpl)
+            return (score, scale, loc) if score > -1.0 else None
+
+        n_steps = int(np.ceil(np.log(hi / lo) / np.log1p(step)))
+        scales = sorted(set(np.round(np.geomspace(lo, hi, n_steps + 1), 3).tolist())
+                        | {cs for cs in self.common_scales if lo <= cs <= hi})
+        coarse = [c for c in self.matcher.map(coarse_match, scales) if c is not None]
+
+        picked = []
+        for score, scale, loc in sorted(coarse, reverse=True):
+            if all(abs(scale / p[1] - 1) > step * 1.5 for p in picked):
+                picked.append((score, scale, loc))
+            if len(picked) >= self.pyramid_top_k:
+                break
+
+        best = quick
+        for _, c_scale, c_loc in picked:
+            best = self._refine_scale(screen, path, mode, c_scale, c_loc, f, best)
+
+        return self._scale_search_done(best, t0, f"{len(coarse)} coarse scales")
+
+    def _refine_scale(self, screen: np.ndarray, path: str, mode: str, c_scale: float, c_loc: Tuple[int, int],
+                      f: float, best: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """在候選 (c_scale, c_loc; 座標為縮小 f 倍後) 附近的全解析度小視窗內細調 scale, 回傳較佳者"""
+        step = self.scale_step
+        fine = set(np.round(c_scale * (1 + step * np.array([-0.5, -0.25, 0.0, 0.25, 0.5])), 3).tolist())
+        fine.update(cs for cs in self.common_scales if abs(cs / c_scale - 1) <= step)
+        for scale in sorted(fine):
+            tpl = self.templates.get(path, float(scale), mode)
+            if tpl is None:
+                continue
+            th, tw = tpl.shape[:2]
+            margin = int(2 / f + max(th, tw) * step) + 2
+            cx, cy = int(c_loc[0] / f), int(c_loc[1] / f)
+            x0, y0 = max(0, cx - margin), max(0, cy - margin)
+            win = screen[y0:cy + th + margin, x0:cx + tw + margin]
+            score, loc = self._best_match(win, tpl)
+            if score > -1.0 and (best is None or score > best["score"]):
+                best = {"scale": float(scale), "score": score, "loc": (x0 + loc[0], y0 + loc[1]), "size": (tw, th)}
+        return best
+
+    def _scale_search_done(self, best: Optional[Dict[str, Any]], t0: float, how: str) -> Optional[Dict[str, Any]]:
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        self.scale_search_stats["count"] += 1
+        self.scale_search_stats["total_ms"] += elapsed_ms
+        if best is None:
+            logger.info(f"      🔭 [Scale Search] no candidate ({how}, {elapsed_ms:.1f} ms)")
+            return None
+        best["elapsed_ms"] = elapsed_ms
+        logger.info(f"      🔭 [Scale Search] best {best['scale']}x (score {best['score']:.3f}, {how}) in {elapsed_ms:.1f} ms")
+        return best
+
+    def roi_signature(self, roi: Optional[Tuple[int, int, int, int]], factor: int = 4) -> Optional[np.ndarray]:
+        """ROI 的縮小灰階影像 (預設 1/4), 用於便宜的畫面變化偵測; 共用當前 tick 的畫面"""
+        view, _ = self.frames.frame_for(roi).view(roi)
+        if view is None or view.size == 0:
+            return None
+        h, w = view.shape[:2]
+        return cv2.resize(view, (max(1, w // factor), max(1, h // factor)), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def pixel_diff(a: Optional[np.ndarray], b: Optional[np.ndarray], tile: int = 8, noise: int = 16) -> float:
+        """
+        兩張縮圖的變化量 (0~1): 每個 tile 內變動像素比例的最大值。
+        取最大值而非全圖平均, 大 ROI 中只有一個按鈕變色時也能被偵測到。
+        """
+        if a is None or b is None or a.shape != b.shape:
+            return 1.0
+        changed = (cv2.absdiff(a, b) > noise).astype(np.float32)
+        h, w = changed.shape[:2]
+        if h < tile or w < tile:
+            return float(changed.mean())
+        tiles = cv2.resize(changed, (max(1, w // tile), max(1, h // tile)), interpolation=cv2.INTER_AREA)
+        return float(tiles.max())
+
+    def wait_settle(self, roi: Optional[Tuple[int, int, int, int]], max_wait: float, stable_frames: int = 3,
+                    interval: float = 0.03, tolerance: float = 0.01, require_change: bool = False) -> bool:
+        """
+        等待 ROI 畫面穩定: 連續 stable_frames 張縮圖沒有變化 (pixel_diff <= tolerance) 就回傳 True,
+        max_wait 秒內未穩定則等滿並回傳 False。require_change=True 時必須先看到變化才算穩定
+        (等待 UI 回應用), 畫面一直不動就等滿 max_wait。
+        """
+        start = time.time()
+        deadline = start + max_wait
+        previous, stable, changed, settled = None, 0, False, False
+        while True:
+            with self.frames.tick([roi]):
+                signature = self.roi_signature(roi)
+            if previous is not None and self.pixel_diff(previous, signature) > tolerance:
+                stable, changed = 1, True
+            else:
+                stable += 1
+            previous = signature
+            if stable >= stable_frames and (changed or not require_change):
+                settled = True
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+        st = self.settle_stats
+        st["count"] += 1
+        st["settled"] += int(settled)
+        st["budget_s"] += max_wait
+        st["waited_s"] += time.time() - start
+        return settled
+
+    def _settle_metrics(self) -> Dict[str, Any]:
+        st = self.settle_stats
+        return {
+            "count": st["count"],
+            "settled": st["settled"],
+            "avg_wait_ms": round(st["waited_s"] * 1000 / st["count"], 1) if st["count"] else None,
+            "saved_s": round(max(0.0, st["budget_s"] - st["waited_s"]), 2),
+        }
+
+    def detect(self, feature: Dict, roi: Optional[Tuple[int, int, int, int]] = None,
+               background: bool = False) -> DetectionResult:
+        """回傳 DetectionResult, 可直接解包為 (found, coords); background=True 的結果另外統計"""
+        return self._detect(feature, roi, background)
+
+    def detect_batch(self, items: List[Tuple[Dict, Any]], mode: str = "first",
+                     background: bool = False) -> Tuple[bool, Optional[Tuple[int, int]], int]:
+        """
+        平行偵測多個 (feature, roi), 共用同一張畫面。
+        mode="first": 依 YAML 順序回傳第一個命中的項目 (與逐一偵測的語意相同);
+        mode="best":  全部比對完後回傳分數最高的命中項目。
+        background=True: watcher / 推測偵測等背景呼叫, telemetry 記在 background 區。
+        回傳 (found, coords, index), 未命中時 index = -1。
+        """
+        if mode not in ("first", "best"):
+            raise ValueError(f"Unknown match mode: {mode}")
+        if not items:
+            return False, None, -1
+        if len(items) == 1 or not self.matcher.parallel:
+            frame = None
+        else:
+            # 在呼叫端的 tick 內先取得涵蓋所有 ROI 的畫面, 再交給 worker 共用
+            with self.frames.tick([roi for _, roi in items]):
+                frame = self.frames.frame_for(_union_rect([roi for _, roi in items]))
+
+        def run(feature, roi):
+            with self.frames.tick(frame=frame):
+                return self._detect(feature, roi, background)
+
+        if frame is None:
+            # 循序 (lazy): first 模式命中後不再比對後面的 feature
+            futures = []
+            results = (self._detect(feature, roi, background) for feature, roi in items)
+        else:
+            futures = [self.matcher.submit(run, feature, roi) for feature, roi in items]
+            results = (future.result() for future in futures)
+
+        best = (False, None, -1, -np.inf)
+        for idx, result in enumerate(results):
+            found, coords = result
+            if found and mode == "first":
+                for rest in futures[idx + 1:]:
+                    rest.cancel()
+                return True, coords, idx
+            if found and result.score > best[3]:
+                best = (True, coords, idx, result.score)
+        return best[:3]
+
+    def detect_any(self, features: List[Dict], roi: Optional[Tuple[int, int, int, int]] = None, mode: str = "first",
+                   background: bool = False) -> Tuple[bool, Optional[Tuple[int, int]], int]:
+        """同一個 ROI 內的多個 target_features 任一命中即可"""
+        return self.detect_batch([(f, roi) for f in features], mode=mode, background=background)
+
+    def _detect(self, feature: Dict, roi: Optional[Tuple[int, int, int, int]] = None,
+                background: bool = False) -> DetectionResult:
+        """執行一次偵測並記錄 telemetry: 擷取 / 前處理 / 比對耗時與分數, 彙整到 detection_metrics"""
+        st = self._telemetry_local
+        st.detail = detail = {}
+        self._path_local.last = None
+        capture_before = self.frames.thread_capture_ms
+        t0 = time.perf_counter()
+        try:
+            found, coords, score = self._detect_feature(feature, roi, background)
+        finally:
+            st.detail = None
+        total_ms = (time.perf_counter() - t0) * 1000
+        capture_ms = self.frames.thread_capture_ms - capture_before
+        preprocess_ms = detail.get("preprocess_ms", 0.0)
+        if roi:
+            roi_size = (int(roi[2]), int(roi[3]))
+        else:
+            roi_size = tuple(int(v) for v in self.frames.screen_size())
+        result = DetectionResult(
+            found, coords,
+            feature_type=feature.get("type"),
+            target=feature.get("path") or feature.get("text") or "unknown",
+            score=float(score), threshold=detail.get("threshold"), scale=detail.get("scale"),
+            path=self.last_path, roi=roi, roi_size=roi_size,
+            capture_ms=capture_ms, preprocess_ms=preprocess_ms,
+            match_ms=max(0.0, total_ms - capture_ms - preprocess_ms), total_ms=total_ms,
+        )
+        st.last = result
+        self.detection_metrics.record(result, background)
+        return result
+
+    def _detect_feature(self, feature: Dict, roi: Optional[Tuple[int, int, int, int]] = None,
+                        background: bool = False) -> Tuple[bool, Optional[Tuple[int, int]], float]:
+        """
+        detect 的實作, 另外回傳最佳比對分數 (供 best-score 模式挑選)。
+        background=True (watcher / 推測偵測): 只讀取既有的校正與上次命中位置, 不寫入 calibration / priors,
+        也不做完整尺度搜尋; 這些偵測多半發生在目標尚未出現時, 不能拿來當作前景的 miss。
+        """
         f_type = feature.get("type")
-        target_info = feature.get("path") or "unknown"
+        target_info = feature.get("path") or feature.get("text") or "unknown"
         
-        if f_type == "ocr":
-            logger.error("      ❌ FATAL: Lite engine does not support OCR features! Please update YAML to use images.")
-            return False, None
-            
-        use_edge_filter = feature.get("edge_filter", False)
-        filter_msg = " [Edge Filter Enabled]" if use_edge_filter else ""
+        try:
+            steps = Preprocessor.steps_for(feature) if f_type == "image" else ()
+        except ValueError as e:
+            logger.error(f"      ❌ Invalid feature config: {e}")
+            return False, None, -1.0
+        filter_msg = f" [Preprocess: {Preprocessor.key(steps)}]" if steps else ""
         
-        logger.info(f"   👁️ Scanning [image]: '{target_info}' in ROI: {roi}{filter_msg}")
+        logger.info(f"   👁️ Scanning [{f_type}]: '{target_info}' in ROI: {roi}{filter_msg}")
+
+        if self.MOCK_MODE: return True, (100, 100), 1.0
+
+        if f_type == "ocr":
+            return self._detect_ocr(feature, roi)
+
+        if f_type == "pixel_probe":
+            try:
+                return self._detect_pixel_probe(feature, roi, background)
+            except FileNotFoundError:
+                logger.error(f"      ❌ File not found: {feature.get('path')}")
+            except (ValueError, IndexError, TypeError) as e:
+                logger.error(f"      ❌ Invalid feature config: {e}")
+            return False, None, -1.0
 
-        if self.MOCK_MODE: return True, (100, 100)
+        if f_type == "keypoints":
+            path = feature.get("path")
+            conf = feature.get("confidence", 0.5)   # RANSAC inlier 比例
+            try:
+                frame = self.frames.frame_for(roi)
+                result = self.keypoints.match(
+                    frame, roi, path,
+                    detector=str(feature.get("detector", "orb")).lower(),
+                    ratio=feature.get("ratio", 0.75),
+                    min_matches=feature.get("min_matches", 10),
+                    min_inliers=feature.get("min_inliers", 8),
+                    scale_range=tuple(feature.get("scale_range", self.scale_range)),
+                    max_anisotropy=feature.get("max_anisotropy", 1.25),
+                    min_ncc=feature.get("min_ncc", 0.5),
+                )
+                self._note_path("keypoints")
+                self._note_detail(threshold=conf, scale=result["scale"] if result else None)
+                if result and result["score"] >= conf:
+                    logger.info(f"      ✅ Found Keypoints at {result['center']} (Scale: {result['scale']}x, "
+                                f"Inliers: {result['inliers']}/{result['matches']})")
+                    return True, result["center"], result["score"]
+                logger.info("      ❌ Keypoints Not Matched")
+                return False, None, result["score"] if result else -1.0
+            except FileNotFoundError:
+                logger.error(f"      ❌ File not found: {path}")
+                return False, None, -1.0
+            except ValueError as e:
+                logger.error(f"      ❌ Invalid feature config: {e}")
+                return False, None, -1.0
+            except Exception as e:
+                logger.warning(f"      ⚠️ Vision Error: {e}")
+                return False, None, -1.0
 
         if f_type == "image":
             # 這裡收到的 path 已經是替換過變數的完整路徑了 (例如: assets/model_B/btn.png)
             path = feature.get("path")
             conf = feature.get("confidence", self.confidence_threshold)
             try:
-                if not os.path.exists(path):
-                    logger.error(f"      ❌ File not found: {path}")
-                    return False, None
+                frame = self.frames.frame_for(roi)
+                t_pre = time.perf_counter()
+                screen, (off_x, off_y) = frame.processed(roi, steps)
+                self._note_detail(threshold=conf, preprocess_ms=(time.perf_counter() - t_pre) * 1000)
+                if screen is None or screen.size == 0:
+                    logger.info("      ❌ ROI is outside of the screen")
+                    return False, None, -1.0
+                mode = Preprocessor.key(steps)
                 
-                original_img = Image.open(path)
-                scales_to_try = [self.scale_factor] if self.is_calibrated else self.calibration_scales
-                
-                screen_edges = None
-                if use_edge_filter:
-                    screen_img = pyautogui.screenshot(region=roi)
-                    screen_gray = cv2.cvtColor(np.array(screen_img), cv2.COLOR_RGB2GRAY)
-                    screen_edges = cv2.Canny(screen_gray, 50, 150)
+                entry = self.calibration.peek(path)
+                known_scale = entry.scale if entry is not None else None
+                if feature.get("prefilter", self.color_prefilter) and not self._color_prefilter(frame, roi, path, known_scale):
+                    self._note_path("prefilter")
+                    logger.info("      ❌ Image Not Found (color prefilter)")
+                    return False, None, -1.0
+
+                scale = self.calibration.guess(path)
+                search = not background and self.calibration.should_search(path)   # 完整搜尋 (受 backoff 限制)
+                quick = search or self.calibration.needs_scale(path)   # 常見縮放比對 (便宜, 未校正時每次都做)
+                score, loc, size = -1.0, (0, 0), (0, 0)
+                match_path = None
+                exact = feature.get("exact", self.exact_match)
+                # 兩階段縮小比對只用在灰階; 邊緣 / 二值化的結果縮小後會失真
+                two_stage = feature.get("two_stage", self.two_stage) and mode == "gray"
+                tried = None
+                if not quick or self.calibration.has_hint(path):
+                    # 先用已知 scale (本模板或同資料夾) 做單次比對, 命中就不必搜尋
+                    template = self.templates.get(path, scale, mode)
+                    if template is not None:
+                        size = (template.shape[1], template.shape[0])
+                        tried = scale
+                        score, loc, match_path = self._match_with_prior(screen, template, (path, roi), (off_x, off_y), conf,
+                                                                        exact and round(scale, 4) == 1.0,   # 縮放後的模板不會逐像素相同
+                                                                        two_stage)
+                    if score >= conf and known_scale is None and not background:
+                        self.calibration.searched(path, scale)
+                if quick and score < conf:
+                    result = self._pyramid_scale_search(screen, path, mode, conf, exact, two_stage, tried,
+                                                        full=search) or {"score": -1.0}
+                    kind = "scale_search" if search else "common_scales"
+                    match_path = f"{match_path}+{kind}" if match_path else kind
+                    if result["score"] >= conf:
+                        score, scale, loc, size = result["score"], result["scale"], result["loc"], result["size"]
+                        if not background:
+                            self.calibration.searched(path, scale)
+                            logger.info(f"\n      🎯 [Calibration] '{os.path.basename(path)}' scale locked at: {scale}x\n")
+                    else:
+                        score = max(score, result["score"])
+                        if search:
+                            self.calibration.searched(path, None)
+                if not background:
+                    self.calibration.record(path, score >= conf, score)
+                self._note_path(match_path or "none")
+                self._note_detail(scale=scale)
                 
-                for scale in scales_to_try:
-                    new_w = int(original_img.width * scale)
-                    new_h = int(original_img.height * scale)
-                    if new_w == 0 or new_h == 0: continue
-                        
-                    resized_img = original_img.resize((new_w, new_h), Image.LANCZOS)
+                if score >= conf:
+                    if not background:
+                        self.priors[(path, roi)] = (off_x + loc[0], off_y + loc[1], size[0], size[1])
+                    center_x = off_x + loc[0] + (size[0] // 2)
+                    center_y = off_y + loc[1] + (size[1] // 2)
+                    logger.info(f"      ✅ Found Image at ({center_x}, {center_y}) (Scale: {scale}x, Score: {score:.3f}, Path: {match_path})")
+                    return True, (center_x, center_y), score
                     
-                    try:
-                        if use_edge_filter:
-                            template_gray = cv2.cvtColor(np.array(resized_img), cv2.COLOR_RGB2GRAY)
-                            template_edges = cv2.Canny(template_gray, 50, 150)
-                            if template_edges.shape[0] > screen_edges.shape[0] or template_edges.shape[1] > screen_edges.shape[1]:
-                                continue
-                                
-                            res = cv2.matchTemplate(screen_edges, template_edges, cv2.TM_CCOEFF_NORMED)
-                            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-                            
-                            if max_val >= conf:
-                                center_x = max_loc[0] + (new_w // 2)
-                                center_y = max_loc[1] + (new_h // 2)
-                                if roi:
-                                    center_x += roi[0]
-                                    center_y += roi[1]
-                                box = True
-                            else:
-                                box = False
-                        else:
-                            box = pyautogui.locateOnScreen(resized_img, region=roi, confidence=conf, grayscale=True)
-                            if box:
-                                center = pyautogui.center(box)
-                                center_x, center_y = center.x, center.y
-                                
-                        if box:
-                            if not self.is_calibrated:
-                                self.is_calibrated = True
-                                self.scale_factor = scale
-                                logger.info(f"\n      🎯 [Calibration] UI Scale Factor locked at: {scale}x\n")
-                            logger.info(f"      ✅ Found Image at ({center_x}, {center_y}) (Scale: {scale}x)")
-                            return True, (center_x, center_y)
-                            
-                    except pyautogui.ImageNotFoundException:
-                        pass
-                        
-                logger.info("      ❌ Image Not Found")
-                return False, None
+                logger.info(f"      ❌ Image Not Found (Best: {score:.3f} < {conf})")
+                return False, None, score
                 
+            except FileNotFoundError:
+                logger.error(f"      ❌ File not found: {path}")
+                return False, None, -1.0
             except Exception as e:
                 logger.warning(f"      ⚠️ Vision Error: {e}")
 
-        return False, None
+        return False, None, -1.0
+
+class _WatchRequest:
+    def __init__(self, features: List[Dict], roi, condition: str, timeout: float, match_mode: str = "first"):
+        self.features = features
+        self.match_mode = match_mode
+        self.roi = roi
+        self.condition = condition
+        self.created = time.time()
+        self.deadline = self.created + timeout
+        self.future: Future = Future()
+        self.reference = None      # 上次比對時的 ROI 縮圖 (變化觸發用)
+        self.last_match = 0.0
+
+
+class VisionWatcher:
+    """
+    背景畫面擷取執行緒: 以 fps 持續擷取全螢幕到 ring buffer, 並在每張新畫面上評估所有 wait_for() 條件。
+    條件滿足時 future 立即 resolve, 等待延遲的上限是一個 frame 間隔, 而不是 sleep + 逐一比對。
+    """
+
+    def __init__(self, vision: "VisionSystem", fps: float = 10.0, buffer_size: int = 8,
+                 pixel_diff_threshold: Optional[float] = None, recheck_interval: float = 1.0):
+        self.vision = vision
+        self.interval = 1.0 / fps
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self.pixel_diff_threshold = pixel_diff_threshold
+        self.recheck_interval = recheck_interval
+        self.frames_captured = 0
+        self.evaluations = 0
+        self.capture_ms = 0.0
+        self._requests: List[_WatchRequest] = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running: return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="VisionWatcher", daemon=True)
+        self._thread.start()
+        self.vision.frames.live_source = self.frame_after
+        logger.info(f"🛰️ Vision watcher started ({1 / self.interval:.0f} FPS)")
+
+    def stop(self):
+        if not self._thread: return
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+        if self.vision.frames.live_source == self.frame_after:
+            self.vision.frames.live_source = None
+        with self._cond:
+            for req in self._requests:
+                self._resolve(req, (False, None))
+            self._requests.clear()
+            self._cond.notify_all()
+        logger.info(f"🛰️ Vision watcher stopped ({self.frames_captured} frames, {self.evaluations} evaluations)")
+
+    def latest(self) -> Optional[Frame]:
+        with self._cond:
+            return self.buffer[-1] if self.buffer else None
+
+    def frame_after(self, since: float, timeout: Optional[float] = None) -> Optional[Frame]:
+        """回傳擷取開始時間晚於 since 的最新畫面; 最多等兩個 frame 間隔, 逾時回傳 None (由呼叫端自行截圖)"""
+        timeout = self.interval * 2 if timeout is None else timeout
+        fresh = lambda: bool(self.buffer) and self.buffer[-1].timestamp >= since
+        with self._cond:
+            self._cond.wait_for(lambda: fresh() or self._stop.is_set(), timeout)
+            return self.buffer[-1] if fresh() else None
+
+    def wait_for(self, feature, roi=None, condition: str = "appear", timeout: float = 5.0, match_mode: str = "first") -> Future:
+        """
+        訂閱一個畫面條件: feature 可為單一 feature 或 list (任一命中即算出現)。
+        Future 結果為 (satisfied, coords); 逾時為 (False, None)。
+        """
+        if condition not in ("appear", "disappear"):
+            raise ValueError(f"Unknown wait condition: {condition}")
+        features = feature if isinstance(feature, list) else [feature]
+        req = _WatchRequest(features, roi, condition, timeout, match_mode)
+        with self._cond:
+            self._requests.append(req)
+        return req.future
+
+    def _run(self):
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                frame = self.vision.frames.capture(None)
+            except Exception as e:
+                logger.warning(f"⚠️ Watcher capture failed: {e}")
+                self._stop.wait(self.interval)
+                continue
+            self.capture_ms += (time.perf_counter() - t0) * 1000
+            with self._cond:
+                self.buffer.append(frame)
+                self.frames_captured += 1
+                self._cond.notify_all()
+                requests = list(self._requests)
+            if requests:
+                self._evaluate(frame, requests)
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - t0)))
+
+    @staticmethod
+    def _resolve(req: _WatchRequest, result=None, error: Optional[BaseException] = None):
+        try:
+            if error is not None:
+                req.future.set_exception(error)
+            else:
+                req.future.set_result(result)
+        except InvalidStateError:
+            pass  # 呼叫端已 cancel
+
+    def _evaluate(self, frame: Frame, requests: List[_WatchRequest]):
+        now = time.time()
+        finished = []
+        with self.vision.frames.tick(frame=frame):
+            for req in requests:
+                if req.future.done():
+                    finished.append(req)
+                    continue
+                if now > req.deadline:
+                    self._resolve(req, (False, None))
+                    finished.append(req)
+                    continue
+                if frame.timestamp < req.created:
+                    continue
+                try:
+                    if self.pixel_diff_threshold is not None:
+                        sig = self.vision.roi_signature(req.roi)
+                        if (req.reference is not None and now - req.last_match < self.recheck_interval
+                                and self.vision.pixel_diff(req.reference, sig) < self.pixel_diff_threshold):
+                            continue
+                        req.reference = sig
+                    req.last_match = now
+                    self.evaluations += 1
+                    found, coords, _ = self.vision.detect_any(req.features, roi=req.roi, mode=req.match_mode, background=True)
+                    if found == (req.condition == "appear"):
+                        self._resolve(req, (True, coords if found else None))
+                        finished.append(req)
+                except Exception as e:
+                    self._resolve(req, error=e)
+                    finished.append(req)
+        if finished:
+            with self._cond:
+                self._requests = [r for r in self._requests if r not in finished]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "fps_target": round(1 / self.interval, 2),
+            "frames": self.frames_captured,
+            "evaluations": self.evaluations,
+            "avg_capture_ms": round(self.capture_ms / self.frames_captured, 2) if self.frames_captured else None,
+        }
+
+class _Speculation:
+    def __init__(self, key: Any, features: List[Dict], roi, match_mode: str, deadline: float):
+        self.key = key
+        self.features = features
+        self.roi = roi
+        self.match_mode = match_mode
+        self.deadline = deadline
+        self.cancelled = threading.Event()
+        self.result = None     # (found, coords, ROI 縮圖, 最後確認時間)
+
+
+class SpeculativeDetector:
+    """
+    動作送出後的 post-delay / verify 期間, 先在背景偵測下一個 state 的 target_features。
+    每個結果都記下當時畫面的 ROI 縮圖: ROI 沒變就不重新比對, 下一個 state 開始時
+    目前畫面的 ROI 與縮圖相同才直接採用命中結果, 否則照常偵測。
+    """
+
+    def __init__(self, vision: "VisionSystem", interval: float = 0.1, max_age: float = 2.0, tolerance: float = 0.02):
+        self.vision = vision
+        self.interval = interval
+        self.max_age = max_age
+        self.tolerance = tolerance
+        self._current: Optional[_Speculation] = None
+        self._lock = threading.Lock()
+        self.counts = {"started": 0, "evaluations": 0, "used": 0, "stale": 0, "missed": 0, "cancelled": 0}
+
+    def start(self, key: Any, features: List[Dict], roi, match_mode: str = "first", window: float = 5.0):
+        """開始推測 key (通常是下一個 state 的 DetectionSpec) 的偵測; 同時間只保留一個"""
+        speculation = _Speculation(key, features, roi, match_mode, time.time() + window)
+        with self._lock:
+            previous, self._current = self._current, speculation
+        if previous is not None:
+            previous.cancelled.set()
+        self.counts["started"] += 1
+        threading.Thread(target=self._run, args=(speculation,), name="SpeculativeDetector", daemon=True).start()
+
+    def pending(self, key: Any) -> bool:
+        current = self._current
+        return current is not None and current.key is key
+
+    def _run(self, sp: _Speculation):
+        while not sp.cancelled.is_set() and time.time() < sp.deadline:
+            try:
+                with self.vision.tick([sp.roi]):
+                    signature = self.vision.roi_signature(sp.roi)
+                    last = sp.result
+                    if last is not None and self.vision.pixel_diff(last[2], signature) <= self.tolerance:
+                        sp.result = (last[0], last[1], last[2], time.time())
+                    else:
+                        self.counts["evaluations"] += 1
+                        found, coords, _ = self.vision.detect_any(sp.features, roi=sp.roi, mode=sp.match_mode, background=True)
+                        sp.result = (found, coords, signature, time.time())
+            except Exception as e:
+                logger.debug(f"⚠️ Speculative detection stopped: {e}")
+                return
+            sp.cancelled.wait(self.interval)
+
+    def take(self, key: Any, signature: Optional[np.ndarray]) -> Optional[Tuple[int, int]]:
+        """取出 key 的推測命中座標; ROI 與推測時的畫面不同 / 結果過舊 / 未命中時回傳 None"""
+        with self._lock:
+            sp, self._current = self._current, None
+        if sp is None:
+            return None
+        sp.cancelled.set()
+        if sp.key is not key:
+            return None
+        result = sp.result
+        if result is None or not result[0]:
+            self.counts["missed"] += 1
+            return None
+        if time.time() - result[3] > self.max_age or self.vision.pixel_diff(result[2], signature) > self.tolerance:
+            self.counts["stale"] += 1
+            return None
+        self.counts["used"] += 1
+        return result[1]
+
+    def cancel(self, reason: Optional[str] = None) -> bool:
+        """停止目前的推測 (進入其他 state / 驗證失敗 / run 結束); 有推測被取消時回傳 True"""
+        with self._lock:
+            sp, self._current = self._current, None
+        if sp is None:
+            return False
+        sp.cancelled.set()
+        self.counts["cancelled"] += 1
+        if reason:
+            logger.info(f"   🛑 Speculative detection cancelled: {reason}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        st = dict(self.counts)
+        taken = st["used"] + st["stale"] + st["missed"]
+        st["use_rate"] = round(st["used"] / taken, 4) if taken else None
+        return st
 
 # ==============================================================================
 # 2. Screen Manager
@@ -141,11 +3419,16 @@ class ScreenManager:
                     self.mapping[key] = tuple(val)
 
     def get_roi_rect(self, roi_config: Any) -> Optional[Tuple[int, int, int, int]]:
-        w, h = self.screen_size
+        return self.roi_rect(roi_config, self.mapping, self.screen_size)
+
+    @staticmethod
+    def roi_rect(roi_config: Any, mapping: Dict, screen_size: Tuple[int, int]) -> Optional[Tuple[int, int, int, int]]:
+        """比例 ROI ([x, y, w, h] 或 roi_map 名稱) 換算成指定解析度下的像素矩形"""
+        w, h = screen_size
         if isinstance(roi_config, list) and len(roi_config) == 4:
             return (int(roi_config[0]*w), int(roi_config[1]*h), int(roi_config[2]*w), int(roi_config[3]*h))
-        if roi_config in self.mapping:
-            pct = self.mapping[roi_config]
+        if isinstance(roi_config, str) and roi_config in mapping:
+            pct = mapping[roi_config]
             return (int(pct[0]*w), int(pct[1]*h), int(pct[2]*w), int(pct[3]*h))
         return None
 
@@ -157,6 +3440,24 @@ class ActionExecutor:
         self.delay = global_config.get("action_post_delay", 0.5)
         self.vision = vision
         self.screen = screen
+        # [NEW] 固定等待改為畫面穩定偵測 (settle: false 時維持原本的 sleep)
+        self.settle = global_config.get("settle", True)
+        self.settle_frames = global_config.get("settle_frames", 3)
+        self.settle_interval = global_config.get("settle_interval", 0.03)
+        self.settle_tolerance = global_config.get("settle_tolerance", 0.01)
+
+    def _wait(self, seconds: float, roi=None):
+        """
+        等待 UI 回應: ROI 先出現變化、再連續 settle_frames 張沒有變化才提前結束; seconds 為等待上限。
+        畫面一直沒動 (UI 還沒反應) 就等滿, 不會因為靜止畫面而提早放行。
+        """
+        if seconds <= 0:
+            return
+        if not self.settle:
+            time.sleep(seconds)
+            return
+        self.vision.wait_settle(roi, seconds, stable_frames=self.settle_frames,
+                                interval=self.settle_interval, tolerance=self.settle_tolerance, require_change=True)
 
     def _move_away(self):
         """將滑鼠移開以免干擾後續辨識 (Hover 效應)"""
@@ -177,7 +3478,8 @@ class ActionExecutor:
         else: 
             pyautogui.click(x, y)
 
-    def execute(self, config: Dict, coords: Tuple[int, int], roi=None):
+    def execute(self, config: Dict, coords: Tuple[int, int], roi=None, after_input: Optional[Callable[[], None]] = None):
+        """after_input: 輸入動作送出後、post-delay 之前呼叫 (例如開始推測下一個 state 的偵測)"""
         atype = config.get("type", "wait")
         should_move_away = config.get("move_away", True)
         strategy = config.get("click_strategy", "standard")
@@ -204,7 +3506,7 @@ class ActionExecutor:
             if coords: 
                 fx, fy = coords[0] + offset[0], coords[1] + offset[1]
                 self._execute_click_strategy(fx, fy, strategy)
-                time.sleep(0.2)
+                self._wait(0.2, roi)
                 
                 if clear_first:
                     logger.info(f"   🧹 Clearing existing text (Ctrl+A -> Del)")
@@ -224,12 +3526,15 @@ class ActionExecutor:
                 
         elif atype == "click_sequence":
             base = coords
-            for step in config.get("sequence", []):
+            sequence = config.get("sequence", [])
+            for i, step in enumerate(sequence):
                 img = step.get("image")
+                txt = step.get("text")
                 off = step.get("offset", [0, 0])
                 
                 found, step_coords = False, None
                 if img: found, step_coords = self.vision.detect({"type": "image", "path": img}, roi=roi)
+                elif txt: found, step_coords = self.vision.detect({"type": "ocr", "text": txt}, roi=roi)
                 
                 target = step_coords if found else base
                 if target:
@@ -237,24 +3542,319 @@ class ActionExecutor:
                     step_strategy = step.get("click_strategy", strategy) 
                     self._execute_click_strategy(tx, ty, step_strategy)
                     base = target 
-                time.sleep(step.get("delay", 0.5))
+                # 下一步要重新找圖 / 文字時才用 settle; 否則會在同一點連點, 必須等滿 delay 以免變成雙擊
+                nxt = sequence[i + 1] if i + 1 < len(sequence) else {}
+                if nxt.get("image") or nxt.get("text"):
+                    self._wait(step.get("delay", 0.5), roi)
+                else:
+                    time.sleep(step.get("delay", 0.5))
             if should_move_away:
                 self._move_away()
                 
-        time.sleep(self.delay)
+        if after_input is not None:
+            after_input()
+        self._wait(self.delay, roi)
+
+# ==============================================================================
+# 3b. Workflow Plan (編譯後的 workflow, 依 YAML / 變數 / 解析度快取在磁碟)
+# ==============================================================================
+TERMINAL_STATES = ("end_task", "abort_task", "report_transfer_timeout")
+FEATURE_TYPES = ("image", "ocr", "pixel_probe", "keypoints")
+
+
+class RoiSpec:
+    """YAML 的 roi 設定 (roi_map 名稱或比例) 與在編譯解析度下換算好的像素矩形"""
+    __slots__ = ("config", "rect")
+
+    def __init__(self, config: Any, rect: Optional[Tuple[int, int, int, int]]):
+        self.config = config
+        self.rect = rect
+
+
+class DetectionSpec:
+    __slots__ = ("roi", "anchor", "features", "match_mode", "dummy", "raw")
+
+    def __init__(self, cfg: Dict, roi: RoiSpec):
+        self.roi = roi
+        self.anchor = cfg.get("anchor")
+        self.features: List[Dict] = cfg.get("target_features", [])
+        self.match_mode: Optional[str] = cfg.get("match_mode")
+        self.dummy = cfg.get("method") == "dummy"
+        self.raw = cfg
+
+
+class VerificationSpec:
+    __slots__ = ("roi", "anchor", "features", "match_mode", "type", "timeout", "raw")
+
+    def __init__(self, cfg: Dict, roi: RoiSpec):
+        self.roi = roi
+        self.anchor = cfg.get("anchor")
+        self.features: List[Dict] = cfg.get("target_features", [])
+        self.match_mode: Optional[str] = cfg.get("match_mode")
+        self.type = cfg.get("type", "appear")
+        self.timeout = cfg.get("timeout", 5.0)
+        self.raw = cfg
+
+
+class BranchSpec:
+    __slots__ = ("condition", "roi", "next")
+
+    def __init__(self, condition: Dict, roi: RoiSpec, next_index: int):
+        self.condition = condition
+        self.roi = roi
+        self.next = next_index
+
+
+class StateSpec:
+    """單一 state; 轉移 (on_success / error_branches / fallback) 皆為 WorkflowPlan.names 的索引"""
+    __slots__ = ("index", "name", "detection", "action", "verification", "on_success", "branches", "retry", "fallback", "raw")
+
+    def __init__(self, index: int, raw: Dict):
+        self.index = index
+        self.name: str = raw["name"]
+        self.raw = raw
+        self.action: Optional[Dict] = raw.get("action")
+        self.detection: Optional[DetectionSpec] = None
+        self.verification: Optional[VerificationSpec] = None
+        self.on_success: Optional[int] = None
+        self.branches: List[BranchSpec] = []
+        self.retry = 0
+        self.fallback: int = -1
+
+
+class HandlerSpec:
+    __slots__ = ("name", "max_triggers", "detection", "action", "raw")
+
+    def __init__(self, raw: Dict, detection: DetectionSpec):
+        self.name: str = raw["name"]
+        self.max_triggers = raw.get("max_triggers", 1)
+        self.detection = detection
+        self.action: Optional[Dict] = raw.get("action")
+        self.raw = raw
+
+
+class WorkflowPlan:
+    """
+    編譯後的 workflow: 已驗證、已替換變數、ROI 已換算成像素矩形、state 轉移改為索引。
+    以 (YAML 內容, dynamic_vars, 解析度) 為 key 快取在磁碟, 相同條件的下一次執行不必重新解析 YAML。
+    """
+    __slots__ = ("key", "source", "resolution", "config", "states", "names", "index", "handlers", "templates", "warnings")
+    VERSION = 1
+
+    def __init__(self, key: str, source: str, resolution: Tuple[int, int], config: Dict):
+        self.key = key
+        self.source = source
+        self.resolution = tuple(resolution)
+        self.config = config
+        self.states: List[StateSpec] = []
+        # names[i]: 前 len(states) 個為 state, 其後為 terminal 或 YAML 中找不到的轉移目標
+        self.names: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.handlers: List[HandlerSpec] = []
+        self.templates: List[str] = []
+        self.warnings: List[str] = []
+
+    # ---- 載入 / 快取 ----
+    @classmethod
+    def load(cls, config_path: str, dynamic_vars: Dict, resolution: Tuple[int, int],
+             resolve: Callable[[Any], Any], cache_dir: Optional[str] = "cache/plans") -> "WorkflowPlan":
+        """
+        快取內容為驗證過、已替換變數的 workflow (JSON); 載入時略過 YAML 解析與變數替換,
+        只重新連結 slotted 物件。engine 以動態模組載入, 無法使用 pickle。
+        """
+        t0 = time.perf_counter()
+        with open(config_path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha1()
+        digest.update(f"v{cls.VERSION}|{resolution[0]}x{resolution[1]}|".encode("utf-8"))
+        digest.update(json.dumps(dynamic_vars, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(raw)
+        key = digest.hexdigest()
+        cache_file = None
+        if cache_dir:
+            stem = os.path.splitext(os.path.basename(config_path))[0]
+            cache_file = os.path.join(cache_dir, f"{stem}_{key[:16]}.json")
+            cached = cls._read_cache(cache_file, key)
+            if cached is not None:
+                plan = cls.compile(cached, resolution, key=key, source=config_path, quiet=True)
+                logger.info(f"📦 Workflow plan loaded from cache ({(time.perf_counter() - t0) * 1000:.1f} ms): {cache_file}")
+                return plan
+
+        config = resolve(yaml.safe_load(raw.decode("utf-8")) or {})
+        plan = cls.compile(config, resolution, key=key, source=config_path)
+        logger.info(f"📦 Workflow compiled: {len(plan.states)} states, {len(plan.templates)} templates "
+                    f"({(time.perf_counter() - t0) * 1000:.1f} ms)")
+        if cache_file:
+            plan._write_cache(cache_file)
+        return plan
+
+    @staticmethod
+    def _read_cache(cache_file: str, key: str) -> Optional[Dict]:
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Workflow plan cache unreadable, recompiling: {e}")
+            return None
+        return cached.get("config") if cached.get("key") == key else None
+
+    def _write_cache(self, cache_file: str):
+        try:
+            os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+            tmp = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": self.key, "source": self.source, "resolution": list(self.resolution),
+                           "config": self.config}, f, ensure_ascii=False, default=str)
+            os.replace(tmp, cache_file)
+        except (OSError, TypeError) as e:
+            logger.warning(f"⚠️ Workflow plan cache save failed: {e}")
+
+    # ---- 編譯 ----
+    @classmethod
+    def compile(cls, config: Dict, resolution: Tuple[int, int], key: str = "", source: str = "",
+                quiet: bool = False) -> "WorkflowPlan":
+        """驗證並編譯; 結構錯誤 (缺少 / 重複的 state 名稱等) 拋出 ValueError, 其餘問題記在 warnings (quiet 時不重複記錄)"""
+        if not isinstance(config, dict):
+            raise ValueError("Workflow YAML 最外層必須是 mapping")
+        plan = cls(key, source, resolution, config)
+        states = config.get("states") or []
+        errors = []
+        if not isinstance(states, list):
+            raise ValueError("states 必須是 list")
+        for i, s in enumerate(states):
+            if not isinstance(s, dict) or not s.get("name"):
+                errors.append(f"states[{i}] 缺少 name")
+            elif s["name"] in plan.index:
+                errors.append(f"state 名稱重複: {s['name']}")
+            else:
+                plan.index[s["name"]] = len(plan.names)
+                plan.names.append(s["name"])
+        handlers = config.get("interrupt_handlers") or []
+        for i, h in enumerate(handlers):
+            if not isinstance(h, dict) or not h.get("name"):
+                errors.append(f"interrupt_handlers[{i}] 缺少 name")
+        if errors:
+            raise ValueError("Workflow 驗證失敗:\n  " + "\n  ".join(errors))
+
+        roi_map = {k: tuple(v) for k, v in (config.get("roi_map") or {}).items() if isinstance(v, list) and len(v) == 4}
+        templates: Dict[str, None] = {}
+        for i, raw in enumerate(states):
+            spec = StateSpec(i, raw)
+            where = f"state '{spec.name}'"
+            spec.detection = plan._detection(raw.get("detection") or {}, roi_map, templates, where)
+            if raw.get("verification"):
+                v_cfg = raw["verification"]
+                spec.verification = VerificationSpec(v_cfg, plan._roi(v_cfg.get("roi"), roi_map, where))
+                plan._features(spec.verification.features, templates, where)
+                if spec.verification.type not in ("appear", "disappear"):
+                    plan.warnings.append(f"{where}: 未知的 verification type '{spec.verification.type}'")
+            plan._action_templates(spec.action, templates)
+            transitions = raw.get("transitions") or {}
+            if "on_success" in transitions:
+                spec.on_success = plan._target(transitions["on_success"], where)
+            elif spec.name not in TERMINAL_STATES:   # 與 terminal 同名的 state 不會被執行
+                plan.warnings.append(f"{where}: 缺少 transitions.on_success")
+            fail = transitions.get("on_fail") or {}
+            spec.retry = fail.get("retry", 0)
+            spec.fallback = plan._target(fail.get("fallback", "abort_task"), where)
+            for br in fail.get("error_branches", []):
+                cond = br.get("condition") or {}
+                plan._features([cond], templates, where)
+                spec.branches.append(BranchSpec(cond, plan._roi(cond.get("roi"), roi_map, where),
+                                                plan._target(br.get("next_state"), where)))
+            plan.states.append(spec)
+        for raw in handlers:
+            where = f"handler '{raw['name']}'"
+            detection = plan._detection(raw.get("detection") or {}, roi_map, templates, where)
+            plan._action_templates(raw.get("action"), templates)
+            plan.handlers.append(HandlerSpec(raw, detection))
+        plan.templates = list(templates)
+        for w in ([] if quiet else plan.warnings):
+            logger.warning(f"⚠️ Workflow: {w}")
+        return plan
+
+    def _roi(self, roi_config: Any, roi_map: Dict, where: str) -> RoiSpec:
+        rect = ScreenManager.roi_rect(roi_config, roi_map, self.resolution)
+        if roi_config is not None and rect is None:
+            self.warnings.append(f"{where}: 未定義的 roi '{roi_config}' (改為全螢幕)")
+        return RoiSpec(roi_config, rect)
+
+    def _target(self, name: Optional[str], where: str) -> int:
+        if name is None:
+            name = "abort_task"
+        if name not in self.index:
+            if name not in TERMINAL_STATES:
+                self.warnings.append(f"{where}: 轉移目標 '{name}' 不存在")
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        return self.index[name]
+
+    def _detection(self, cfg: Dict, roi_map: Dict, templates: Dict, where: str) -> DetectionSpec:
+        spec = DetectionSpec(cfg, self._roi(cfg.get("roi"), roi_map, where))
+        self._features(spec.features, templates, where)
+        if spec.anchor:
+            self._features([spec.anchor.get("feature") or {}], templates, where)
+        return spec
+
+    def _features(self, features: List[Dict], templates: Dict, where: str):
+        for f in features:
+            if f.get("type") not in FEATURE_TYPES:
+                self.warnings.append(f"{where}: 未知的 feature type '{f.get('type')}'")
+                continue
+            if f.get("type") == "image":
+                try:
+                    Preprocessor.steps_for(f)
+                except ValueError as e:
+                    self.warnings.append(f"{where}: {e}")
+            if f.get("type") != "ocr" and f.get("path"):
+                templates[f["path"]] = None
+
+    @staticmethod
+    def _action_templates(action: Optional[Dict], templates: Dict):
+        if action and action.get("type") == "click_sequence":
+            for step in action.get("sequence", []):
+                if step.get("image"):
+                    templates[step["image"]] = None
+
+    # ---- 執行期 ----
+    def bind(self, vision: "VisionSystem") -> int:
+        """預先載入所有模板到 TemplateCache (第一次偵測不必解碼 PNG); 回傳找不到的模板數"""
+        missing = 0
+        for path in self.templates:
+            try:
+                vision.templates.get(path, 1.0, "gray")
+            except FileNotFoundError:
+                missing += 1
+                logger.warning(f"⚠️ Workflow: template not found: {path}")
+            except Exception as e:
+                logger.warning(f"⚠️ Workflow: template unreadable: {path} ({e})")
+        return missing
+
+    def state(self, index: int) -> Optional[StateSpec]:
+        return self.states[index] if 0 <= index < len(self.states) else None
+
+    def detection_spec(self, cfg: Dict, roi_map: Dict) -> DetectionSpec:
+        """工具直接傳入 detection dict 時的即時編譯 (不寫入 plan)"""
+        return DetectionSpec(cfg, RoiSpec(cfg.get("roi"), ScreenManager.roi_rect(cfg.get("roi"), roi_map, self.resolution)))
+
+    def verification_spec(self, cfg: Dict, roi_map: Dict) -> VerificationSpec:
+        return VerificationSpec(cfg, RoiSpec(cfg.get("roi"), ScreenManager.roi_rect(cfg.get("roi"), roi_map, self.resolution)))
+
 
 # ==============================================================================
 # 4. Main Engine (Lite)
 # ==============================================================================
 class AgentEngine:
-    def __init__(self, config_path: str, dynamic_vars: dict = None):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            raw_config = yaml.safe_load(f)
-            
+    def __init__(self, config_path: str, dynamic_vars: dict = None, plan_cache_dir: Optional[str] = "cache/plans"):
         self.dynamic_vars = dynamic_vars or {}
         
-        # [NEW] 在初始化最源頭，直接對整份 YAML 做全域變數替換
-        self.config = self._resolve_config_vars(raw_config)
+        # [NEW] 在初始化最源頭，直接對整份 YAML 做全域變數替換; 驗證 / ROI 像素化 / 轉移索引化後的
+        # 編譯結果依 (YAML, 變數, 解析度) 快取, 相同條件下次啟動不必重新解析
+        self.plan = WorkflowPlan.load(config_path, self.dynamic_vars, FrameGrabber.screen_size(),
+                                      self._resolve_config_vars, plan_cache_dir)
+        self.config = self.plan.config
         
         self.global_config = self.config.get("global_config", {})
         self.states_list = self.config.get("states", [])
@@ -262,14 +3862,85 @@ class AgentEngine:
         self.interrupt_handlers = self.config.get("interrupt_handlers", [])
         self.interrupt_triggers = defaultdict(int)
         
-        self.vision = VisionSystem()
+        self.vision = VisionSystem(
+            template_cache_mb=self.global_config.get("template_cache_mb", 64),
+            calibration_scope=self.global_config.get("calibration_scope", "template"),
+            matcher_threads=self.global_config.get("matcher_threads"),
+            color_prefilter=self.global_config.get("color_prefilter", False),
+            exact_match=self.global_config.get("exact_match", True),
+            ocr=self._ocr_client(),
+            ocr_incremental=self.global_config.get("ocr_incremental", True),
+            glyph_ocr=self._glyph_ocr(),
+            dnn_ocr=self._dnn_ocr(),
+            ocr_backend=self.global_config.get("ocr_backend", "easyocr"),
+            two_stage=self.global_config.get("two_stage_match", True),
+            capture_backend=self.global_config.get("capture_backend", "pyautogui"),
+            capture_cache_dir=self.global_config.get("capture_benchmark_dir", "cache/capture"),
+        )
         self.screen = ScreenManager(self.config.get("roi_map", {}))
+        self.plan.bind(self.vision)
+        self.calibration_profile = self._load_calibration_profile()
+        # [NEW] 背景畫面監看 (global_config.watcher_fps > 0 時啟用)
+        self.watcher = None
+        if self.global_config.get("watcher_fps"):
+            self.watcher = VisionWatcher(
+                self.vision,
+                fps=self.global_config["watcher_fps"],
+                buffer_size=self.global_config.get("watcher_buffer_size", 8),
+                pixel_diff_threshold=self.global_config.get("pixel_diff_threshold"),
+                recheck_interval=self.global_config.get("verify_recheck_interval", 1.0),
+            )
         # 不再需要把 dynamic_vars 傳給 Executor，因為它已經被全域替換過了
         self.executor = ActionExecutor(self.global_config, self.vision, self.screen)
+        # [NEW] 動作後的 post-delay / verify 期間, 先在背景偵測下一個 state 的目標
+        self.speculator = None
+        if self.global_config.get("speculative_detection", True):
+            self.speculator = SpeculativeDetector(
+                self.vision,
+                interval=self.global_config.get("speculative_interval", 0.1),
+                max_age=self.global_config.get("speculative_max_age", 2.0),
+                tolerance=self.global_config.get("speculative_tolerance", 0.02),
+            )
         
         self.loops = defaultdict(int)
         self.retries = defaultdict(int)
 
+    def _ocr_client(self) -> Optional[OcrClient]:
+        """同一個 process 內的 engine 共用 OCR 連線; 只有真的用到 OCR feature 時才會啟動 worker"""
+        g = self.global_config
+        if not g.get("enable_ocr", True):
+            return None
+        return OcrClient.shared(
+            port=g.get("ocr_port", 47631),
+            model_dir=g.get("ocr_model_dir"),
+            languages=g.get("ocr_languages", ["en"]),
+            gpu=g.get("ocr_gpu", False),
+            idle_timeout=g.get("ocr_idle_timeout", 600),
+        )
+
+    def _glyph_ocr(self) -> Optional[GlyphOcr]:
+        """字模 OCR: 預設讀取 <asset_dir>/glyphs (由 tools/roi_tmp_crop_tool.py 的文字樣本建立)"""
+        g = self.global_config
+        glyph_dir = g.get("glyph_dir") or os.path.join(self.dynamic_vars.get("asset_dir", "assets"), "glyphs")
+        if not g.get("enable_ocr", True) or not os.path.isdir(glyph_dir):
+            return None
+        return GlyphOcr(glyph_dir, min_score=g.get("glyph_min_score", 0.75))
+
+    def _dnn_ocr(self) -> Optional[DnnOcr]:
+        """cv2.dnn OCR: 模型放在 models/dnn_ocr (或 dnn_ocr_model_dir), 目錄不存在時不啟用"""
+        g = self.global_config
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        model_dir = g.get("dnn_ocr_model_dir") or os.path.join(base_dir, "models", "dnn_ocr")
+        if not g.get("enable_ocr", True) or not os.path.isdir(model_dir):
+            return None
+        return DnnOcr(
+            model_dir,
+            detector=g.get("dnn_ocr_detector"),
+            recognizer=g.get("dnn_ocr_recognizer"),
+            vocabulary=g.get("dnn_ocr_vocabulary"),
+            rgb=g.get("dnn_ocr_rgb", False),
+        )
+
     def _resolve_config_vars(self, data):
         """遞迴遍歷整個 Config，替換所有的 $ 變數"""
         if isinstance(data, dict):
@@ -290,6 +3961,47 @@ class AgentEngine:
             return data
         return data
 
+    def _load_calibration_profile(self) -> Optional[str]:
+        """同一個 asset_dir + 解析度 的下一次執行直接沿用上次校正的 scale, 不必重新搜尋"""
+        asset_dir = self.dynamic_vars.get("asset_dir")
+        if not asset_dir or not self.global_config.get("calibration_profile", True):
+            return None
+        profile_dir = self.global_config.get("calibration_profile_dir", "cache/calibration")
+        profile_file = ScaleCalibrator.profile_path(profile_dir, asset_dir, self.screen.screen_size)
+        self.vision.calibration.load_profile(profile_file, asset_dir)
+        return profile_file
+
+    def _save_calibration_profile(self):
+        if not self.calibration_profile: return
+        try:
+            self.vision.calibration.save_profile(self.calibration_profile, self.dynamic_vars["asset_dir"], self.screen.screen_size)
+        except OSError as e:
+            logger.warning(f"⚠️ Calibration profile save failed: {e}")
+
+    def _dump_detection_metrics(self) -> Optional[str]:
+        """輸出本次執行的 per-template 偵測統計, 並列出最耗時與差一點命中的模板"""
+        metrics_dir = self.global_config.get("detection_metrics_dir", "logs")
+        registry = self.vision.detection_metrics
+        summary = registry.summary()
+        if not metrics_dir or not summary:
+            return None
+        try:
+            path = registry.dump(os.path.join(metrics_dir, f"detection_metrics_{time.strftime('%Y%m%d_%H%M%S')}.json"),
+                                 vision=self.vision.get_metrics(),
+                                 speculation=self.speculator.stats() if self.speculator else None)
+        except OSError as e:
+            logger.warning(f"⚠️ Detection metrics dump failed: {e}")
+            return None
+        logger.info(f"📊 Detection metrics ({len(summary)} targets) -> {path}")
+        for key, m in sorted(summary.items(), key=lambda kv: -kv[1]["total_ms"])[:5]:
+            logger.info(f"   ⏱️ {key}: {m['calls']} calls, avg {m['avg_ms']} ms "
+                        f"(capture {m['avg_capture_ms']} / match {m['avg_match_ms']}), hit rate {m['hit_rate']}")
+        for key, m in summary.items():
+            best_miss, threshold = m["best_miss_score"], m["threshold"]
+            if best_miss is not None and threshold and best_miss >= threshold - 0.1:
+                logger.info(f"   🎯 {key}: closest miss {best_miss} vs threshold {threshold}")
+        return path
+
     def _save_debug(self, name, roi, return_path=False):
         try:
             fname = f"logs/debug_{time.strftime('%H%M%S')}_{name}.png"
@@ -321,6 +4033,12 @@ class AgentEngine:
         except Exception as e:
             logger.debug(f"⚠️ API Report Failed: {e}")
 
+    def _rect(self, roi: RoiSpec) -> Optional[Tuple[int, int, int, int]]:
+        """編譯時已換算好的 ROI; 解析度被改過 (例如靜態測試工具換了截圖) 時才重新換算"""
+        if self.screen.screen_size == self.plan.resolution:
+            return roi.rect
+        return self.screen.get_roi_rect(roi.config)
+
     def _resolve_anchor(self, cfg, base_roi):
         if not cfg: return base_roi
         found, coords = self.vision.detect(cfg["feature"], roi=base_roi)
@@ -331,38 +4049,45 @@ class AgentEngine:
         return base_roi
 
     def _attempt_recovery(self, state_name: str) -> bool:
-        if not self.interrupt_handlers: return False
-        for handler in self.interrupt_handlers:
-            h_name = handler["name"]
-            trigger_key = f"{state_name}_{h_name}"
-            max_t = handler.get("max_triggers", 1)
-            
-            if self.interrupt_triggers[trigger_key] >= max_t: continue
-            d_cfg = handler.get("detection", {})
-            found, coords, used_roi = self._detect_with_retry(d_cfg, f"defense_{h_name}")
-            
-            if found:
-                logger.warning(f"🚨 Defense Triggered: {h_name} ({self.interrupt_triggers[trigger_key]+1}/{max_t})")
-                if "action" in handler:
-                    self.executor.execute(handler["action"], coords or (0,0), roi=used_roi)
-                self.interrupt_triggers[trigger_key] += 1
-                return True
-        return False
+        if not self.plan.handlers: return False
+        handler_rois = [self._rect(h.detection.roi) for h in self.plan.handlers]
+        triggered = None
+        # 所有 handler 共用同一張畫面 (ROI 聯集); action 必須在 tick 外執行, 以免沿用點擊前的畫面
+        with self.vision.tick(handler_rois):
+            for handler in self.plan.handlers:
+                h_name = handler.name
+                trigger_key = f"{state_name}_{h_name}"
+                max_t = handler.max_triggers
+                
+                if self.interrupt_triggers[trigger_key] >= max_t: continue
+                found, coords, used_roi = self._detect_with_retry(handler.detection, f"defense_{h_name}")
+                if found:
+                    triggered = (handler, trigger_key, max_t, coords, used_roi)
+                    break
+
+        if not triggered: return False
+        handler, trigger_key, max_t, coords, used_roi = triggered
+        logger.warning(f"🚨 Defense Triggered: {handler.name} ({self.interrupt_triggers[trigger_key]+1}/{max_t})")
+        if handler.action is not None:
+            self.executor.execute(handler.action, coords or (0,0), roi=used_roi)
+        self.interrupt_triggers[trigger_key] += 1
+        return True
 
     def run(self, start_state: Optional[str] = None) -> dict:
         if start_state is None:
-            if not self.states_list: raise ValueError("YAML 檔案中沒有定義任何 states！")
-            start_state = self.states_list[0]["name"]
+            if not self.plan.states: raise ValueError("YAML 檔案中沒有定義任何 states！")
+            start_state = self.plan.states[0].name
 
         curr = start_state
         self._report_api_status(curr, "started", "Task initiated")
         
         try:
-            while curr not in ["end_task", "abort_task", "report_transfer_timeout"]:
+            if self.watcher: self.watcher.start()
+            while curr not in TERMINAL_STATES:
                 logger.info(f"\n📍 Entering State: [{curr}]")
                 self._report_api_status(curr, "running")
                 
-                state_def = self.states.get(curr)
+                state_def = self.plan.state(self.plan.index.get(curr, -1))
                 if not state_def:
                     logger.error(f"⛔ FATAL: State '{curr}' not found!")
                     break
@@ -372,7 +4097,7 @@ class AgentEngine:
                     logger.error(f"⛔ Infinite loop at {curr}")
                     break
 
-                curr = self._process(state_def)
+                curr = self.plan.names[self._step(state_def)]
             
             success = (curr == "end_task")
             logger.info(f"🏁 Finished. Final State: {curr}")
@@ -396,86 +4121,179 @@ class AgentEngine:
             logger.exception(f"⛔ Crash: {e}")
             self._report_api_status(curr, "error", str(e))
             return {"status": "error", "final_state": curr, "screenshot_path": None}
+        finally:
+            if self.watcher: self.watcher.stop()
+            if self.speculator: self.speculator.cancel()
+            self._save_calibration_profile()
+            self._dump_detection_metrics()
 
-    def _detect_with_retry(self, detect_cfg: Dict, state_name: str) -> Tuple[bool, Any, Any]:
-        roi_key = detect_cfg.get("roi")
-        base_roi = self.screen.get_roi_rect(roi_key)
-        detection_roi = self._resolve_anchor(detect_cfg.get("anchor"), base_roi)
-        
-        if detect_cfg.get("method") == "dummy":
-            return True, None, detection_roi
+    def _match_mode(self, cfg) -> str:
+        """多個 target_features 的挑選方式: first (YAML 順序, 預設) 或 best (最高分)"""
+        mode = cfg.match_mode if isinstance(cfg, (DetectionSpec, VerificationSpec)) else cfg.get("match_mode")
+        return mode or self.global_config.get("match_mode", "first")
+
+    def _detect_with_retry(self, detect_cfg, state_name: str) -> Tuple[bool, Any, Any]:
+        """detect_cfg 可為編譯好的 DetectionSpec 或 YAML dict (測試工具直接傳入)"""
+        spec = detect_cfg if isinstance(detect_cfg, DetectionSpec) else self.plan.detection_spec(detect_cfg, self.screen.mapping)
+        base_roi = self._rect(spec.roi)
+        if self.speculator and not self.speculator.pending(spec):
+            # 進入的不是推測中的 state (recovery / fallback / 分支): 背景偵測的結果用不到了
+            self.speculator.cancel(f"entered '{state_name}' instead of the speculated state")
+        if spec.dummy:
+            return True, None, self._resolve_anchor(spec.anchor, base_roi)
 
-        features = detect_cfg.get("target_features", [])
-        for feature in features:
-            found, coords = self.vision.detect(feature, roi=detection_roi)
+        with self.vision.tick([base_roi]):
+            if self.speculator and self.speculator.pending(spec):
+                # 與推測時的畫面相同才採用; 縮圖與後續偵測共用本 tick 的畫面
+                coords = self.speculator.take(spec, self.vision.roi_signature(base_roi))
+                if coords:
+                    logger.info(f"   ⚡ Speculative hit reused at {coords}")
+                    return True, coords, base_roi
+            detection_roi = self._resolve_anchor(spec.anchor, base_roi)
+            found, coords, _ = self.vision.detect_any(spec.features, roi=detection_roi, mode=self._match_mode(spec))
             if found:
                 return True, coords, detection_roi
         
         self._save_debug(state_name + "_detect_fail", detection_roi)
         return False, None, detection_roi
 
-    def _process(self, state):
-        d_cfg = state.get("detection", {})
-        found, coords, used_roi = self._detect_with_retry(d_cfg, state['name'])
+    def _process(self, state) -> str:
+        """執行一個 state 並回傳下一個 state 名稱; state 可為 YAML dict (engine.states) 或 StateSpec"""
+        spec = state if isinstance(state, StateSpec) else self.plan.states[self.plan.index[state["name"]]]
+        return self.plan.names[self._step(spec)]
+
+    def _step(self, state: StateSpec) -> int:
+        """偵測 -> 動作 -> 驗證, 回傳下一個 state 在 plan.names 中的索引"""
+        name = state.name
+        found, coords, used_roi = self._detect_with_retry(state.detection, name)
         
         if not found:
-            logger.warning(f"⚠️ Detection Failed for [{state['name']}]")
-            if self._attempt_recovery(state['name']): return state['name']
+            logger.warning(f"⚠️ Detection Failed for [{name}]")
+            if self._attempt_recovery(name): return state.index
             return self._handle_fail(state)
 
-        if "action" in state:
-            self.executor.execute(state["action"], coords or (0,0), roi=used_roi)
+        if state.action is not None:
+            self.executor.execute(state.action, coords or (0,0), roi=used_roi, after_input=lambda: self._speculate(state))
+        else:
+            self._speculate(state)
 
-        if "verification" in state:
-            if not self._verify(state["verification"], state['name']):
-                logger.warning(f"⚠️ Verification Failed for [{state['name']}]")
-                if self._attempt_recovery(state['name']): return state['name']
+        if state.verification is not None:
+            if not self._verify(state.verification, name):
+                logger.warning(f"⚠️ Verification Failed for [{name}]")
+                if self.speculator:
+                    self.speculator.cancel(f"verification of '{name}' failed")
+                if self._attempt_recovery(name): return state.index
                 return self._handle_fail(state)
 
-        self.retries[state['name']] = 0 
-        return state["transitions"]["on_success"]
+        self.retries[name] = 0 
+        if state.on_success is None:
+            raise KeyError(f"State '{name}' 缺少 transitions.on_success")
+        return state.on_success
 
     def _verify(self, v_cfg, name):
-        roi_key = v_cfg.get("roi")
-        base_roi = self.screen.get_roi_rect(roi_key)
-        check_roi = self._resolve_anchor(v_cfg.get("anchor"), base_roi)
-        timeout = v_cfg.get("timeout", 5.0)
-        v_type = v_cfg.get("type", "appear")
-        target_features = v_cfg.get("target_features", [])
+        spec = v_cfg if isinstance(v_cfg, VerificationSpec) else self.plan.verification_spec(v_cfg, self.screen.mapping)
+        base_roi = self._rect(spec.roi)
+        check_roi = self._resolve_anchor(spec.anchor, base_roi)
+        timeout = spec.timeout
+        v_type = spec.type
+        target_features = spec.features
+        
+        if self.watcher and self.watcher.running:
+            # 背景 watcher: 每張新畫面都會評估條件, 延遲上限為一個 frame 間隔
+            start = time.time()
+            future = self.watcher.wait_for(target_features, check_roi, v_type, timeout, self._match_mode(spec))
+            try:
+                ok, _ = future.result(timeout=timeout + 1.0)
+            except FutureTimeout:
+                future.cancel()
+                ok = False
+            if ok:
+                logger.info(f"   ✔️ Verified [{v_type}] after {time.time() - start:.2f}s (watcher)")
+                return True
+            logger.info(f"   ✖️ Verify timeout [{v_type}] (watcher)")
+            self._save_debug(name+"_verify_fail", check_roi)
+            return False
+        
+        # [NEW] 變化觸發式驗證: 只有 ROI 相對上次比對時的變化超過 pixel_diff_threshold 才重跑比對,
+        # 畫面正在變化時改用高頻輪詢; 未設定門檻時維持每 0.5 秒完整比對一次
+        diff_threshold = self.global_config.get("pixel_diff_threshold")
+        idle_interval = self.global_config.get("verify_idle_interval", 0.5 if diff_threshold is None else 0.2)
+        active_interval = self.global_config.get("verify_active_interval", 0.05)
+        recheck_interval = self.global_config.get("verify_recheck_interval", 1.0)
         
         start = time.time()
+        reference, previous, last_match = None, None, 0.0
+        polls, matches = 0, 0
         while time.time() - start < timeout:
-            found_any = False
-            for feat in target_features:
-                if self.vision.detect(feat, roi=check_roi)[0]:
-                    found_any = True
-                    break
-            
-            if v_type == "appear" and found_any: return True
-            elif v_type == "disappear" and not found_any: return True
-            time.sleep(0.5)
+            moving = False
+            with self.vision.tick([check_roi]):
+                polls += 1
+                run_match = True
+                if diff_threshold is not None:
+                    probe = self.vision.roi_signature(check_roi)
+                    moving = previous is not None and self.vision.pixel_diff(previous, probe) > 0
+                    previous = probe
+                    # 保底: 即使畫面沒動, 每 recheck_interval 秒仍重新比對一次
+                    run_match = (reference is None or time.time() - last_match >= recheck_interval
+                                 or self.vision.pixel_diff(reference, probe) >= diff_threshold)
+                    if run_match:
+                        reference = probe
+                
+                if run_match:
+                    matches += 1
+                    last_match = time.time()
+                    found_any = self.vision.detect_any(target_features, roi=check_roi, mode=self._match_mode(spec))[0]
+                    
+                    if (v_type == "appear" and found_any) or (v_type == "disappear" and not found_any):
+                        logger.info(f"   ✔️ Verified [{v_type}] after {time.time() - start:.2f}s ({matches} matches / {polls} polls)")
+                        return True
+            if diff_threshold is None or moving or not self.executor.settle:
+                time.sleep(active_interval if moving else idle_interval)
+            else:
+                # 有設 pixel_diff_threshold 才用 settle: 畫面不動時等滿 idle_interval; 有變化則在穩定後立刻重新比對
+                self.vision.wait_settle(check_roi, idle_interval, stable_frames=self.executor.settle_frames,
+                                        interval=self.executor.settle_interval,
+                                        tolerance=self.executor.settle_tolerance, require_change=True)
             
+        logger.info(f"   ✖️ Verify timeout [{v_type}] ({matches} matches / {polls} polls)")
         self._save_debug(name+"_verify_fail", check_roi)
         return False
 
-    def _handle_fail(self, state):
-        name = state['name']
-        fail = state["transitions"]["on_fail"]
-        
-        for br in fail.get("error_branches", []):
-            roi = self.screen.get_roi_rect(br["condition"].get("roi"))
-            if self.vision.detect(br["condition"], roi=roi)[0]:
-                return br['next_state']
+    def _speculate(self, state: StateSpec):
+        """在 post-delay / verify 期間先偵測 on_success state 的目標 (anchor 依賴偵測結果, 不推測)"""
+        if not self.speculator or state.on_success is None:
+            return
+        nxt = self.plan.state(state.on_success)
+        if nxt is None or nxt.detection.dummy or nxt.detection.anchor or not nxt.detection.features:
+            return
+        window = self.executor.delay + (state.verification.timeout if state.verification else 0.0) + self.speculator.max_age
+        self.speculator.start(nxt.detection, nxt.detection.features, self._rect(nxt.detection.roi),
+                              self._match_mode(nxt.detection), window)
+
+    def _handle_fail(self, state: StateSpec) -> int:
+        name = state.name
+        branches = state.branches
+        branch_rois = [self._rect(br.roi) for br in branches]
+        with self.vision.tick(branch_rois):
+            found, _, idx = self.vision.detect_batch([(br.condition, roi) for br, roi in zip(branches, branch_rois)])
+            if found:
+                return branches[idx].next
 
-        max_r = fail.get("retry", 0)
-        if self.retries[name] < max_r:
+        if self.retries[name] < state.retry:
             self.retries[name] += 1
-            return name
+            return state.index
 
-        fallback = fail.get("fallback", "abort_task")
-        return fallback
+        return state.fallback
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--ocr-worker":
+        _ocr_worker_main(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark-capture":
+        # 重新量測擷取後端並更新快取, 下次 capture_backend: auto 直接沿用
+        select_capture_backend(sys.argv[2] if len(sys.argv) > 2 else "cache/capture", rebenchmark=True)
+        sys.exit(0)
+
     yaml_file = "workflows/testing_dropdown_verify.yaml" if os.path.exists("workflows/") else "testing_dropdown_verify.yaml"
     if len(sys.argv) > 1: yaml_file = sys.argv[1]
     
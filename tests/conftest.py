@@ -0,0 +1,64 @@
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pyautogui = pytest.importorskip("pyautogui")
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENGINE_PATH = os.path.join(PROJECT_ROOT, "core", "auto_gui_engine.py")
+ASSET_DIR = os.path.join(PROJECT_ROOT, "assets", "simulator")
+
+
+def asset(name: str) -> str:
+    return os.path.join(ASSET_DIR, name)
+
+
+@pytest.fixture(scope="session")
+def engine(tmp_path_factory):
+    """與 launcher / tools 相同, 以 dynamic_engine 動態載入引擎; import 時建立的 logs/ 放在暫存目錄"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("engine"))
+    try:
+        spec = importlib.util.spec_from_file_location("dynamic_engine", ENGINE_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+class MockScreen:
+    """以 numpy 畫布取代 pyautogui.screenshot / size (引擎在呼叫時才查找這兩個函式)"""
+
+    def __init__(self, width: int = 1280, height: int = 720):
+        self.canvas = np.full((height, width, 3), 40, np.uint8)
+
+    def screenshot(self, region=None):
+        if region:
+            x, y, w, h = [int(v) for v in region]
+            return Image.fromarray(self.canvas[max(y, 0):y + h, max(x, 0):x + w].copy())
+        return Image.fromarray(self.canvas.copy())
+
+    def size(self):
+        return self.canvas.shape[1], self.canvas.shape[0]
+
+    def place(self, name: str, x: int, y: int, scale: float = 1.0):
+        img = Image.open(asset(name)).convert("RGB")
+        if scale != 1.0:
+            img = img.resize((int(img.width * scale), int(img.height * scale)), Image.LANCZOS)
+        arr = np.array(img)
+        self.canvas[y:y + arr.shape[0], x:x + arr.shape[1]] = arr
+
+    def clear(self):
+        self.canvas[:] = 40
+
+
+@pytest.fixture
+def screen(monkeypatch):
+    mock = MockScreen()
+    monkeypatch.setattr(pyautogui, "screenshot", mock.screenshot)
+    monkeypatch.setattr(pyautogui, "size", mock.size)
+    return mock
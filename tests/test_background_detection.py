@@ -0,0 +1,79 @@
+import copy
+
+from conftest import asset
+
+ROI = (100, 100, 500, 400)
+
+
+def _state(vision):
+    return copy.deepcopy(vision.calibration.stats()), dict(vision.priors)
+
+
+def test_background_miss_leaves_calibration_and_priors(engine, screen):
+    vision = engine.VisionSystem()
+    feature = {"type": "image", "path": asset("btn_open_0.png")}
+    before = _state(vision)
+
+    result = vision.detect(feature, ROI, background=True)
+
+    assert not result.found
+    assert _state(vision) == before
+    assert vision.calibration.peek(feature["path"]) is None
+
+
+def test_background_miss_does_not_delay_foreground_hit(engine, screen):
+    vision = engine.VisionSystem()
+    feature = {"type": "image", "path": asset("btn_open_0.png")}
+    vision.detect(feature, ROI, background=True)
+
+    screen.place("btn_open_0.png", 200, 200, scale=1.25)
+    result = vision.detect(feature, ROI)
+
+    assert result.found
+    assert result.scale == 1.25
+
+
+def test_background_hit_does_not_write_priors(engine, screen):
+    vision = engine.VisionSystem()
+    feature = {"type": "image", "path": asset("btn_open_0.png")}
+    screen.place("btn_open_0.png", 200, 200)
+    before = _state(vision)
+
+    result = vision.detect(feature, ROI, background=True)
+
+    assert result.found
+    assert _state(vision) == before
+
+
+def test_watcher_miss_leaves_calibration_and_priors(engine, screen):
+    vision = engine.VisionSystem()
+    watcher = engine.VisionWatcher(vision, fps=50)
+    features = [{"type": "image", "path": asset("btn_open_0.png")},
+                {"type": "pixel_probe", "path": asset("status_clamped_blue.png")}]
+    before = _state(vision)
+
+    watcher.start()
+    try:
+        found, _ = watcher.wait_for(features, ROI, "appear", timeout=0.5).result(timeout=2.0)
+    finally:
+        watcher.stop()
+
+    assert not found
+    assert watcher.evaluations > 1
+    assert _state(vision) == before
+
+
+def test_watcher_pixel_probe_locates_without_priors(engine, screen):
+    vision = engine.VisionSystem()
+    watcher = engine.VisionWatcher(vision, fps=50)
+    screen.place("status_clamped_blue.png", 301, 203)
+    feature = {"type": "pixel_probe", "path": asset("status_clamped_blue.png")}
+
+    watcher.start()
+    try:
+        found, _ = watcher.wait_for([feature], ROI, "appear", timeout=1.0).result(timeout=2.0)
+    finally:
+        watcher.stop()
+
+    assert found
+    assert vision.priors == {}
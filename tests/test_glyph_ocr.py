@@ -0,0 +1,46 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+# 比例字型: 多數樣本都有相黏的字元 (例如 "rst"、"uvwxy"), 需要在建立字模時切開
+SAMPLES = ["ABCDEFGHIJKLM", "NOPQRSTUVWXYZ", "abcdefghijklm", "nopqrstuvwxyz", "0123456789", "Go Manual Mode", "Auto Mode"]
+
+
+def render(text: str, dark: bool = True) -> np.ndarray:
+    (w, h), base = cv2.getTextSize(text, FONT, 0.6, 1)
+    img = np.full((h + base + 12, w + 16), 235 if dark else 30, np.uint8)
+    cv2.putText(img, text, (8, h + 6), FONT, 0.6, 20 if dark else 230, 1, cv2.LINE_AA)
+    return img
+
+
+@pytest.fixture
+def ocr(engine, tmp_path):
+    labels = {}
+    for i, text in enumerate(SAMPLES):
+        cv2.imwrite(str(tmp_path / f"sample_{i}.png"), render(text))
+        labels[f"sample_{i}.png"] = text
+    (tmp_path / "labels.json").write_text(json.dumps(labels), encoding="utf-8")
+    return engine.GlyphOcr(str(tmp_path))
+
+
+def read(ocr, text: str, dark: bool):
+    screen = np.full((80, 400), 235 if dark else 30, np.uint8)
+    img = render(text, dark)
+    screen[20:20 + img.shape[0], 40:40 + img.shape[1]] = img
+    return [t for _, t, _ in ocr.readtext(cv2.cvtColor(screen, cv2.COLOR_GRAY2RGB))]
+
+
+def test_atlas_splits_merged_glyphs(ocr):
+    ocr._load()
+    assert ocr.stats["samples"] == len(SAMPLES)
+    assert ocr.stats["skipped_samples"] == 0
+
+
+@pytest.mark.parametrize("dark", [True, False])
+@pytest.mark.parametrize("text", ["Go Manual Mode", "Auto Mode"])
+def test_rendered_text_round_trip(ocr, text, dark):
+    # 只讀出原文: 空白保留, 筆畫之間的底色不會在反極性中被讀成 'lll'
+    assert read(ocr, text, dark) == [text]
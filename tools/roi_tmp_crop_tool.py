@@ -4,6 +4,9 @@ import cv2
 import numpy as np
 from PIL import Image, ImageTk
 import os
+import re
+import json
+import hashlib
 
 # [NEW] 嘗試匯入 ruamel.yaml 以支援無損 YAML 讀寫 (保留註解與排版)
 try:
@@ -32,6 +35,21 @@ class ImageTask(Task):
         self.phase = phase
         self.path = path
 
+class GlyphTask(Task):
+    """OCR 文字樣本: 裁切畫面上實際顯示的文字, 供引擎的 glyph OCR backend 建立字模"""
+    def __init__(self, state_name, phase, text):
+        super().__init__('GLYPH', text, f"State: {state_name} | Phase: {phase} | Text sample")
+        self.state_name = state_name
+        self.phase = phase
+        self.text = text
+
+    @property
+    def filename(self):
+        # slug 只保留英數方便辨識; 加上文字的短 hash, 避免 "Go Manual" / "Go-Manual" 或中文標籤對到同一個檔名互相覆蓋
+        slug = re.sub(r"[^0-9A-Za-z]+", "_", self.text).strip("_") or "sample"
+        digest = hashlib.sha1(self.text.encode("utf-8")).hexdigest()[:8]
+        return f"text_{slug}_{digest}.png"
+
 class SOPSetupTool(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -169,7 +187,8 @@ class SOPSetupTool(tk.Tk):
         for name, val in roi_map.items():
             self.tasks.append(ROITask(name, val))
             
-        # 2. Parse States for Images
+        # 2. Parse States for Images (以及 OCR 文字樣本, 同一段文字只需要一張)
+        seen_texts = set()
         states = self.yaml_data.get("states", [])
         for state in states:
             s_name = state.get("name", "Unknown")
@@ -179,12 +198,23 @@ class SOPSetupTool(tk.Tk):
                     if f.get("type") == "image" and "path" in f:
                         clean_path = os.path.basename(f["path"])
                         self.tasks.append(ImageTask(s_name, phase, clean_path))
+                    elif f.get("type") == "ocr" and f.get("text"):
+                        add_glyph(phase, f["text"])
+
+            def add_glyph(phase, text):
+                if text not in seen_texts:
+                    seen_texts.add(text)
+                    self.tasks.append(GlyphTask(s_name, phase, text))
             
             det_features = state.get("detection", {}).get("target_features", [])
             extract_images(det_features, "Detection")
             
             ver_features = state.get("verification", {}).get("target_features", [])
             extract_images(ver_features, "Verification")
+
+            for step in (state.get("action") or {}).get("sequence", []) or []:
+                if step.get("text"):
+                    add_glyph("Click Sequence", step["text"])
             
             err_branches = state.get("transitions", {}).get("on_fail", {}).get("error_branches", [])
             for br in err_branches:
@@ -192,6 +222,8 @@ class SOPSetupTool(tk.Tk):
                 if cond.get("type") == "image" and "path" in cond:
                     clean_path = os.path.basename(cond["path"])
                     self.tasks.append(ImageTask(s_name, "Error Branch", clean_path))
+                elif cond.get("type") == "ocr" and cond.get("text"):
+                    add_glyph("Error Branch", cond["text"])
                     
         if self.tasks:
             self.current_task_idx = 0
@@ -218,8 +250,11 @@ class SOPSetupTool(tk.Tk):
         # Clear existing image label
         self.lbl_existing_img.config(image='', text="")
         
-        if task.task_type == 'IMAGE' and self.assets_dir:
-            full_path = os.path.join(self.assets_dir, task.name)
+        if task.task_type in ('IMAGE', 'GLYPH') and self.assets_dir:
+            if task.task_type == 'GLYPH':
+                full_path = os.path.join(self.assets_dir, "glyphs", task.filename)
+            else:
+                full_path = os.path.join(self.assets_dir, task.name)
             if os.path.exists(full_path):
                 try:
                     img = Image.open(full_path)
@@ -363,6 +398,30 @@ class SOPSetupTool(tk.Tk):
             self.update_ui()
             self.next_task()
 
+        elif task.task_type == 'GLYPH':
+            if not self.assets_dir:
+                messagebox.showerror("Error", "Please select Assets Directory first!")
+                return
+
+            # 框選範圍只包含這段文字 (單行), 引擎會依 labels.json 把每個字元切出來當字模
+            glyph_dir = os.path.join(self.assets_dir, "glyphs")
+            os.makedirs(glyph_dir, exist_ok=True)
+            save_path = os.path.join(glyph_dir, task.filename)
+            self.original_screenshot.crop((x, y, x+w, y+h)).save(save_path)
+
+            labels_path = os.path.join(glyph_dir, "labels.json")
+            labels = {}
+            if os.path.exists(labels_path):
+                with open(labels_path, 'r', encoding='utf-8') as f:
+                    labels = json.load(f)
+            labels[task.filename] = task.text
+            with open(labels_path, 'w', encoding='utf-8') as f:
+                json.dump(labels, f, indent=2, ensure_ascii=False)
+
+            messagebox.showinfo("Text Sample Saved", f"Saved text sample '{task.text}' to:\n{save_path}")
+            self.update_ui()
+            self.next_task()
+
     def _update_yaml_image_path(self, task: ImageTask, new_rel_path: str):
         states = self.yaml_data.get("states", [])
         for state in states: